@@ -1,11 +1,13 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, JSONResponse
 from sqlalchemy import inspect, text
 from sqlalchemy.orm import Session
 from utils.db import Base, engine, SessionLocal
 from utils.db_init_safe import ensure_safe_foreign_keys  # Auto-fix FK safety
+from utils.inference_executor import InferenceRejected
 import os
+import threading
 
 # =====================================================
 # Route Imports
@@ -65,6 +67,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# =====================================================
+# Backpressure (saturated inference executor → 429 / 503)
+# =====================================================
+@app.exception_handler(InferenceRejected)
+async def inference_rejected_handler(request: Request, exc: InferenceRejected):
+    return JSONResponse(
+        {"error": exc.reason, "retry_after": exc.retry_after},
+        status_code=exc.status_code,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 # =====================================================
 # Router Registration
 # =====================================================
@@ -171,6 +184,22 @@ def refresh_embedding_cache():
     except Exception as e:
         print(f"⚠️ Embedding cache refresh failed: {e}")
 
+def patch_embedding_cache(user=None, old_name: str = None):
+    """
+    Update a single user's entry (register / rename / delete) without re-reading every embedding.
+    Pass `user=None` with `old_name` to drop an entry.
+    """
+    from routes.attendance import frontend_embedding
+    if not cached_embeddings:
+        return  # not loaded yet — the next /users/embeddings request does a full load
+    if old_name:
+        cached_embeddings.pop(old_name, None)
+    if user is not None and user.embedding is not None:
+        try:
+            cached_embeddings[user.name] = frontend_embedding(user)
+        except Exception as e:
+            print(f"⚠️ Embedding cache patch failed for {user.name}: {e}")
+
 # =====================================================
 # Serve ArcFace ONNX Model + User Embeddings
 # =====================================================
@@ -204,7 +233,10 @@ def startup_event():
     - Tables exist
     - Foreign keys are safe (ON DELETE SET NULL)
     - Embeddings refreshed (for backend + frontend cache)
+    - Inference backends warmed up in the background (see /attendance/ready)
     """
+    attendance.start_warm_up()
+
     try:
         inspector = inspect(engine)
         if "users" not in inspector.get_table_names():
@@ -224,11 +256,18 @@ def startup_event():
         if user_count == 0:
             print("ℹ️ No users found — skipping embedding refresh.")
         else:
-            refresh_embeddings()
-            refresh_embedding_cache()
+            refresh_embeddings()  # no-op / snapshot load when the marker is unchanged
+            # Frontend cache parses every embedding JSON — build it off the startup path
+            threading.Thread(target=refresh_embedding_cache, daemon=True).start()
             print(f"✅ Refreshed embeddings successfully for {user_count} users.")
 
     except Exception as e:
         print(f"⚠️ Startup routine skipped: {e}")
 
-    print("✅ System initialization complete — ready for use.")
\ No newline at end of file
+    print("✅ System initialization complete — ready for use.")
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """Fail queued recognition jobs fast instead of leaving kiosks waiting on a dying worker."""
+    attendance.inference.shutdown()
@@ -96,34 +96,45 @@ bool ArcFaceEngine::loadModel(const std::string& path) {
     }
 }
 
+cv::Mat ArcFaceEngine::preprocess(const cv::Mat& face) {
+    cv::Mat resized;
+    if (face.rows == 112 && face.cols == 112) {
+        // Pre-aligned raw crops are already ArcFace-sized: scale straight into the blob input
+        face.convertTo(resized, CV_32F, 1.0 / 255.0);
+        return resized;
+    }
+    cv::resize(face, resized, cv::Size(112, 112));
+    resized.convertTo(resized, CV_32F, 1.0 / 255.0);
+    return resized;
+}
+
+// L2-normalize one output row into `embedding`
+static void normalize_row(const float* row, int cols, std::vector<float>& embedding) {
+    for (int i = 0; i < cols && i < (int)embedding.size(); ++i)
+        embedding[i] = row[i];
+
+    float norm = 0.0f;
+    for (float v : embedding) norm += v * v;
+    norm = std::sqrt(norm) + 1e-6f;
+    for (float& v : embedding) v /= norm;
+}
+
 std::vector<float> ArcFaceEngine::getEmbedding(const cv::Mat& face) {
-    std::vector<float> embedding(512, 0.0f);
+    std::vector<float> embedding(kEmbeddingDim, 0.0f);
     if (!initialized) {
         std::cerr << "⚠️ ArcFace not initialized!" << std::endl;
         return embedding;
     }
 
     try {
-        cv::Mat resized;
-        cv::resize(face, resized, cv::Size(112, 112));
-        resized.convertTo(resized, CV_32F, 1.0 / 255.0);
-
         cv::Mat blob = cv::dnn::blobFromImage(
-            resized, 1.0, cv::Size(112, 112),
+            preprocess(face), 1.0, cv::Size(112, 112),
             cv::Scalar(0, 0, 0), true, false
         );
 
         net.setInput(blob);
         cv::Mat output = net.forward();
-
-        for (int i = 0; i < output.cols; ++i)
-            embedding[i] = output.at<float>(0, i);
-
-        // Normalize
-        float norm = 0.0f;
-        for (float v : embedding) norm += v * v;
-        norm = std::sqrt(norm) + 1e-6f;
-        for (float& v : embedding) v /= norm;
+        normalize_row(output.ptr<float>(0), output.cols, embedding);
     }
     catch (const std::exception& e) {
         std::cerr << "⚠️ ArcFace forward error: " << e.what() << std::endl;
@@ -132,6 +143,50 @@ std::vector<float> ArcFaceEngine::getEmbedding(const cv::Mat& face) {
     return embedding;
 }
 
+std::vector<std::vector<float>> ArcFaceEngine::getEmbeddings(const std::vector<cv::Mat>& faces) {
+    std::vector<std::vector<float>> embeddings(faces.size(), std::vector<float>(kEmbeddingDim, 0.0f));
+    if (!initialized) {
+        std::cerr << "⚠️ ArcFace not initialized!" << std::endl;
+        return embeddings;
+    }
+    if (faces.empty()) return embeddings;
+    if (faces.size() == 1 || !batchSupported) {
+        for (size_t i = 0; i < faces.size(); ++i)
+            embeddings[i] = getEmbedding(faces[i]);
+        return embeddings;
+    }
+
+    try {
+        std::vector<cv::Mat> inputs;
+        inputs.reserve(faces.size());
+        for (const cv::Mat& face : faces)
+            inputs.push_back(preprocess(face));
+
+        // One NCHW blob → one forward pass for the whole batch
+        cv::Mat blob = cv::dnn::blobFromImages(
+            inputs, 1.0, cv::Size(112, 112),
+            cv::Scalar(0, 0, 0), true, false
+        );
+
+        net.setInput(blob);
+        cv::Mat output = net.forward();  // N x 512
+        output = output.reshape(1, (int)faces.size());
+
+        for (int n = 0; n < output.rows; ++n)
+            normalize_row(output.ptr<float>(n), output.cols, embeddings[n]);
+    }
+    catch (const std::exception& e) {
+        // Models exported with a fixed batch of 1 reject N > 1 — remember and go per-face
+        std::cerr << "⚠️ ArcFace batched forward failed (" << e.what()
+                  << ") — falling back to per-face inference." << std::endl;
+        batchSupported = false;
+        for (size_t i = 0; i < faces.size(); ++i)
+            embeddings[i] = getEmbedding(faces[i]);
+    }
+
+    return embeddings;
+}
+
 void ArcFaceEngine::printBackendInfo() const {
     std::cout << "----------------------------------------\n";
     std::cout << "🧠 ArcFace Engine Backend Info\n";
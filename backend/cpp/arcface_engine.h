@@ -11,6 +11,10 @@ private:
     bool initialized = false;
     std::string activeBackend = "CPU";   // Store which backend is used
     std::string activeTarget = "CPU";    // Store which target (CPU/GPU)
+    bool batchSupported = true;          // Cleared if the model has a fixed batch dimension of 1
+
+    // Resize (skipped for 112x112 crops) + scale one face into a 112x112 CV_32F image (blob input)
+    static cv::Mat preprocess(const cv::Mat& face);
 
 public:
     // Load the ONNX model and automatically pick the best backend (GPU if available)
@@ -19,6 +23,13 @@ public:
     // Get 512-D face embedding (normalized)
     std::vector<float> getEmbedding(const cv::Mat& face);
 
+    // Get normalized embeddings for many faces with ONE forward pass (N x 3 x 112 x 112 blob).
+    // Falls back to per-face forwards if the model cannot take a dynamic batch.
+    std::vector<std::vector<float>> getEmbeddings(const std::vector<cv::Mat>& faces);
+
+    // Embedding width (512 for ArcFace R100)
+    static constexpr int kEmbeddingDim = 512;
+
     // Utility: check if model is loaded
     inline bool isInitialized() const { return initialized; }
 
@@ -1,71 +1,380 @@
 #include <iostream>
 #include <string>
 #include <vector>
+#include <memory>
+#include <mutex>
+#include <condition_variable>
+#include <thread>
+#include <cstdint>
+#include <cstdlib>
+#include <cstring>
+#include <algorithm>
 #include <nlohmann/json.hpp>
 #include <opencv2/opencv.hpp>
 #include "arcface_engine.h"  // Only ArcFace now
+#include "face_engine_api.h"
 
 using json = nlohmann::json;
 
-static ArcFaceEngine arcface;
+// =====================================================
+// Engine Pool (one cv::dnn::Net per inference thread)
+// =====================================================
+// A cv::dnn::Net is not safe to forward from two threads at once, so every
+// call leases its own ArcFaceEngine from the pool and returns it afterwards.
+// Pool size: set_engine_pool_size() before the first call, else the
+// FACETRACK_ENGINE_POOL env var, else half the hardware threads (min 1).
+
+namespace {
+
+const char* kArcFacePath = "cpp/models/arcface_r100.onnx";
+
+class EnginePool {
+public:
+    void configure(int size) {
+        std::lock_guard<std::mutex> lock(mutex_);
+        if (engines_.empty() && size > 0) requested_ = size;
+    }
+
+    int size() {
+        ensure_loaded();
+        return static_cast<int>(engines_.size());
+    }
+
+    ArcFaceEngine* acquire() {
+        ensure_loaded();
+        std::unique_lock<std::mutex> lock(mutex_);
+        available_.wait(lock, [this] { return !idle_.empty(); });
+        ArcFaceEngine* engine = idle_.back();
+        idle_.pop_back();
+        return engine;
+    }
+
+    void release(ArcFaceEngine* engine) {
+        {
+            std::lock_guard<std::mutex> lock(mutex_);
+            idle_.push_back(engine);
+        }
+        available_.notify_one();
+    }
+
+private:
+    void ensure_loaded() {
+        std::call_once(loaded_, [this] {
+            int size = requested_;
+            if (size <= 0) {
+                const char* env = std::getenv("FACETRACK_ENGINE_POOL");
+                size = env ? std::atoi(env) : 0;
+            }
+            if (size <= 0) size = std::max(1u, std::thread::hardware_concurrency() / 2);
+
+            for (int i = 0; i < size; ++i) {
+                auto engine = std::make_unique<ArcFaceEngine>();
+                if (!engine->loadModel(kArcFacePath)) {
+                    std::cerr << "❌ ArcFace model initialization failed (pool slot " << i << ").\n";
+                    if (i > 0) break;  // keep the engines that did load
+                }
+                idle_.push_back(engine.get());
+                engines_.push_back(std::move(engine));
+            }
+            std::cout << "✅ ArcFace engine pool ready: " << engines_.size() << " instance(s).\n";
+        });
+    }
+
+    std::once_flag loaded_;
+    std::mutex mutex_;
+    std::condition_variable available_;
+    std::vector<std::unique_ptr<ArcFaceEngine>> engines_;
+    std::vector<ArcFaceEngine*> idle_;
+    int requested_ = 0;
+};
+
+EnginePool& pool() {
+    static EnginePool instance;
+    return instance;
+}
+
+// RAII lease: the engine goes back to the pool even if inference throws
+struct EngineLease {
+    ArcFaceEngine* engine;
+    EngineLease() : engine(pool().acquire()) {}
+    ~EngineLease() { pool().release(engine); }
+    ArcFaceEngine* operator->() const { return engine; }
+};
+
+cv::Mat decode(const uint8_t* data, size_t length) {
+    if (data == nullptr || length == 0) return cv::Mat();
+    cv::Mat raw(1, static_cast<int>(length), CV_8UC1, const_cast<uint8_t*>(data));
+    return cv::imdecode(raw, cv::IMREAD_COLOR);
+}
+
+// getEmbedding / getEmbeddings signal failure (no model, forward error) with an
+// all-zero vector, never an empty one — every "ok" check tests for that.
+bool is_embedded(const std::vector<float>& embedding) {
+    return std::any_of(embedding.begin(), embedding.end(), [](float v) { return v != 0.0f; });
+}
+
+// Embed an already-decoded (cropped) face image → JSON array string
+std::string embed_image_json(const cv::Mat& img) {
+    // 🔹 Since Blaze already detects faces, treat the whole image as one face
+    std::vector<float> embedding;
+    {
+        EngineLease engine;
+        embedding = engine->getEmbedding(img);
+    }
+
+    json output = json::array();
+    if (is_embedded(embedding)) {
+        output.push_back({
+            {"embedding", embedding},
+            {"facial_area", {
+                {"x", 0},
+                {"y", 0},
+                {"w", img.cols},
+                {"h", img.rows}
+            }}
+        });
+    } else {
+        std::cerr << "⚠️ ArcFace returned no embedding for image.\n";
+    }
+    return output.dump();
+}
 
-// Initialize only once
-static bool initialized = false;
+// Embed one decoded image into a caller buffer of kEmbeddingDim floats
+bool embed_into(const cv::Mat& img, float* out_embedding) {
+    std::vector<float> embedding;
+    {
+        EngineLease engine;
+        embedding = engine->getEmbedding(img);
+    }
+    if (!is_embedded(embedding)) return false;
+    std::copy(embedding.begin(), embedding.end(), out_embedding);
+    return true;
+}
 
-static void init_models() {
-    if (initialized) return;
+// Legacy JSON entry points return a pointer into a per-thread buffer: valid until the
+// same thread calls again, so concurrent callers never see each other's results.
+const char* hold(std::string value) {
+    thread_local std::string result_str;
+    result_str = std::move(value);
+    return result_str.c_str();
+}
+
+}  // namespace
 
-    std::string arc_path = "cpp/models/arcface_r100.onnx";
-    bool arc_ok = arcface.loadModel(arc_path);
+extern "C" {
 
-    if (arc_ok)
-        std::cout << "✅ ArcFace model initialized successfully.\n";
-    else
-        std::cerr << "❌ ArcFace model initialization failed.\n";
+// =====================================================
+// Engine pool configuration / info
+// =====================================================
+void set_engine_pool_size(int size) {
+    pool().configure(size);
+}
 
-    initialized = true;
+int engine_pool_size() {
+    return pool().size();
 }
 
 // =====================================================
 // Exported Function: detect_and_embed
 // =====================================================
 // This version assumes the frontend (Blaze) already sends a CROPPED face image.
-extern "C" const char* detect_and_embed(const char* image_path) {
-    static std::string result_str;
-    init_models();
-
+const char* detect_and_embed(const char* image_path) {
     try {
         cv::Mat img = cv::imread(image_path);
         if (img.empty()) {
             std::cerr << "❌ Cannot read image: " << image_path << std::endl;
-            result_str = "[]";
-            return result_str.c_str();
+            return hold("[]");
         }
+        return hold(embed_image_json(img));
+    }
+    catch (const std::exception& e) {
+        std::cerr << "⚠️ Exception in detect_and_embed: " << e.what() << std::endl;
+        return hold("[]");
+    }
+}
 
-        // 🔹 Since Blaze already detects faces, treat the whole image as one face
-        std::vector<float> embedding = arcface.getEmbedding(img);
-
-        json output = json::array();
-        if (!embedding.empty()) {
-            output.push_back({
-                {"embedding", embedding},
-                {"facial_area", {
-                    {"x", 0},
-                    {"y", 0},
-                    {"w", img.cols},
-                    {"h", img.rows}
-                }}
-            });
-        } else {
-            std::cerr << "⚠️ ArcFace returned empty embedding for image.\n";
+// =====================================================
+// Exported Function: detect_and_embed_buffer
+// =====================================================
+// Same as detect_and_embed, but decodes the encoded upload (JPEG/PNG bytes)
+// straight from memory with cv::imdecode — no temp file, no disk I/O.
+const char* detect_and_embed_buffer(const uint8_t* data, size_t length) {
+    try {
+        cv::Mat img = decode(data, length);
+        if (img.empty()) {
+            std::cerr << "❌ Cannot decode image buffer (" << length << " bytes)" << std::endl;
+            return hold("[]");
         }
+        return hold(embed_image_json(img));
+    }
+    catch (const std::exception& e) {
+        std::cerr << "⚠️ Exception in detect_and_embed_buffer: " << e.what() << std::endl;
+        return hold("[]");
+    }
+}
 
-        result_str = output.dump();
-        return result_str.c_str();
+// =====================================================
+// Exported Function: detect_and_embed_alloc / free_result
+// =====================================================
+// Explicit-ownership variant: the JSON is malloc'd for the caller, who must
+// release it with free_result(). Returns NULL on allocation failure.
+char* detect_and_embed_alloc(const uint8_t* data, size_t length) {
+    std::string result = "[]";
+    try {
+        cv::Mat img = decode(data, length);
+        if (!img.empty()) result = embed_image_json(img);
     }
     catch (const std::exception& e) {
-        std::cerr << "⚠️ Exception in detect_and_embed: " << e.what() << std::endl;
-        result_str = "[]";
-        return result_str.c_str();
+        std::cerr << "⚠️ Exception in detect_and_embed_alloc: " << e.what() << std::endl;
     }
-}
\ No newline at end of file
+    char* out = static_cast<char*>(std::malloc(result.size() + 1));
+    if (out) std::memcpy(out, result.c_str(), result.size() + 1);
+    return out;
+}
+
+void free_result(char* result) {
+    std::free(result);
+}
+
+// =====================================================
+// Exported Function: embed_buffer_into
+// =====================================================
+// Re-entrant, JSON-free path: decodes one encoded crop and writes its
+// normalized embedding into the caller's `out_embedding` (dim floats) and
+// its box into `out_box` (x, y, w, h; may be NULL).
+// Returns 1 on success, 0 if nothing could be embedded, -1 on error.
+int embed_buffer_into(const uint8_t* data, size_t length, float* out_embedding, int dim, int* out_box) {
+    try {
+        cv::Mat img = decode(data, length);
+        if (img.empty() || dim < ArcFaceEngine::kEmbeddingDim) return 0;
+        if (!embed_into(img, out_embedding)) return 0;
+
+        if (out_box) {
+            out_box[0] = 0;
+            out_box[1] = 0;
+            out_box[2] = img.cols;
+            out_box[3] = img.rows;
+        }
+        return 1;
+    }
+    catch (const std::exception& e) {
+        std::cerr << "⚠️ Exception in embed_buffer_into: " << e.what() << std::endl;
+        return -1;
+    }
+}
+
+// =====================================================
+// Exported Function: embed_bgr_into
+// =====================================================
+// Embeds an already-decoded 8-bit BGR crop (rows x cols x 3, `stride` bytes per
+// row) without copying it — e.g. a NumPy frame passed by the extension module.
+int embed_bgr_into(const uint8_t* pixels, int rows, int cols, size_t stride, float* out_embedding, int dim) {
+    try {
+        if (pixels == nullptr || rows <= 0 || cols <= 0 || dim < ArcFaceEngine::kEmbeddingDim) return 0;
+        cv::Mat img(rows, cols, CV_8UC3, const_cast<uint8_t*>(pixels), stride);
+        return embed_into(img, out_embedding) ? 1 : 0;
+    }
+    catch (const std::exception& e) {
+        std::cerr << "⚠️ Exception in embed_bgr_into: " << e.what() << std::endl;
+        return -1;
+    }
+}
+
+// =====================================================
+// Exported Function: embed_batch
+// =====================================================
+// Embeds n_images encoded face crops (JPEG/PNG bytes) with a single batched
+// forward pass. Results go into the caller's buffer `out_embeddings`
+// (n_images x embedding_dim() floats, row-major); `out_ok[i]` is 1 when image i
+// decoded and embedded, 0 otherwise (its row is left zeroed).
+// Returns the number of embedded images, or -1 on error.
+int embedding_dim() {
+    return ArcFaceEngine::kEmbeddingDim;
+}
+
+int embed_batch(const uint8_t* const* buffers,
+                const size_t* lengths,
+                int n_images,
+                float* out_embeddings,
+                int* out_ok) {
+    const int dim = ArcFaceEngine::kEmbeddingDim;
+
+    try {
+        std::vector<cv::Mat> faces;
+        std::vector<int> slots;  // faces[j] came from image slots[j]
+        faces.reserve(n_images);
+
+        for (int i = 0; i < n_images; ++i) {
+            out_ok[i] = 0;
+            std::fill(out_embeddings + (int64_t)i * dim, out_embeddings + (int64_t)(i + 1) * dim, 0.0f);
+
+            cv::Mat img = decode(buffers[i], lengths[i]);
+            if (img.empty()) {
+                std::cerr << "❌ embed_batch: cannot decode image " << i << std::endl;
+                continue;
+            }
+            faces.push_back(img);
+            slots.push_back(i);
+        }
+
+        std::vector<std::vector<float>> embeddings;
+        {
+            EngineLease engine;
+            embeddings = engine->getEmbeddings(faces);
+        }
+        int count = 0;
+        for (size_t j = 0; j < embeddings.size(); ++j) {
+            std::copy(embeddings[j].begin(), embeddings[j].end(), out_embeddings + (int64_t)slots[j] * dim);
+            out_ok[slots[j]] = is_embedded(embeddings[j]) ? 1 : 0;
+            count += out_ok[slots[j]];
+        }
+        return count;
+    }
+    catch (const std::exception& e) {
+        std::cerr << "⚠️ Exception in embed_batch: " << e.what() << std::endl;
+        return -1;
+    }
+}
+
+// =====================================================
+// Exported Function: embed_bgr_batch
+// =====================================================
+// Embeds n_images already-decoded 8-bit BGR crops laid out back to back in one
+// contiguous buffer (n_images x rows x cols x 3, e.g. a raw-crop upload) with a
+// single batched forward. The crops are wrapped, not copied, and 112x112 crops
+// skip the resize. Same output contract as embed_batch.
+int embed_bgr_batch(const uint8_t* pixels, int n_images, int rows, int cols,
+                    float* out_embeddings, int* out_ok) {
+    const int dim = ArcFaceEngine::kEmbeddingDim;
+
+    try {
+        if (pixels == nullptr || n_images <= 0 || rows <= 0 || cols <= 0) return 0;
+        const size_t crop_bytes = static_cast<size_t>(rows) * cols * 3;
+
+        std::vector<cv::Mat> faces;
+        faces.reserve(n_images);
+        for (int i = 0; i < n_images; ++i) {
+            faces.emplace_back(rows, cols, CV_8UC3, const_cast<uint8_t*>(pixels + i * crop_bytes));
+        }
+
+        std::vector<std::vector<float>> embeddings;
+        {
+            EngineLease engine;
+            embeddings = engine->getEmbeddings(faces);
+        }
+        int count = 0;
+        for (int i = 0; i < n_images; ++i) {
+            const std::vector<float>& embedding = embeddings[i];
+            out_ok[i] = is_embedded(embedding) ? 1 : 0;
+            std::copy(embedding.begin(), embedding.end(), out_embeddings + (int64_t)i * dim);
+            count += out_ok[i];
+        }
+        return count;
+    }
+    catch (const std::exception& e) {
+        std::cerr << "⚠️ Exception in embed_bgr_batch: " << e.what() << std::endl;
+        return -1;
+    }
+}
+
+}  // extern "C"
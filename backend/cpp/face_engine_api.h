@@ -0,0 +1,37 @@
+#pragma once
+#include <cstddef>
+#include <cstdint>
+
+// =====================================================
+// C ABI of libface_engine (shared by ctypes and the _face_engine extension)
+// =====================================================
+extern "C" {
+
+// Engine pool
+void set_engine_pool_size(int size);
+int engine_pool_size();
+int embedding_dim();
+
+// Inference (face_engine.cpp)
+const char* detect_and_embed(const char* image_path);
+const char* detect_and_embed_buffer(const uint8_t* data, size_t length);
+char* detect_and_embed_alloc(const uint8_t* data, size_t length);
+void free_result(char* result);
+int embed_buffer_into(const uint8_t* data, size_t length, float* out_embedding, int dim, int* out_box);
+int embed_bgr_into(const uint8_t* pixels, int rows, int cols, size_t stride, float* out_embedding, int dim);
+int embed_batch(const uint8_t* const* buffers, const size_t* lengths, int n_images,
+                float* out_embeddings, int* out_ok);
+int embed_bgr_batch(const uint8_t* pixels, int n_images, int rows, int cols,
+                    float* out_embeddings, int* out_ok);
+
+// Matching (simd_match.cpp)
+int simd_level();
+const char* simd_level_name();
+int simd_num_threads();
+float dot_f32(const float* a, const float* b, int dim);
+int best_match_f32(const float* input, const float* all_embeddings, int n_rows, int dim,
+                   const float* thresholds, float* best_score);
+void best_match_many(const float* inputs, int n_inputs, const float* all_embeddings, int n_rows,
+                     int dim, const float* thresholds, int* out_index, float* out_score);
+
+}  // extern "C"
@@ -0,0 +1,181 @@
+#include <pybind11/pybind11.h>
+#include <pybind11/numpy.h>
+#include <pybind11/stl.h>
+#include <stdexcept>
+#include <string>
+#include <vector>
+#include "face_engine_api.h"
+
+namespace py = pybind11;
+
+// =====================================================
+// _face_engine — zero-copy Python bindings for libface_engine
+// =====================================================
+// Inputs are read straight from bytes / NumPy buffers and results are written
+// into NumPy arrays, so nothing is serialised to JSON or copied into Python
+// lists. The GIL is released for every inference and matching call.
+
+using FloatArray = py::array_t<float, py::array::c_style | py::array::forcecast>;
+using ByteArray = py::array_t<uint8_t, py::array::c_style>;
+
+namespace {
+
+// Encoded image (bytes / bytearray / memoryview / uint8 ndarray) → (embedding, (x, y, w, h)) or None
+py::object embed(py::buffer data) {
+    py::buffer_info info = data.request();
+    if (info.itemsize != 1) throw std::invalid_argument("embed() expects a byte buffer");
+
+    const int dim = embedding_dim();
+    py::array_t<float> out(dim);
+    const auto* ptr = static_cast<const uint8_t*>(info.ptr);
+    const size_t length = static_cast<size_t>(info.size);
+    float* dst = out.mutable_data();
+
+    int box[4] = {0, 0, 0, 0};
+    int found;
+    {
+        py::gil_scoped_release release;
+        found = embed_buffer_into(ptr, length, dst, dim, box);
+    }
+    if (found <= 0) return py::none();
+    return py::make_tuple(out, py::make_tuple(box[0], box[1], box[2], box[3]));
+}
+
+// Decoded BGR crop (H x W x 3 uint8 ndarray, e.g. from cv2) → embedding or None
+py::object embed_image(ByteArray image) {
+    if (image.ndim() != 3 || image.shape(2) != 3)
+        throw std::invalid_argument("embed_image() expects an HxWx3 uint8 BGR array");
+
+    const int dim = embedding_dim();
+    py::array_t<float> out(dim);
+    const uint8_t* pixels = image.data();
+    const int rows = static_cast<int>(image.shape(0));
+    const int cols = static_cast<int>(image.shape(1));
+    const size_t stride = static_cast<size_t>(image.strides(0));
+    float* dst = out.mutable_data();
+
+    int found;
+    {
+        py::gil_scoped_release release;
+        found = embed_bgr_into(pixels, rows, cols, stride, dst, dim);
+    }
+    if (found <= 0) return py::none();
+    return std::move(out);
+}
+
+// list of encoded crops → (embeddings float32[N, dim], ok bool[N]) from one batched forward
+py::tuple embed_many(const std::vector<py::bytes>& images) {
+    const int n = static_cast<int>(images.size());
+    const int dim = embedding_dim();
+
+    std::vector<const uint8_t*> buffers(n);
+    std::vector<size_t> lengths(n);
+    for (int i = 0; i < n; ++i) {
+        char* ptr = nullptr;
+        Py_ssize_t len = 0;
+        PyBytes_AsStringAndSize(images[i].ptr(), &ptr, &len);
+        buffers[i] = reinterpret_cast<const uint8_t*>(ptr);
+        lengths[i] = static_cast<size_t>(len);
+    }
+
+    py::array_t<float> out({n, dim});
+    std::vector<int> ok(n, 0);
+    float* dst = out.mutable_data();
+
+    int count = 0;
+    if (n > 0) {
+        py::gil_scoped_release release;
+        count = embed_batch(buffers.data(), lengths.data(), n, dst, ok.data());
+    }
+    if (count < 0) throw std::runtime_error("embed_batch failed");
+
+    py::array_t<bool> flags(n);
+    bool* flag = flags.mutable_data();
+    for (int i = 0; i < n; ++i) flag[i] = ok[i] != 0;
+    return py::make_tuple(out, flags);
+}
+
+// Decoded BGR crops (N x H x W x 3 uint8, C-contiguous — e.g. a raw-crop upload)
+// → (embeddings float32[N, dim], ok bool[N]) from one batched forward, pixels read in place
+py::tuple embed_images(ByteArray images) {
+    if (images.ndim() != 4 || images.shape(3) != 3)
+        throw std::invalid_argument("embed_images() expects an NxHxWx3 uint8 BGR array");
+
+    const int n = static_cast<int>(images.shape(0));
+    const int rows = static_cast<int>(images.shape(1));
+    const int cols = static_cast<int>(images.shape(2));
+    const int dim = embedding_dim();
+
+    py::array_t<float> out({n, dim});
+    std::vector<int> ok(n, 0);
+    const uint8_t* pixels = images.data();
+    float* dst = out.mutable_data();
+
+    int count = 0;
+    if (n > 0) {
+        py::gil_scoped_release release;
+        count = embed_bgr_batch(pixels, n, rows, cols, dst, ok.data());
+    }
+    if (count < 0) throw std::runtime_error("embed_bgr_batch failed");
+
+    py::array_t<bool> flags(n);
+    bool* flag = flags.mutable_data();
+    for (int i = 0; i < n; ++i) flag[i] = ok[i] != 0;
+    return py::make_tuple(out, flags);
+}
+
+// probes float32[F, D] vs rows float32[N, D] (+ optional per-row thresholds)
+// → (best row int32[F], raw score float32[F]); rows are scanned in place.
+py::tuple match_many(FloatArray probes, FloatArray rows, py::object thresholds) {
+    if (probes.ndim() != 2 || rows.ndim() != 2 || probes.shape(1) != rows.shape(1))
+        throw std::invalid_argument("best_match_many() expects probes [F, D] and rows [N, D]");
+
+    const int n_probes = static_cast<int>(probes.shape(0));
+    const int n_rows = static_cast<int>(rows.shape(0));
+    const int dim = static_cast<int>(rows.shape(1));
+
+    FloatArray offsets;
+    const float* offset_ptr = nullptr;
+    if (!thresholds.is_none()) {
+        offsets = thresholds.cast<FloatArray>();
+        if (offsets.size() < n_rows) throw std::invalid_argument("thresholds shorter than rows");
+        offset_ptr = offsets.data();
+    }
+
+    py::array_t<int32_t> out_index(n_probes);
+    py::array_t<float> out_score(n_probes);
+    const float* probe_ptr = probes.data();
+    const float* row_ptr = rows.data();
+    int32_t* index_ptr = out_index.mutable_data();
+    float* score_ptr = out_score.mutable_data();
+
+    {
+        py::gil_scoped_release release;
+        best_match_many(probe_ptr, n_probes, row_ptr, n_rows, dim, offset_ptr, index_ptr, score_ptr);
+    }
+    return py::make_tuple(out_index, out_score);
+}
+
+}  // namespace
+
+PYBIND11_MODULE(_face_engine, m) {
+    m.doc() = "Zero-copy bindings for the native ArcFace engine and SIMD matcher";
+
+    m.def("embed", &embed, py::arg("data"),
+          "Embed one encoded face crop (JPEG/PNG bytes) → (float32[dim], (x, y, w, h)) or None");
+    m.def("embed_image", &embed_image, py::arg("image"),
+          "Embed one decoded BGR crop (HxWx3 uint8) → float32[dim] or None");
+    m.def("embed_batch", &embed_many, py::arg("images"),
+          "Embed encoded crops in one batched forward → (float32[N, dim], bool[N])");
+    m.def("embed_images", &embed_images, py::arg("images"),
+          "Embed decoded BGR crops (NxHxWx3 uint8) in one batched forward → (float32[N, dim], bool[N])");
+    m.def("best_match_many", &match_many,
+          py::arg("probes"), py::arg("rows"), py::arg("thresholds") = py::none(),
+          "Best row + raw score per probe → (int32[F], float32[F])");
+
+    m.def("embedding_dim", &embedding_dim);
+    m.def("pool_size", &engine_pool_size);
+    m.def("set_pool_size", &set_engine_pool_size, py::arg("size"));
+    m.def("simd_level", []() { return std::string(simd_level_name()); });
+    m.def("simd_threads", &simd_num_threads);
+}
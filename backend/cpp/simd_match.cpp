@@ -0,0 +1,300 @@
+#include <cstdint>
+#include <cfloat>
+#include <vector>
+
+#if defined(__x86_64__) || defined(_M_X64) || defined(__i386__) || defined(_M_IX86)
+#define FE_X86 1
+#include <immintrin.h>
+// GCC/Clang compile each kernel for its own ISA and probe with __builtin_cpu_supports;
+// MSVC accepts AVX/AVX-512 intrinsics in any function, so it needs neither (CPUID below)
+#ifdef _MSC_VER
+#include <intrin.h>
+#define FE_TARGET(isa)
+#else
+#define FE_TARGET(isa) __attribute__((target(isa)))
+#endif
+#endif
+
+// The NEON kernel uses AArch64-only intrinsics (vaddvq_f32, vfmaq_f32 without VFPv4):
+// 32-bit ARM builds take the scalar path
+#if defined(__aarch64__) || defined(_M_ARM64)
+#define FE_NEON 1
+#include <arm_neon.h>
+#endif
+
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+// ==========================================================
+// Float32 SIMD dot-product kernels + runtime CPU dispatch
+// ==========================================================
+// Index rows and probes are already L2-normalized on the Python side,
+// so cosine similarity is a plain dot product (no norms recomputed).
+
+namespace {
+
+enum SimdLevel { SIMD_SCALAR = 0, SIMD_NEON = 1, SIMD_AVX2 = 2, SIMD_AVX512 = 3 };
+
+typedef float (*dot_fn)(const float*, const float*, int);
+
+float dot_scalar(const float* a, const float* b, int n) {
+    float s0 = 0.f, s1 = 0.f, s2 = 0.f, s3 = 0.f;
+    int i = 0;
+    for (; i + 4 <= n; i += 4) {
+        s0 += a[i] * b[i];
+        s1 += a[i + 1] * b[i + 1];
+        s2 += a[i + 2] * b[i + 2];
+        s3 += a[i + 3] * b[i + 3];
+    }
+    for (; i < n; ++i) s0 += a[i] * b[i];
+    return (s0 + s1) + (s2 + s3);
+}
+
+#ifdef FE_X86
+FE_TARGET("avx2,fma")
+float dot_avx2(const float* a, const float* b, int n) {
+    __m256 acc0 = _mm256_setzero_ps();
+    __m256 acc1 = _mm256_setzero_ps();
+    int i = 0;
+    for (; i + 16 <= n; i += 16) {
+        acc0 = _mm256_fmadd_ps(_mm256_loadu_ps(a + i), _mm256_loadu_ps(b + i), acc0);
+        acc1 = _mm256_fmadd_ps(_mm256_loadu_ps(a + i + 8), _mm256_loadu_ps(b + i + 8), acc1);
+    }
+    for (; i + 8 <= n; i += 8)
+        acc0 = _mm256_fmadd_ps(_mm256_loadu_ps(a + i), _mm256_loadu_ps(b + i), acc0);
+
+    __m256 acc = _mm256_add_ps(acc0, acc1);
+    __m128 lo = _mm256_castps256_ps128(acc);
+    __m128 hi = _mm256_extractf128_ps(acc, 1);
+    lo = _mm_add_ps(lo, hi);
+    lo = _mm_hadd_ps(lo, lo);
+    lo = _mm_hadd_ps(lo, lo);
+    float sum = _mm_cvtss_f32(lo);
+
+    for (; i < n; ++i) sum += a[i] * b[i];
+    return sum;
+}
+
+FE_TARGET("avx512f")
+float dot_avx512(const float* a, const float* b, int n) {
+    __m512 acc0 = _mm512_setzero_ps();
+    __m512 acc1 = _mm512_setzero_ps();
+    int i = 0;
+    for (; i + 32 <= n; i += 32) {
+        acc0 = _mm512_fmadd_ps(_mm512_loadu_ps(a + i), _mm512_loadu_ps(b + i), acc0);
+        acc1 = _mm512_fmadd_ps(_mm512_loadu_ps(a + i + 16), _mm512_loadu_ps(b + i + 16), acc1);
+    }
+    for (; i + 16 <= n; i += 16)
+        acc0 = _mm512_fmadd_ps(_mm512_loadu_ps(a + i), _mm512_loadu_ps(b + i), acc0);
+
+    alignas(64) float lanes[16];
+    _mm512_store_ps(lanes, _mm512_add_ps(acc0, acc1));
+    float sum = 0.f;
+    for (float v : lanes) sum += v;
+    for (; i < n; ++i) sum += a[i] * b[i];
+    return sum;
+}
+#endif
+
+#ifdef FE_NEON
+float dot_neon(const float* a, const float* b, int n) {
+    float32x4_t acc0 = vdupq_n_f32(0.f);
+    float32x4_t acc1 = vdupq_n_f32(0.f);
+    int i = 0;
+    for (; i + 8 <= n; i += 8) {
+        acc0 = vfmaq_f32(acc0, vld1q_f32(a + i), vld1q_f32(b + i));
+        acc1 = vfmaq_f32(acc1, vld1q_f32(a + i + 4), vld1q_f32(b + i + 4));
+    }
+    float sum = vaddvq_f32(vaddq_f32(acc0, acc1));
+    for (; i < n; ++i) sum += a[i] * b[i];
+    return sum;
+}
+#endif
+
+#if defined(FE_X86) && defined(_MSC_VER)
+// CPUID feature bits + XCR0 (the OS must save the YMM / ZMM state)
+int detect_x86_msvc() {
+    int r[4];
+    __cpuid(r, 0);
+    if (r[0] < 7) return SIMD_SCALAR;
+    __cpuid(r, 1);
+    bool fma = (r[2] >> 12) & 1, osxsave = (r[2] >> 27) & 1, avx = (r[2] >> 28) & 1;
+    if (!osxsave || !avx) return SIMD_SCALAR;
+    unsigned long long xcr0 = _xgetbv(0);
+    __cpuidex(r, 7, 0);
+    bool avx2 = (r[1] >> 5) & 1, avx512f = (r[1] >> 16) & 1;
+    if (avx512f && (xcr0 & 0xE6) == 0xE6) return SIMD_AVX512;
+    if (avx2 && fma && (xcr0 & 0x6) == 0x6) return SIMD_AVX2;
+    return SIMD_SCALAR;
+}
+#endif
+
+int detect_level() {
+#if defined(FE_X86) && defined(_MSC_VER)
+    return detect_x86_msvc();
+#elif defined(FE_X86)
+    __builtin_cpu_init();
+    if (__builtin_cpu_supports("avx512f")) return SIMD_AVX512;
+    if (__builtin_cpu_supports("avx2") && __builtin_cpu_supports("fma")) return SIMD_AVX2;
+#endif
+#ifdef FE_NEON
+    return SIMD_NEON;
+#endif
+    return SIMD_SCALAR;
+}
+
+dot_fn select_kernel(int level) {
+    switch (level) {
+#ifdef FE_X86
+        case SIMD_AVX512: return dot_avx512;
+        case SIMD_AVX2: return dot_avx2;
+#endif
+#ifdef FE_NEON
+        case SIMD_NEON: return dot_neon;
+#endif
+        default: return dot_scalar;
+    }
+}
+
+// Resolved once on first use (thread-safe static init)
+struct Dispatch {
+    int level;
+    dot_fn dot;
+    Dispatch() : level(detect_level()), dot(select_kernel(level)) {}
+};
+
+const Dispatch& dispatch() {
+    static Dispatch d;
+    return d;
+}
+
+}  // namespace
+
+extern "C" {
+
+// ==========================================================
+// simd_level — 0 scalar, 1 NEON, 2 AVX2+FMA, 3 AVX-512F
+// ==========================================================
+int simd_level() {
+    return dispatch().level;
+}
+
+const char* simd_level_name() {
+    static const char* names[] = {"scalar", "neon", "avx2", "avx512"};
+    return names[dispatch().level];
+}
+
+int simd_num_threads() {
+#ifdef _OPENMP
+    return omp_get_max_threads();
+#else
+    return 1;
+#endif
+}
+
+float dot_f32(const float* a, const float* b, int dim) {
+    return dispatch().dot(a, b, dim);
+}
+
+// ==========================================================
+// best_match_f32 — best row for one probe (score - threshold ranking)
+// thresholds may be NULL (plain argmax); best_score gets the raw cosine.
+// ==========================================================
+int best_match_f32(const float* input,
+                   const float* all_embeddings,
+                   int n_rows,
+                   int dim,
+                   const float* thresholds,
+                   float* best_score) {
+    dot_fn dot = dispatch().dot;
+    float best_rank = -FLT_MAX;
+    float best = -1.f;
+    int best_index = -1;
+
+    for (int i = 0; i < n_rows; ++i) {
+        float score = dot(input, all_embeddings + (int64_t)i * dim, dim);
+        float rank = thresholds ? score - thresholds[i] : score;
+        if (rank > best_rank) {
+            best_rank = rank;
+            best = score;
+            best_index = i;
+        }
+    }
+
+    *best_score = best;
+    return best_index;
+}
+
+// ==========================================================
+// best_match_many — best row for each of n_inputs probes.
+// The index is split into contiguous shards, one per OpenMP thread;
+// each thread scores every probe against its shard, then the per-shard
+// winners are reduced. Without OpenMP this runs on a single core.
+// ==========================================================
+void best_match_many(const float* inputs,
+                     int n_inputs,
+                     const float* all_embeddings,
+                     int n_rows,
+                     int dim,
+                     const float* thresholds,
+                     int* out_index,
+                     float* out_score) {
+    dot_fn dot = dispatch().dot;
+    std::vector<float> best_rank(n_inputs, -FLT_MAX);
+
+    for (int q = 0; q < n_inputs; ++q) {
+        out_index[q] = -1;
+        out_score[q] = -1.f;
+    }
+
+#ifdef _OPENMP
+#pragma omp parallel
+#endif
+    {
+        int n_threads = 1, tid = 0;
+#ifdef _OPENMP
+        n_threads = omp_get_num_threads();
+        tid = omp_get_thread_num();
+#endif
+        int64_t shard = ((int64_t)n_rows + n_threads - 1) / n_threads;
+        int start = (int)(shard * tid);
+        int end = (int)((int64_t)start + shard < n_rows ? (int64_t)start + shard : n_rows);
+
+        std::vector<float> local_rank(n_inputs, -FLT_MAX);
+        std::vector<float> local_score(n_inputs, -1.f);
+        std::vector<int> local_index(n_inputs, -1);
+
+        for (int i = start; i < end; ++i) {
+            const float* row = all_embeddings + (int64_t)i * dim;
+            float offset = thresholds ? thresholds[i] : 0.f;
+            for (int q = 0; q < n_inputs; ++q) {
+                float score = dot(inputs + (int64_t)q * dim, row, dim);
+                float rank = score - offset;
+                if (rank > local_rank[q]) {
+                    local_rank[q] = rank;
+                    local_score[q] = score;
+                    local_index[q] = i;
+                }
+            }
+        }
+
+#ifdef _OPENMP
+#pragma omp critical
+#endif
+        {
+            for (int q = 0; q < n_inputs; ++q) {
+                bool better = local_rank[q] > best_rank[q] ||
+                              (local_rank[q] == best_rank[q] && local_index[q] >= 0 &&
+                               (out_index[q] < 0 || local_index[q] < out_index[q]));
+                if (local_index[q] >= 0 && better) {
+                    best_rank[q] = local_rank[q];
+                    out_score[q] = local_score[q];
+                    out_index[q] = local_index[q];
+                }
+            }
+        }
+    }
+}
+
+}  // extern "C"
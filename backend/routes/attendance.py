@@ -1,8 +1,22 @@
-from fastapi import APIRouter, UploadFile, Form, Depends, Query
+from fastapi import APIRouter, UploadFile, Form, Depends, Query, Request
+from fastapi.responses import JSONResponse
 import ctypes
 from sqlalchemy.orm import Session
 from utils.db import SessionLocal
+from utils.face_index import EmbeddingIndex, IndexSnapshot, prepare_probe, prepare_probes, DEFAULT_USER_THRESHOLD
+from utils.shared_index import SharedIndexFile
+from utils.image_io import decode_image
+from utils.inference_executor import (
+    InferenceExecutor, InferenceRejected, PRIORITY_MARK, PRIORITY_SEARCH, PRIORITY_PREVIEW
+)
+from utils.micro_batcher import MicroBatcher
+from utils.embedding_backends import NativeBackend, OnnxBackend, DeepFaceBackend, embedded_rows
+from utils.embedding_cache import EmbeddingCache, crop_hash
+from utils.face_quality import QualityGate
+from utils.crop_wire import CropWireError, is_raw_crops, parse_crops
+from utils.face_sessions import FaceSessionStore
 from models.User import User
+from models.Admin import Admin
 from models.Attendance import Attendance
 from models.Holiday import Holiday
 from models.WorkApplication import WorkApplication
@@ -14,12 +28,15 @@ import cv2
 from datetime import date, datetime, timezone, timedelta
 from calendar import monthrange
 import time 
-from sqlalchemy import inspect
+from sqlalchemy import inspect, func
 import os
+import sys
 import gc
+import asyncio
 import threading
 import tensorflow as tf
 import logging
+from contextlib import contextmanager
 from queue import Queue
 
 # Global queue for async attendance DB writes
@@ -38,16 +55,22 @@ router = APIRouter(prefix="/attendance", tags=["Attendance"])
 # Resolve native lib path reliably from this file's folder
 _here = os.path.dirname(os.path.abspath(__file__))
 
-# macOS build name
-engine_path = os.path.abspath(os.path.join(_here, "..", "cpp", "build", "libface_engine.dylib"))
+_build_dir = os.path.abspath(os.path.join(_here, "..", "cpp", "build"))
 
-# (Optional cross-platform fallback)
-if not os.path.exists(engine_path):
-    for alt in ["face_engine.so", "face_engine.dll"]:
-        _p = os.path.abspath(os.path.join(_here, "..", "cpp", "build", alt))
-        if os.path.exists(_p):
-            engine_path = _p
-            break
+# CMake names the library per platform; try this platform's name first
+if sys.platform == "darwin":
+    _lib_names = ["libface_engine.dylib", "libface_engine.so"]
+elif sys.platform == "win32":
+    _lib_names = ["face_engine.dll", "libface_engine.dll"]
+else:
+    _lib_names = ["libface_engine.so", "face_engine.so"]
+
+engine_path = os.path.join(_build_dir, _lib_names[0])
+for _name in _lib_names:
+    _p = os.path.join(_build_dir, _name)
+    if os.path.exists(_p):
+        engine_path = _p
+        break
 
 # Try to load the unified native engine
 try:
@@ -69,6 +92,47 @@ try:
     face_engine.detect_and_embed.restype = ctypes.c_char_p
     face_engine.detect_and_embed.argtypes = [ctypes.c_char_p]
 
+    # detect_and_embed_buffer → const char* (JSON), decodes encoded bytes in memory (newer builds)
+    if hasattr(face_engine, "detect_and_embed_buffer"):
+        face_engine.detect_and_embed_buffer.restype = ctypes.c_char_p
+        face_engine.detect_and_embed_buffer.argtypes = [ctypes.c_char_p, ctypes.c_size_t]
+
+    # embed_buffer_into → int, re-entrant single-face path writing into caller buffers (newer builds)
+    if hasattr(face_engine, "embed_buffer_into"):
+        face_engine.embed_buffer_into.restype = ctypes.c_int
+        face_engine.embed_buffer_into.argtypes = [
+            ctypes.c_char_p,                  # encoded image bytes
+            ctypes.c_size_t,                  # length
+            ctypes.POINTER(ctypes.c_float),   # out embedding [dim]
+            ctypes.c_int,                     # dim
+            ctypes.POINTER(ctypes.c_int)      # out box [x, y, w, h]
+        ]
+        face_engine.engine_pool_size.restype = ctypes.c_int
+
+    # embed_batch → int, one batched ArcFace forward for many encoded crops (newer builds)
+    if hasattr(face_engine, "embed_batch"):
+        face_engine.embedding_dim.restype = ctypes.c_int
+        face_engine.embed_batch.restype = ctypes.c_int
+        face_engine.embed_batch.argtypes = [
+            ctypes.POINTER(ctypes.c_char_p),  # encoded image buffers
+            ctypes.POINTER(ctypes.c_size_t),  # buffer lengths
+            ctypes.c_int,                     # n_images
+            ctypes.POINTER(ctypes.c_float),   # out embeddings [n_images, dim]
+            ctypes.POINTER(ctypes.c_int)      # out ok flags [n_images]
+        ]
+
+    # embed_bgr_batch → int, one batched forward over contiguous decoded BGR crops (newer builds)
+    if hasattr(face_engine, "embed_bgr_batch"):
+        face_engine.embed_bgr_batch.restype = ctypes.c_int
+        face_engine.embed_bgr_batch.argtypes = [
+            ctypes.POINTER(ctypes.c_uint8),   # pixels [n_images, rows, cols, 3]
+            ctypes.c_int,                     # n_images
+            ctypes.c_int,                     # rows
+            ctypes.c_int,                     # cols
+            ctypes.POINTER(ctypes.c_float),   # out embeddings [n_images, dim]
+            ctypes.POINTER(ctypes.c_int)      # out ok flags [n_images]
+        ]
+
     # cosine_similarity → double
     cosine_lib.cosine_similarity.restype = ctypes.c_double
     cosine_lib.cosine_similarity.argtypes = [
@@ -87,6 +151,40 @@ try:
         ctypes.POINTER(ctypes.c_double)   # best_score
     ]
 
+    # Optional float32 SIMD kernels (simd_match.cpp) — only in newer builds
+    if hasattr(face_engine, "best_match_many"):
+        face_engine.simd_level_name.restype = ctypes.c_char_p
+        face_engine.simd_num_threads.restype = ctypes.c_int
+
+        face_engine.best_match_f32.restype = ctypes.c_int
+        face_engine.best_match_f32.argtypes = [
+            ctypes.POINTER(ctypes.c_float),   # input (normalized)
+            ctypes.POINTER(ctypes.c_float),   # all embeddings (normalized, row-major)
+            ctypes.c_int,                     # n_rows
+            ctypes.c_int,                     # dim
+            ctypes.POINTER(ctypes.c_float),   # per-row thresholds (nullable)
+            ctypes.POINTER(ctypes.c_float)    # best_score
+        ]
+
+        face_engine.best_match_many.restype = None
+        face_engine.best_match_many.argtypes = [
+            ctypes.POINTER(ctypes.c_float),   # inputs [F, D]
+            ctypes.c_int,                     # n_inputs
+            ctypes.POINTER(ctypes.c_float),   # all embeddings [N, D]
+            ctypes.c_int,                     # n_rows
+            ctypes.c_int,                     # dim
+            ctypes.POINTER(ctypes.c_float),   # per-row thresholds (nullable)
+            ctypes.POINTER(ctypes.c_int),     # out best row per input
+            ctypes.POINTER(ctypes.c_float)    # out best score per input
+        ]
+        simd_lib = face_engine
+        print(
+            f"✅ C++ SIMD matcher ready ({face_engine.simd_level_name().decode()}, "
+            f"{face_engine.simd_num_threads()} threads)"
+        )
+    else:
+        simd_lib = None
+
     # Quick test to ensure functions are callable
     v1 = np.array([1.0, 2.0, 3.0], dtype=np.float64)
     v2 = np.array([1.0, 2.0, 3.0], dtype=np.float64)
@@ -99,6 +197,111 @@ try:
 except Exception as e:
     print(f"❌ Failed to load C++ Face Engine: {e}")
     face_engine = None
+    cosine_lib = None
+    vector_lib = None
+    simd_lib = None
+
+# Zero-copy extension module (pybind11, built next to the library when available):
+# bytes / NumPy in, NumPy out, GIL released inside — preferred over ctypes + JSON
+native_ext = None
+if face_engine is not None:
+    try:
+        sys.path.insert(0, _build_dir)
+        import _face_engine as native_ext
+        print(f"✅ Loaded _face_engine extension (SIMD {native_ext.simd_level()})")
+    except ImportError:
+        native_ext = None
+    finally:
+        sys.path.remove(_build_dir)
+
+# -------------------------
+# Matching backend selection
+# -------------------------
+# "numpy"  → float32 index, one BLAS matrix-vector product per probe (default)
+# "native" → C++ float32 SIMD kernels (AVX2/AVX-512/NEON, OpenMP-sharded batches)
+# "ctypes" → legacy C++ best_match loop over a float64 copy (fallback)
+MATCH_BACKEND = os.environ.get("FACETRACK_MATCH_BACKEND", "numpy").strip().lower()
+
+# Approximate (IVF) search kicks in automatically once the index has this many rows;
+# below it the exact scan is both faster and exact.
+ANN_MIN_ROWS = int(os.environ.get("FACETRACK_ANN_MIN_ROWS", "20000"))
+ANN_NPROBE = int(os.environ.get("FACETRACK_ANN_NPROBE", "8"))
+
+# Multi-worker mode (POSIX): path of a shared memory-mapped index file, e.g. /dev/shm/facetrack.idx.
+# One worker builds it, every worker maps it read-only. Empty = each process keeps a private index.
+SHARED_INDEX_PATH = os.environ.get("FACETRACK_SHARED_INDEX", "").strip()
+SHARED_INDEX_POLL = float(os.environ.get("FACETRACK_SHARED_INDEX_POLL", "1.0"))  # seconds
+
+# Persistent index snapshot for fast cold start (keyed by a DB change marker). Empty = disabled.
+INDEX_SNAPSHOT_PATH = os.environ.get(
+    "FACETRACK_INDEX_SNAPSHOT",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "embedding_index.idx"),
+).strip()
+INDEX_SNAPSHOT_DELAY = float(os.environ.get("FACETRACK_INDEX_SNAPSHOT_DELAY", "5.0"))  # shared-mode re-save debounce, seconds
+
+# Inference executor: recognition work runs on these threads, never on the event loop.
+# Default workers match the native engine pool (half the cores); a full queue answers 429,
+# an overloaded one 503, and /mark is always served ahead of /search and /preview.
+INFERENCE_WORKERS = int(os.environ.get("FACETRACK_INFERENCE_WORKERS", "0")) or max(1, (os.cpu_count() or 2) // 2)
+INFERENCE_QUEUE = int(os.environ.get("FACETRACK_INFERENCE_QUEUE", "64"))
+INFERENCE_MAX_WAIT = float(os.environ.get("FACETRACK_INFERENCE_MAX_WAIT", "5.0"))  # seconds
+
+inference = InferenceExecutor(INFERENCE_WORKERS, INFERENCE_QUEUE, INFERENCE_MAX_WAIT)
+
+# Preview micro-batching: crops arriving within BATCH_WAIT_MS of each other (up to BATCH_MAX)
+# share one batched ArcFace forward and one matrix match. BATCH_MAX=1 disables coalescing.
+# At most BATCH_IN_FLIGHT preview batches run at once; arrivals meanwhile join the next batch.
+PREVIEW_BATCH_MAX = int(os.environ.get("FACETRACK_BATCH_MAX", "16"))
+PREVIEW_BATCH_WAIT_MS = float(os.environ.get("FACETRACK_BATCH_WAIT_MS", "5"))
+PREVIEW_BATCH_IN_FLIGHT = int(os.environ.get("FACETRACK_BATCH_IN_FLIGHT", "1"))
+
+# Preview embedding cache: near-identical crops (dHash within EMBED_CACHE_DISTANCE of 256 bits)
+# from the same kiosk face slot reuse an embedding for up to EMBED_CACHE_TTL seconds.
+# EMBED_CACHE_SIZE=0 disables it. /mark always runs a fresh inference.
+EMBED_CACHE_SIZE = int(os.environ.get("FACETRACK_EMBED_CACHE_SIZE", "1024"))
+EMBED_CACHE_TTL = float(os.environ.get("FACETRACK_EMBED_CACHE_TTL", "2.0"))  # seconds
+EMBED_CACHE_DISTANCE = int(os.environ.get("FACETRACK_EMBED_CACHE_DISTANCE", "12"))  # Hamming bits
+
+embedding_cache = (
+    EmbeddingCache(EMBED_CACHE_SIZE, EMBED_CACHE_TTL, EMBED_CACHE_DISTANCE) if EMBED_CACHE_SIZE > 0 else None
+)
+
+# Pre-inference quality gate for kiosk crops (/preview, /mark): tiny, mis-proportioned, dark,
+# blown-out or blurry crops are answered immediately with a reason instead of running ArcFace
+# (and the DeepFace fallback). FACETRACK_QUALITY_GATE=0 disables it.
+QUALITY_GATE_ENABLED = os.environ.get("FACETRACK_QUALITY_GATE", "1").strip() != "0"
+quality_gate = QualityGate(
+    min_side=int(os.environ.get("FACETRACK_MIN_FACE_PX", "40")),
+    max_aspect=float(os.environ.get("FACETRACK_MAX_FACE_ASPECT", "2.0")),
+    min_brightness=float(os.environ.get("FACETRACK_MIN_BRIGHTNESS", "35")),
+    max_brightness=float(os.environ.get("FACETRACK_MAX_BRIGHTNESS", "230")),
+    min_sharpness=float(os.environ.get("FACETRACK_MIN_SHARPNESS", "15")),
+) if QUALITY_GATE_ENABLED else None
+
+def screen_crops(crops):
+    """
+    → (indices of the crops that may be embedded, verdict of the first rejected crop or None).
+    The verdict carries the machine-readable reason + metrics returned to the kiosk.
+    """
+    if quality_gate is None:
+        return list(range(len(crops))), None
+    verdicts = quality_gate.check_crops(crops)
+    kept = [i for i, verdict in enumerate(verdicts) if verdict["ok"]]
+    rejected = next((verdict for verdict in verdicts if not verdict["ok"]), None)
+    if rejected is not None:
+        logger.info(f"🚫 {len(crops) - len(kept)}/{len(crops)} crop(s) rejected before inference: {rejected['reason']}")
+    return kept, rejected
+
+def upload_crops(contents: bytes):
+    """
+    Uploaded file bytes → list of face crops. A raw-crop upload (application/octet-stream,
+    see utils/crop_wire.py) yields its pre-aligned 112x112 BGR arrays, which are embedded
+    without any decode or resize; anything else is one encoded image (JPEG/PNG bytes).
+    Raises CropWireError for a malformed raw-crop upload.
+    """
+    if is_raw_crops(contents):
+        return list(parse_crops(contents))
+    return [contents]
 
 # -------------------------
 # Smart Log Management (auto-truncate when file > 5 MB)
@@ -202,6 +405,9 @@ def _auto_clear_memory():
                 gc.collect()
                 tf.keras.backend.clear_session()
                 logger.info("✅ TensorFlow session and Python GC cleared.")
+                # clear_session drops the Keras ArcFace/MTCNN graphs — rebuild them here,
+                # not on the next kiosk frame that needs the DeepFace fallback
+                warm_up_backends(["deepface"])
 
             time.sleep(300)  # check every 5 minutes
         except Exception as e:
@@ -229,6 +435,13 @@ JST = timezone(timedelta(hours=9))
 # =====================================================
 # Export Embeddings for Frontend Hybrid Recognition
 # =====================================================
+def frontend_embedding(user):
+    """Single embedding for the frontend cache (mean when several are stored)."""
+    emb = json.loads(user.embedding) if isinstance(user.embedding, str) else user.embedding
+    if isinstance(emb[0], list):
+        emb = np.mean(np.array(emb), axis=0).tolist()
+    return emb
+
 def get_embeddings_cache():
     """
     Returns all user embeddings as a dictionary {name: [embedding]}.
@@ -236,7 +449,6 @@ def get_embeddings_cache():
     """
     from models.User import User
     from utils.db import SessionLocal
-    import json
 
     embeddings = {}
     try:
@@ -245,11 +457,7 @@ def get_embeddings_cache():
             for user in users:
                 if user.embedding is not None:
                     try:
-                        emb = json.loads(user.embedding) if isinstance(user.embedding, str) else user.embedding
-                        # If stored as list of embeddings, take mean
-                        if isinstance(emb[0], list):
-                            emb = np.mean(np.array(emb), axis=0).tolist()
-                        embeddings[user.name] = emb
+                        embeddings[user.name] = frontend_embedding(user)
                     except Exception as e:
                         logger.info(f"⚠️ Failed to parse embedding for {user.name}: {e}")
                         continue
@@ -344,96 +552,611 @@ def cpp_detect_and_embed(image_path: str):
         logger.warning(f"⚠️ C++ detect_and_embed failed: {e}")
         return []
 
-def detect_faces(tmp_path):
+def cpp_detect_and_embed_buffer(contents: bytes):
     """
-    Detect faces and generate embeddings using the native C++ engine.
-    Falls back to DeepFace if C++ engine fails or detects nothing.
+    Native engine on the encoded upload bytes (cv::imdecode in C++, no temp file).
+    Newer builds write straight into caller-owned buffers (re-entrant, no JSON); each
+    call leases its own ArcFace instance from the engine pool (FACETRACK_ENGINE_POOL).
     """
-    # Blaze already gives cropped face — directly use ArcFace embedding
-    faces = cpp_detect_and_embed(tmp_path) if face_engine else []
+    try:
+        if native_ext is not None:
+            result = native_ext.embed(contents)
+            if result is None:
+                return []
+            embedding, (x, y, w, h) = result
+            return [{"embedding": embedding, "facial_area": {"x": x, "y": y, "w": w, "h": h}}]
+
+        if hasattr(face_engine, "embed_buffer_into"):
+            dim = face_engine.embedding_dim()
+            embedding = np.empty(dim, dtype=np.float32)
+            box = (ctypes.c_int * 4)()
+            found = face_engine.embed_buffer_into(
+                contents, len(contents), embedding.ctypes.data_as(ctypes.POINTER(ctypes.c_float)), dim, box
+            )
+            if found <= 0:
+                return []
+            return [{
+                "embedding": embedding.tolist(),
+                "facial_area": {"x": box[0], "y": box[1], "w": box[2], "h": box[3]},
+            }]
+
+        result = face_engine.detect_and_embed_buffer(contents, len(contents))
+        if not result:
+            return []
+        return json.loads(result.decode("utf-8"))
+    except Exception as e:
+        logger.warning(f"⚠️ C++ detect_and_embed_buffer failed: {e}")
+        return []
 
-    # --- Fallback to DeepFace if C++ engine found nothing ---
-    if not faces:
-        logger.warning("⚠️ ArcFace embedding failed, fallback to DeepFace")
+def cpp_embed_batch(images):
+    """
+    Embed several encoded face crops with one batched ArcFace forward pass.
+    Returns a list parallel to `images`: embedding (floats) or None if it failed.
+    """
+    n = len(images)
+    if n == 0 or not face_engine or not hasattr(face_engine, "embed_batch"):
+        return [None] * n
+    if native_ext is not None:
         try:
-            reps = DeepFace.represent(
-                img_path=tmp_path,
-                model_name="ArcFace",
-                detector_backend="mtcnn",
-                enforce_detection=False
+            out, ok = native_ext.embed_batch([bytes(img) for img in images])
+        except RuntimeError as e:
+            logger.warning(f"⚠️ C++ embed_batch failed: {e}")
+            return [None] * n
+        return [out[i] if ok[i] else None for i in range(n)]
+    dim = face_engine.embedding_dim()
+    buffers = (ctypes.c_char_p * n)(*[bytes(img) for img in images])
+    lengths = (ctypes.c_size_t * n)(*[len(img) for img in images])
+    out = np.zeros((n, dim), dtype=np.float32)
+    ok = np.zeros(n, dtype=np.int32)
+
+    count = face_engine.embed_batch(
+        buffers, lengths, n,
+        out.ctypes.data_as(ctypes.POINTER(ctypes.c_float)),
+        ok.ctypes.data_as(ctypes.POINTER(ctypes.c_int)),
+    )
+    if count < 0:
+        logger.warning("⚠️ C++ embed_batch failed")
+        return [None] * n
+    return [out[i].tolist() if ok[i] else None for i in range(n)]
+
+def cpp_embed_pixels(crops):
+    """
+    Embed decoded BGR crops (raw-crop uploads) with one batched forward, straight from
+    their pixels — no encode/decode round trip. Returns a list parallel to `crops`:
+    embedding or None. Crops of different sizes are embedded one shape group at a time.
+    """
+    n = len(crops)
+    results = [None] * n
+    groups = {}
+    for i, crop in enumerate(crops):
+        groups.setdefault(crop.shape, []).append(i)
+
+    for shape, rows in groups.items():
+        stack = np.ascontiguousarray(np.stack([crops[i] for i in rows]), dtype=np.uint8)
+        if native_ext is not None and hasattr(native_ext, "embed_images"):
+            try:
+                out, ok = native_ext.embed_images(stack)
+            except RuntimeError as e:
+                logger.warning(f"⚠️ C++ embed_images failed: {e}")
+                continue
+        else:
+            dim = face_engine.embedding_dim()
+            out = np.zeros((len(rows), dim), dtype=np.float32)
+            ok = np.zeros(len(rows), dtype=np.int32)
+            count = face_engine.embed_bgr_batch(
+                stack.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8)), len(rows), shape[0], shape[1],
+                out.ctypes.data_as(ctypes.POINTER(ctypes.c_float)),
+                ok.ctypes.data_as(ctypes.POINTER(ctypes.c_int)),
             )
+            if count < 0:
+                logger.warning("⚠️ C++ embed_bgr_batch failed")
+                continue
+        for j, i in enumerate(rows):
+            if ok[j]:
+                results[i] = out[j]
+    return results
+
+# -------------------------
+# Embedding backend selection
+# -------------------------
+# "auto"     → native C++ engine if loaded, else ONNX Runtime if the model + package exist, else DeepFace
+# "native"   → libface_engine (cv::dnn ArcFace)
+# "onnx"     → ONNX Runtime CPU on FACETRACK_ONNX_MODEL (FACETRACK_ONNX_THREADS intra-op threads, 0 = ORT default)
+# "deepface" → DeepFace ArcFace + MTCNN (TensorFlow)
+# DeepFace is always built as well: it is the detection fallback when the primary backend finds nothing.
+EMBED_BACKEND = os.environ.get("FACETRACK_EMBED_BACKEND", "auto").strip().lower()
+ONNX_MODEL_PATH = os.environ.get(
+    "FACETRACK_ONNX_MODEL",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "arcface.onnx"),
+)
+ONNX_THREADS = int(os.environ.get("FACETRACK_ONNX_THREADS", "0"))
+
+def _native_embed_one(crop: bytes):
+    faces = cpp_detect_and_embed_buffer(crop)
+    return faces[0]["embedding"] if faces else None
+
+def _build_embedding_backends():
+    backends = {}
+    if face_engine is not None and hasattr(face_engine, "detect_and_embed_buffer"):
+        batched = hasattr(face_engine, "embed_batch")
+        pixels = hasattr(face_engine, "embed_bgr_batch")
+        backends["native"] = NativeBackend(
+            _native_embed_one, cpp_embed_batch if batched else None, cpp_embed_pixels if pixels else None
+        )
+    if EMBED_BACKEND in ("onnx", "auto"):
+        try:
+            backends["onnx"] = OnnxBackend(ONNX_MODEL_PATH, ONNX_THREADS)
+        except Exception as e:
+            if EMBED_BACKEND == "onnx":
+                logger.warning(f"⚠️ ONNX Runtime backend unavailable: {e}")
+    try:
+        backends["deepface"] = DeepFaceBackend("mtcnn")
+    except Exception as e:
+        logger.warning(f"⚠️ DeepFace backend unavailable: {e}")
+    return backends
 
-            if isinstance(reps, dict):
-                reps = [reps]
+embedding_backends = _build_embedding_backends()
 
-            faces = []
-            for rep in reps:
-                emb = rep.get("embedding", [])
-                box = rep.get("facial_area", {})
-                faces.append({"embedding": emb, "facial_area": box})
+if EMBED_BACKEND in embedding_backends:
+    embedder = embedding_backends[EMBED_BACKEND]
+else:
+    if EMBED_BACKEND != "auto":
+        logger.warning(f"⚠️ Embedding backend '{EMBED_BACKEND}' unavailable — choosing automatically")
+    embedder = next(embedding_backends[n] for n in ("native", "onnx", "deepface") if n in embedding_backends)
+print(f"✅ Embedding backend: {embedder.name} (available: {', '.join(embedding_backends)})")
 
-        except Exception as e:
-            logger.error(f"❌ DeepFace fallback failed: {e}")
-            faces = []
+def embed_crops(crops):
+    """
+    Encoded face crops → one faces list per crop ([] where the backend found nothing),
+    from a single embedder.embed() call (batched forward where the backend supports it).
+    DeepFace detects inside each crop, so it returns every face it found, with boxes.
+    """
+    try:
+        if embedder.name == "deepface":
+            return embedder.represent(crops)
+        out = embedder.embed(crops)
+    except Exception as e:
+        logger.warning(f"⚠️ {embedder.name} embedding failed: {e}")
+        return [[] for _ in crops]
+    ok = embedded_rows(out)
+    return [[{"embedding": out[i], "facial_area": {}}] if ok[i] else [] for i in range(len(crops))]
 
+def detect_faces(image):
+    """
+    Generate embeddings with the configured embedding backend.
+    `image` is the encoded upload (bytes, decoded in memory), a decoded BGR crop
+    (raw-crop upload) or a file path (legacy).
+    Falls back to DeepFace + MTCNN detection if the backend finds nothing.
+    """
+    in_memory = isinstance(image, (bytes, bytearray, np.ndarray))
+
+    # Blaze already gives cropped face — directly use ArcFace embedding
+    faces = []
+    if in_memory:
+        faces = embed_crops([image if isinstance(image, np.ndarray) else bytes(image)])[0]
+    elif face_engine:
+        faces = cpp_detect_and_embed(image)
+
+    if not faces and not (in_memory and embedder.name == "deepface"):  # DeepFace already tried
+        faces = fallback_faces(image)
+    return faces
+
+def detect_crop_faces(crops):
+    """
+    Several crops of one frame (a raw-crop upload) → one faces list per crop, from one
+    batched embedder call; only the crops the backend could not embed fall back to DeepFace.
+    """
+    faces = []
+    for crop, found in zip(crops, embed_crops(list(crops))):
+        if not found and embedder.name != "deepface":
+            found = fallback_faces(crop)
+        faces.append(found)
+    return faces
+
+def fallback_faces(image):
+    """DeepFace + MTCNN on the whole upload — for crops the primary backend could not embed."""
+    logger.warning("⚠️ ArcFace embedding failed, fallback to DeepFace")
+    try:
+        img = decode_image(image) if isinstance(image, (bytes, bytearray)) else image  # DeepFace takes BGR arrays too
+        if img is None:
+            return []
+        return deepface_embed(img)
+    except Exception as e:
+        logger.error(f"❌ DeepFace fallback failed: {e}")
+        return []
+
+def deepface_embed(img):
+    """DeepFace ArcFace (+ MTCNN) on a BGR array or path → [{"embedding", "facial_area"}, ...]."""
+    reps = DeepFace.represent(
+        img_path=img,
+        model_name="ArcFace",
+        detector_backend="mtcnn",
+        enforce_detection=False
+    )
+
+    if isinstance(reps, dict):
+        reps = [reps]
+
+    faces = []
+    for rep in reps:
+        emb = rep.get("embedding", [])
+        box = rep.get("facial_area", {})
+        faces.append({"embedding": emb, "facial_area": box})
     return faces
 
 # -------------------------
-# Embedding Cache in Memory (Vectorized)
+# Backend Warm-up & Readiness
 # -------------------------
-embedding_cache = []   # raw list of users (optional for debugging)
-all_embeddings = None  # big NumPy array [N, D]
-user_ids = []          # parallel list of IDs
-user_names = []        # parallel list of names
+# Models load lazily (native engine pool, Keras ArcFace + MTCNN), so the first frame
+# after boot would pay model construction. warm_up_backends() runs one dummy inference
+# on each configured backend at startup; recognition endpoints answer 503 "warming_up"
+# until it finishes, so kiosks retry instead of hanging on a cold model.
+WARMUP_ENABLED = os.environ.get("FACETRACK_WARMUP", "1").strip() != "0"
+
+inference_ready = threading.Event()
+_warmup_report = {}   # backend → {"ok": bool, "ms": float | "error": str}
+
+def _dummy_face_crop(size=112):
+    """Smooth synthetic crop (BGR array + JPEG bytes) — content is irrelevant for warm-up."""
+    rng = np.random.default_rng(0)
+    img = cv2.GaussianBlur(rng.integers(0, 256, (size, size, 3), dtype=np.uint8), (9, 9), 0)
+    ok, buf = cv2.imencode(".jpg", img)
+    return img, buf.tobytes()
+
+def warm_up_backends(names=None):
+    """Run one dummy inference on each configured backend (or only `names`), then mark ready."""
+    _, crop = _dummy_face_crop()
+    # deepface is always built (it is the /mark + /preview fallback): warming it builds ArcFace + MTCNN
+    for name, backend in embedding_backends.items():
+        if names is not None and name not in names:
+            continue
+        t0 = time.perf_counter()
+        try:
+            backend.embed([crop])  # native: loads the whole engine pool
+            backend.reset_stats()  # keep model construction out of the latency stats
+            _warmup_report[name] = {"ok": True, "ms": round((time.perf_counter() - t0) * 1000, 1)}
+            logger.info(f"🔥 Warmed {name} backend in {_warmup_report[name]['ms']} ms")
+        except Exception as e:
+            _warmup_report[name] = {"ok": False, "error": str(e)}
+            logger.warning(f"⚠️ Warm-up failed for {name} backend: {e}")
+    if names is None:
+        inference_ready.set()  # best effort: a failed backend must not keep the API closed
+
+def start_warm_up():
+    """Warm every backend in the background (called from app startup)."""
+    if not WARMUP_ENABLED:
+        inference_ready.set()
+        return
+    threading.Thread(target=warm_up_backends, daemon=True, name="warm-up").start()
+
+def require_ready():
+    """Reject recognition with 503 until warm-up has finished."""
+    if not inference_ready.is_set():
+        raise InferenceRejected(503, "warming_up", retry_after=2)
+
+# -------------------------
+# Embedding Cache in Memory (Vectorized, copy-on-write snapshots)
+# -------------------------
+# Readers call current_snapshot() once per request and use only that object;
+# writers build a new IndexSnapshot under _index_write_lock and publish it with
+# one reference assignment — no locking on the matching path, no torn reads.
+_snapshot = IndexSnapshot()
+_index_write_lock = threading.RLock()
+
+def current_snapshot() -> IndexSnapshot:
+    """The published index snapshot (index + scoped sub-indexes)."""
+    return _snapshot
+
+def _publish(snapshot: IndexSnapshot):
+    global _snapshot
+    _snapshot = snapshot  # single atomic reference swap
+
+# -------------------------
+# Shared Index Across Workers (FACETRACK_SHARED_INDEX)
+# -------------------------
+shared_store = SharedIndexFile(SHARED_INDEX_PATH) if SHARED_INDEX_PATH else None
+if shared_store is not None and shared_store.join():
+    logger.info("🧹 Discarded shared index file left by a previous server run.")
+_shared_signature = None   # (inode, mtime) of the mapped file version
+_shared_info = {}          # version / group / size of the mapped file (for /index-stats)
+
+def _server_group():
+    """
+    Identifies the workers of one server run (same master process), so only one builds.
+    A single-process server shares its parent (the shell) across restarts; the stale file
+    such a run leaves behind is discarded by SharedIndexFile.join() before it can match.
+    """
+    try:
+        parent = psutil.Process(os.getppid())
+        return f"{parent.pid}:{parent.create_time():.0f}"
+    except Exception:
+        return str(os.getppid())
+
+def _index_from_file(data, copy=False):
+    """
+    Decoded index file (SharedIndexFile.read()) → (EmbeddingIndex, department scopes).
+    Rows are grouped by department, so each scope is a zero-copy row range of the index.
+    """
+    meta = data["meta"]
+    index = EmbeddingIndex(
+        data["vectors"] if len(data["user_ids"]) else None,
+        data["user_ids"], meta["names"], data["thresholds"],
+        normalized=True, copy=copy,
+    )
+    if "scope_rows" in meta:
+        scopes = {name: index.row_range(start, end) for name, (start, end) in meta["scope_rows"].items()}
+    else:  # file written before scope grouping: member ids
+        scopes = {name: index.subset(ids) for name, ids in meta["scopes"].items()}
+    return index, scopes
+
+def _write_index_file(store: SharedIndexFile, snapshot: IndexSnapshot, **meta):
+    """
+    Write the live rows of `snapshot` as a new file version, grouped by department:
+    each department scope is stored as its [start, end) row range, not as a copy.
+    """
+    index = snapshot.index
+    department = {
+        int(uid): name
+        for name, idx in snapshot.scopes.items()
+        if name.startswith("dept:")
+        for uid, count in zip(idx.identity_ids, idx.identity_counts) if count > 0
+    }
+    groups = {}
+    live = np.flatnonzero(index.alive)
+    for row, uid in zip(live.tolist(), index.user_ids[live].tolist()):
+        groups.setdefault(department.get(uid), []).append(row)
+
+    order, scope_rows = [], {}
+    for name in sorted(name for name in groups if name is not None):
+        scope_rows[name] = [len(order), len(order) + len(groups[name])]
+        order.extend(groups[name])
+    order.extend(groups.get(None, []))  # users without a department
+    order = np.asarray(order, dtype=np.int64)
+
+    return store.write(
+        index.vectors[order], index.user_ids[order], index.thresholds[order],
+        dict(meta, names=[index.names[i] for i in order], scope_rows=scope_rows),
+    )
+
+def _attach_shared():
+    """Map the newest shared index file (zero-copy) and publish it; no-op if already mapped."""
+    global _shared_signature, _shared_info
+    if shared_store.signature() in (None, _shared_signature):
+        return False
+    data = shared_store.read()
+    if data is None:
+        return False
+
+    index, scopes = _index_from_file(data)
+    # Roster is per-worker derived data → rebuilt lazily on the next roster request
+    _publish(current_snapshot().evolve(index=index, scopes=scopes, roster_date=None))
+
+    _shared_signature = data["signature"]
+    _shared_info = {"version": data["version"], "group": data["meta"].get("group"), "mapped_bytes": data["nbytes"]}
+    logger.info(
+        f"🔗 Attached shared index v{data['version']} ({len(index)} rows, "
+        f"{data['nbytes'] / 1024:.1f} KB mapped)"
+    )
+    return True
+
+@contextmanager
+def _index_writer():
+    """Serialise index writers — across threads, and across worker processes in shared mode."""
+    with _index_write_lock:
+        if shared_store is None:
+            yield
+            return
+        with shared_store.locked():
+            _attach_shared()  # mutate the newest version, not this worker's stale copy
+            yield
+
+def _commit(snapshot: IndexSnapshot, marker=None):
+    """
+    Publish a new snapshot; in shared mode write it to the shared file and re-map it.
+    Full rebuilds pass their DB `marker` and are persisted right away; incremental
+    changes mark the persisted file stale (see _invalidate_persisted).
+    """
+    if shared_store is None:
+        _publish(snapshot)
+    else:
+        _write_index_file(shared_store, snapshot, group=_server_group())
+        _attach_shared()
+
+    if marker is not None:
+        _save_persisted(marker)
+    else:
+        _invalidate_persisted()
+
+def _watch_shared_index():
+    """Re-map when another worker publishes a new version (keeps the request path lock-free)."""
+    while True:
+        time.sleep(SHARED_INDEX_POLL)
+        try:
+            if shared_store.signature() != _shared_signature:
+                with _index_write_lock:
+                    _attach_shared()
+        except Exception as e:
+            logger.warning(f"⚠️ Shared index re-map failed: {e}")
+
+if shared_store is not None:
+    threading.Thread(target=_watch_shared_index, daemon=True, name="shared-index-watch").start()
+
+# -------------------------
+# Persistent Index Snapshot (FACETRACK_INDEX_SNAPSHOT)
+# -------------------------
+# The built index is saved in the same binary layout as the shared index, tagged
+# with a DB change marker. Startup loads it instead of parsing every embedding JSON
+# blob when the marker still matches; any mismatch falls back to a DB rebuild.
+persist_store = SharedIndexFile(INDEX_SNAPSHOT_PATH) if INDEX_SNAPSHOT_PATH else None
+_loaded_marker = None      # DB marker the published index was loaded / saved with
+_persist_timer = None
+
+def _db_marker(db: Session):
+    """
+    Cheap fingerprint of the active users (count, max id, checksum of every column the
+    index uses) — one aggregate query, no embedding JSON leaves the database.
+    """
+    row = (
+        db.query(
+            func.count(User.id),
+            func.max(User.id),
+            func.sum(func.crc32(func.concat_ws(
+                "|", User.id, User.name, User.department, User.threshold, User.embedding
+            ))),
+        )
+        .filter(User.is_active == True)
+        .one()
+    )
+    return [str(v) for v in row]
+
+def _save_persisted(marker):
+    """Write the published index to the snapshot file under `marker`."""
+    global _loaded_marker
+    _loaded_marker = marker
+    if persist_store is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(INDEX_SNAPSHOT_PATH) or ".", exist_ok=True)
+        with persist_store.locked():
+            version = _write_index_file(persist_store, current_snapshot(), marker=marker)
+        logger.info(f"💾 Saved index snapshot v{version} → {INDEX_SNAPSHOT_PATH}")
+    except Exception as e:
+        logger.warning(f"⚠️ Index snapshot save skipped: {e}")
+
+def _invalidate_persisted():
+    """
+    An incremental change makes the saved file stale. It is left in place: its marker no
+    longer matches the database, so the next startup rebuilds instead of loading it.
+    Shared mode re-saves after a short debounce (see _resave_persisted); private indexes
+    are only ever persisted at the end of a full rebuild.
+    """
+    global _loaded_marker, _persist_timer
+    _loaded_marker = None
+    if persist_store is None or shared_store is None:
+        return
+
+    if _persist_timer is not None:
+        _persist_timer.cancel()
+    _persist_timer = threading.Timer(INDEX_SNAPSHOT_DELAY, _resave_persisted)
+    _persist_timer.daemon = True
+    _persist_timer.start()
+
+def _resave_persisted():
+    """
+    Debounced re-save after incremental changes (shared mode only). The newest shared
+    version (attached under the writer lock) holds every worker's patches; the marker is
+    computed under that lock, and a DB change not yet applied is always followed by an
+    upsert, which schedules this save again. A private index may miss another worker's
+    patch, so it is never saved under a DB marker.
+    """
+    try:
+        with SessionLocal() as db:
+            with _index_writer():
+                _save_persisted(_db_marker(db))
+    except Exception as e:
+        logger.warning(f"⚠️ Index snapshot re-save skipped: {e}")
+
+def _load_persisted(marker):
+    """Index + scopes from the snapshot file if it was saved under `marker`, else None."""
+    if persist_store is None:
+        return None
+    try:
+        data = persist_store.read()
+        if data is None or data["meta"].get("marker") != marker:
+            return None
+        return _index_from_file(data, copy=True)  # private copy → the file can be replaced freely
+    except Exception as e:
+        logger.warning(f"⚠️ Index snapshot unreadable ({e}) — rebuilding from DB.")
+        return None
+
+def _stored_embeddings(user: User):
+    """User.embedding JSON → list of embeddings (a single vector is wrapped)."""
+    stored = json.loads(user.embedding)
+    if isinstance(stored[0], (int, float)):
+        stored = [stored]
+    return stored
 
 def load_embeddings(db: Session):
-    """Load all active user embeddings into memory (vectorized for fast cosine similarity)."""
-    global embedding_cache, all_embeddings, user_ids, user_names
+    """
+    Load all active user embeddings into a new snapshot (vectorized for fast cosine similarity).
+    In shared mode, workers of the same server run attach the file the first one built.
+    """
+    with _index_writer():
+        if shared_store is not None and _shared_info.get("group") == _server_group():
+            logger.info("🔗 Shared index already built by another worker — attached.")
+            return
+
+        marker = None
+        try:
+            marker = _db_marker(db)
+        except Exception as e:
+            logger.warning(f"⚠️ DB change marker unavailable ({e}) — snapshot file not used.")
+
+        if marker is not None:
+            if marker == _loaded_marker:
+                logger.info("✅ Embedding index already current — reload skipped.")
+                return
+            persisted = _load_persisted(marker)
+            if persisted is not None:
+                index, scopes = persisted
+                _publish_loaded(db, index, scopes, marker)
+                logger.info(f"⚡ Loaded {len(index)} embeddings from index snapshot (marker matched).")
+                return
 
+        _load_embeddings_locked(db, marker)
+
+def _publish_loaded(db: Session, index: EmbeddingIndex, scopes: dict, marker):
+    """Attach the optional companions + today's roster to a freshly loaded index and commit it."""
+    # Shared mode keeps only the mapped float32 rows (no per-worker IVF copy)
+    if shared_store is None and len(index) >= ANN_MIN_ROWS:
+        recall = index.build_ann(n_probe=ANN_NPROBE)
+        logger.info(f"🧭 Built IVF index ({index.ann.n_lists} lists, nprobe={ANN_NPROBE}) — recall@1={recall:.3f}")
+
+    rostered = _rostered_user_ids(db)
+    if rostered is not None:
+        scopes["roster"] = index.subset(rostered)
+
+    _commit(current_snapshot().evolve(
+        index=index,
+        scopes=scopes,
+        roster_date=date.today() if rostered is not None else None,
+    ), marker=marker)
+
+def _load_embeddings_locked(db: Session, marker):
     users = db.query(User).filter(User.is_active == True).all()
 
-    cache = []
-    ids, names, np_list = [], [], []
+    ids, names, rows, thresholds = [], [], [], []
+    departments = {}
 
     for user in users:
         try:
-            stored_embeddings = json.loads(user.embedding)
-
-            # Ensure always list of embeddings
-            if isinstance(stored_embeddings[0], (int, float)):
-                stored_embeddings = [stored_embeddings]
-
-            np_embs = np.array(stored_embeddings, dtype=float)
-            # normalize each row
-            np_embs = np_embs / np.linalg.norm(np_embs, axis=1, keepdims=True)
-
-            # store user
-            cache.append({
-                "id": user.id,
-                "name": user.name,
-                "embeddings": stored_embeddings,
-                "np_embeddings": np_embs,
-                "threshold": user.threshold,
-            })
+            stored_embeddings = _stored_embeddings(user)
+            departments[user.id] = user.department
 
             # for vectorized lookup, store each embedding row
-            for row in np_embs:
-                np_list.append(row)
+            for row in stored_embeddings:
+                rows.append(row)
                 ids.append(user.id)
                 names.append(user.name)
+                thresholds.append(user.threshold)
 
         except Exception as e:
             logger.warning(f"⚠️ Failed to load embeddings for {user.name}: {e}")
 
-    embedding_cache = cache
-    user_ids = ids
-    user_names = names
-    all_embeddings = np.vstack(np_list) if np_list else None
+    # Rows are normalized once here — matching never recomputes norms
+    index = EmbeddingIndex(rows, ids, names, thresholds)
+    _publish_loaded(db, index, build_department_indexes(index, departments), marker)
 
-    logger.info(f"✅ Loaded {len(user_ids)} embeddings for {len(users)} users into cache.")
+    logger.info(
+        f"✅ Loaded {len(index)} embeddings for {len(users)} users into cache "
+        f"({index.nbytes / 1024:.1f} KB float32, backend={MATCH_BACKEND})."
+    )
 
 def refresh_embeddings():
-    """Safely refresh the embedding cache — skips if tables not ready."""
+    """
+    Safely refresh the embedding cache — skips if tables not ready.
+    Requests keep matching against the current snapshot until the new one is published.
+    """
     try:
         with SessionLocal() as db:
             inspector = inspect(db.bind)
@@ -445,6 +1168,156 @@ def refresh_embeddings():
     except Exception as e:
         logger.warning(f"⚠️ Safe refresh skipped: {e}")
 
+# -------------------------
+# Scoped Sub-Indexes (per department/site + today's roster)
+# -------------------------
+def _scope_key(name: str) -> str:
+    return " ".join((name or "").split()).lower()
+
+def build_department_indexes(index: EmbeddingIndex, departments: dict):
+    """Partition the global index by department ({user_id: department})."""
+    members = {}
+    for user_id, dept in departments.items():
+        if dept:
+            members.setdefault(_scope_key(dept), []).append(user_id)
+
+    return {f"dept:{dept}": index.subset(ids) for dept, ids in members.items()}
+
+def _rostered_user_ids(db: Session):
+    """User ids with a shift today (explicit shifts + shift-group schedules), or None on failure."""
+    from models.Shift import Shift
+    from models.EmployeeGroup import EmployeeGroup
+    from models.ShiftGroup import ShiftGroup
+
+    try:
+        today = date.today()
+        weekday = today.strftime("%a").lower()[:3]
+
+        # Explicit shifts for today (placeholder "-" shifts mean a day off)
+        rostered = {
+            uid for uid, start in db.query(User.id, Shift.start_time)
+            .join(Shift, Shift.employee_id == User.employee_id)
+            .filter(Shift.date == today)
+            .all()
+            if start and str(start) not in ("-", "00:00", "0:00", "00:00:00")
+        }
+
+        # Group members whose weekly schedule has a shift today
+        for uid, schedule in (
+            db.query(User.id, ShiftGroup.schedule)
+            .join(EmployeeGroup, EmployeeGroup.employee_id == User.employee_id)
+            .join(ShiftGroup, ShiftGroup.id == EmployeeGroup.group_id)
+            .all()
+        ):
+            day = {k.lower(): v for k, v in (schedule or {}).items()}.get(weekday)
+            if isinstance(day, list) and len(day) == 2 and day[0] not in ("-", "00:00", ""):
+                rostered.add(uid)
+        return rostered
+    except Exception as e:
+        logger.warning(f"⚠️ Roster lookup skipped: {e}")
+        return None
+
+def refresh_roster_index(db: Session = None):
+    """Rebuild the "today's roster" sub-index from shifts + shift-group schedules."""
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
+    try:
+        rostered = _rostered_user_ids(db)
+        if rostered is None:
+            return
+        with _index_write_lock:
+            snap = current_snapshot()
+            scopes = dict(snap.scopes)
+            scopes["roster"] = snap.index.subset(rostered)
+            _publish(snap.evolve(scopes=scopes, roster_date=date.today()))
+        logger.info(f"📋 Roster index rebuilt for {date.today()}: {len(rostered)} employees")
+    finally:
+        if own_session:
+            db.close()
+
+_roster_rebuild_pending = threading.Event()
+
+def _rebuild_roster_in_background():
+    try:
+        refresh_roster_index()
+    finally:
+        _roster_rebuild_pending.clear()
+
+def get_scoped_index(scope: str, snapshot: IndexSnapshot = None):
+    """Resolve a kiosk scope ("roster" or a department/site name) → sub-index or None."""
+    key = _scope_key(scope)
+    if not key:
+        return None
+    snap = snapshot or current_snapshot()
+    if key == "roster":
+        if snap.roster_date != date.today() and not _roster_rebuild_pending.is_set():
+            # First request of a new day: rebuild off the request path, serve yesterday's meanwhile
+            _roster_rebuild_pending.set()
+            threading.Thread(target=_rebuild_roster_in_background, daemon=True).start()
+        return snap.scopes.get("roster")
+    return snap.scopes.get(f"dept:{key}")
+
+# -------------------------
+# Incremental Index Updates (register / update / delete / auto-train)
+# -------------------------
+def upsert_user_embeddings(user: User):
+    """
+    Patch one user's rows into copies of the global + scoped indexes and publish them,
+    instead of reloading every user. Inactive users (or users without embeddings) are removed.
+    """
+    if not user.is_active or not user.embedding:
+        remove_user_embeddings(user.id)
+        return
+    try:
+        stored_embeddings = _stored_embeddings(user)
+    except Exception as e:
+        logger.warning(f"⚠️ Incremental index update failed for {user.name}: {e}")
+        return
+
+    with _index_writer():
+        snap = current_snapshot()
+        try:
+            index = snap.index.clone()
+            index.upsert(user.id, stored_embeddings, user.threshold, user.name)
+        except Exception as e:
+            logger.warning(f"⚠️ Incremental index update failed for {user.name}: {e}")
+            return
+
+        # Department may have changed → drop from every department scope, then add to its own
+        scopes = dict(snap.scopes)
+        for name, idx in snap.scopes.items():
+            if name.startswith("dept:") and user.id in idx:
+                scopes[name] = idx.clone()
+                scopes[name].remove(user.id)
+        if user.department:
+            key = f"dept:{_scope_key(user.department)}"
+            scoped = scopes[key].clone() if key in scopes else EmbeddingIndex()
+            scoped.upsert(user.id, stored_embeddings, user.threshold, user.name)
+            scopes[key] = scoped
+
+        roster = snap.scopes.get("roster")
+        if roster is not None and user.id in roster:
+            scopes["roster"] = roster.clone()
+            scopes["roster"].upsert(user.id, stored_embeddings, user.threshold, user.name)
+
+        _commit(snap.evolve(index=index, scopes=scopes))
+
+def remove_user_embeddings(user_id: int):
+    """Publish a snapshot with one user's rows tombstoned in the global + scoped indexes."""
+    with _index_writer():
+        snap = current_snapshot()
+        index = snap.index.clone()
+        index.remove(user_id)
+
+        scopes = dict(snap.scopes)
+        for name, idx in snap.scopes.items():
+            if user_id in idx:
+                scopes[name] = idx.clone()
+                scopes[name].remove(user_id)
+
+        _commit(snap.evolve(index=index, scopes=scopes))
+
 # =====================================================
 # Safe Embedding Load on Import (macOS + Windows compatible)
 # =====================================================
@@ -471,142 +1344,276 @@ except Exception as e:
 # -------------------------
 # Vectorized Matching Helper
 # -------------------------
-def find_best_match(embedding, default_threshold=0.38, fallback_threshold=0.35):
-    """
-    Super-fast C++ vectorized matching — finds the most similar embedding.
-    """
-    global all_embeddings, user_names, user_ids
-    if all_embeddings is None or len(all_embeddings) == 0:
-        return None, -1, "unknown"
-
-    # --- Normalize the input embedding safely ---
-    emb = np.array(embedding, dtype=np.float64)
-    norm = np.linalg.norm(emb)
-    if norm == 0:
-        return None, -1, "unknown"
-    emb /= norm
-
-    # --- Prepare pointers for C++ ---
+def _ctypes_best_match(index: EmbeddingIndex, probe):
+    """Legacy C++ matcher (per-row cosine loop over the live float64 rows)."""
+    emb = np.ascontiguousarray(probe, dtype=np.float64)
+    all_rows = index.as_float64()
+    if all_rows.shape[0] == 0:
+        return -1, -1.0
+
     emb_ptr = emb.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
-    all_ptr = all_embeddings.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
-    n_users = all_embeddings.shape[0]
-    dim = all_embeddings.shape[1]
+    all_ptr = all_rows.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
 
     best_score = ctypes.c_double()
-    best_index = vector_lib.best_match(emb_ptr, all_ptr, n_users, dim, ctypes.byref(best_score))
-    best_score = best_score.value
+    best_index = vector_lib.best_match(
+        emb_ptr, all_ptr, all_rows.shape[0], all_rows.shape[1], ctypes.byref(best_score)
+    )
+    return index.float64_row(best_index), best_score.value
+
+def _native_best_many(index: EmbeddingIndex, probes):
+    """C++ SIMD matcher: one call scores every probe, index sharded across cores."""
+    probes = np.ascontiguousarray(probes, dtype=np.float32)
+    if native_ext is not None:
+        return native_ext.best_match_many(probes, index.vectors, index.thresholds)
+
+    n_probes = probes.shape[0]
+    rows = np.empty(n_probes, dtype=np.int32)
+    scores = np.empty(n_probes, dtype=np.float32)
+    fptr = ctypes.POINTER(ctypes.c_float)
+
+    simd_lib.best_match_many(
+        probes.ctypes.data_as(fptr), n_probes,
+        index.vectors.ctypes.data_as(fptr), len(index), index.dim,
+        index.thresholds.ctypes.data_as(fptr),
+        rows.ctypes.data_as(ctypes.POINTER(ctypes.c_int)),
+        scores.ctypes.data_as(fptr),
+    )
+    return rows, scores
+
+def _match_status(score, user_threshold, default_threshold, fallback_threshold):
+    """
+    Decide match / maybe / unknown against the user's own threshold.
+    The caller's thresholds only set relative strictness: `default_threshold`
+    shifts the user threshold (0.40 = use it as-is) and the fallback gap sets the "maybe" band.
+    """
+    strict = user_threshold + (default_threshold - DEFAULT_USER_THRESHOLD)
+    if score >= strict:
+        return "match"
+    if score >= strict - (default_threshold - fallback_threshold):
+        return "maybe"
+    return "unknown"
+
+def _best_rows(index: EmbeddingIndex, probes):
+    """Best row + raw score for each normalized probe (F, D) on the configured backend."""
+    if MATCH_BACKEND == "ctypes" and vector_lib is not None:
+        pairs = [_ctypes_best_match(index, p) for p in probes]
+        return [r for r, _ in pairs], [sc for _, sc in pairs]
+    if MATCH_BACKEND == "native" and simd_lib is not None and index.ann is None:
+        return _native_best_many(index, probes)
+    if index.ann is not None:
+        return index.ann.search_many(probes)
+    return index.best_many(probes)
+
+def find_best_matches(embeddings, default_threshold=0.38, fallback_threshold=0.35, scope: str = None,
+                      snapshot: IndexSnapshot = None):
+    """
+    Batched matching for every face in a frame.
+    Stacks the faces into one (F, D) matrix and scores them in one pass; each row is
+    picked by the best score - per-user threshold margin.
+    Backends: float32 BLAS scan (default), IVF once the index reaches ANN_MIN_ROWS rows, C++ SIMD kernels
+    (FACETRACK_MATCH_BACKEND=native) or the legacy C++ loop (FACETRACK_MATCH_BACKEND=ctypes).
+    With `scope` (a department / site name, or "roster"), the small scoped index is
+    searched first and only faces without a match there fall back to the global index.
+    Pass the request's `snapshot` so every lookup in one request sees the same index.
+    Returns a list of (match, score, status) tuples in input order.
+    """
+    snap = snapshot or current_snapshot()
+    index = snap.index
+    matches = [(None, -1, "unknown") for _ in embeddings]
+    if len(index) == 0:
+        return matches
+
+    probes, valid = prepare_probes(embeddings, index.dim)
+    pending = np.flatnonzero(valid)
+
+    scoped = get_scoped_index(scope, snap)
+    for target in ([scoped] if scoped is not None else []) + [index]:
+        if pending.size == 0 or len(target) == 0:
+            continue
+        rows, scores = _best_rows(target, probes[pending])
 
-    # --- Interpret result ---
-    if best_index < 0 or best_index >= len(user_names):
-        return None, -1, "unknown"
+        missed = []
+        for face, row, score in zip(pending, rows, scores):
+            row, score = int(row), float(score)
+            if row < 0 or row >= len(target):
+                missed.append(face)
+                continue
+            status = _match_status(
+                score, float(target.thresholds[row]), default_threshold, fallback_threshold
+            )
+            matches[face] = ({"id": int(target.user_ids[row]), "name": target.names[row]}, score, status)
+            if status != "match":
+                missed.append(face)
 
-    name = user_names[best_index]
-    user_id = user_ids[best_index]
+        # Only scoped misses are retried against the global index
+        pending = np.array(missed, dtype=np.int64) if target is not index else pending[:0]
 
-    # --- Decision logic ---
-    if best_score >= default_threshold:
-        status = "match"
-    elif best_score >= fallback_threshold:
-        status = "maybe"
-    else:
-        status = "unknown"
+    return matches
 
-    return {"id": user_id, "name": name}, best_score, status
+def find_best_match(embedding, default_threshold=0.38, fallback_threshold=0.35, scope: str = None,
+                    snapshot: IndexSnapshot = None):
+    """
+    Finds the stored embedding with the best score - per-user threshold margin.
+    Single-face wrapper around find_best_matches (same backends and scoping).
+    """
+    return find_best_matches([embedding], default_threshold, fallback_threshold, scope, snapshot)[0]
 
 # -------------------------
-# Temporary face session cache for live preview
+# Temporary face session cache for live preview (per kiosk)
 # -------------------------
-active_faces = {}  # {face_id: {"embedding": list, "name": str, "pending_name": str, "confirmed": bool, "last_seen": float}}
-FACE_EXPIRY_SECONDS = 5.0
+# (kiosk, "face_N") → {"embedding", "name", "pending_name", "confirmed", "permanent_unknown",
+# "confirm_count", "unknown_count"}; a session expires FACE_EXPIRY_SECONDS after it was last seen.
+FACE_EXPIRY_SECONDS = float(os.environ.get("FACETRACK_SESSION_TTL", "5.0"))
 CONFIRM_THRESHOLD = 0.75  # similarity to confirm the same face
 
+face_sessions = FaceSessionStore(
+    ttl=FACE_EXPIRY_SECONDS,
+    max_sessions=int(os.environ.get("FACETRACK_SESSION_MAX", "4096")),
+    max_per_kiosk=int(os.environ.get("FACETRACK_SESSIONS_PER_KIOSK", "32")),
+)
+
+def kiosk_key(request: Request, kiosk_id: str = "") -> str:
+    """Kiosk identity for session state and cache namespaces: the kiosk_id it sends, else its address."""
+    return (kiosk_id or "").strip() or (request.client.host if request.client else "")
+
+PREVIEW_THRESHOLD = 0.38
+PREVIEW_FALLBACK_THRESHOLD = 0.35
+
 # -------------------------
 # Preview API (multi-face, stable IDs, smart recheck logic)
 # -------------------------
+def _preview_recognise_batch(items):
+    """
+    [(crop bytes, scope, cache namespace)] → [{"faces": [...], "match": (best_match, score, status) | None}].
+    Crops found in the embedding cache skip inference; the rest share one batched forward
+    on the embedding backend, and crops it could not embed fall back to DeepFace + MTCNN
+    exactly like /mark. Then one find_best_matches call per kiosk scope against a single snapshot.
+    """
+    results = [{"faces": [], "match": None} for _ in items]
+    pending = []  # (item index, dHash) of crops that need inference
+    for i, (crop, _, namespace) in enumerate(items):
+        key = crop_hash(crop) if embedding_cache is not None else None
+        cached = embedding_cache.get(namespace, key) if key is not None else None
+        if cached is not None:
+            results[i]["faces"] = [{"embedding": cached, "facial_area": {}}]
+        else:
+            pending.append((i, key))
+
+    if pending:
+        t0 = time.perf_counter()
+        embedded = embed_crops([items[i][0] for i, _ in pending])
+        batch_cost = (time.perf_counter() - t0) / len(pending)
+        for (i, key), faces in zip(pending, embedded):
+            cost = batch_cost
+            if not faces and embedder.name != "deepface":
+                t1 = time.perf_counter()
+                faces = fallback_faces(items[i][0])
+                cost += time.perf_counter() - t1
+            results[i]["faces"] = faces
+            if faces and key is not None:
+                embedding_cache.put(items[i][2], key, faces[0]["embedding"], cost)
+
+    snapshot = current_snapshot()
+    by_scope = {}
+    for i, (_, scope, _) in enumerate(items):
+        if results[i]["faces"]:
+            by_scope.setdefault(scope, []).append(i)
+    for scope, rows in by_scope.items():
+        try:
+            matches = find_best_matches(
+                [results[i]["faces"][0]["embedding"] for i in rows],
+                PREVIEW_THRESHOLD, PREVIEW_FALLBACK_THRESHOLD, scope=scope, snapshot=snapshot
+            )
+        except Exception as e:
+            logger.error(f"⚠️ Batched preview matching failed: {e}")
+            continue
+        for i, match in zip(rows, matches):
+            results[i]["match"] = match
+    return results
+
+preview_batcher = MicroBatcher(
+    _preview_recognise_batch, inference, PRIORITY_PREVIEW,
+    max_batch=PREVIEW_BATCH_MAX, max_wait_ms=PREVIEW_BATCH_WAIT_MS, max_in_flight=PREVIEW_BATCH_IN_FLIGHT,
+    name="preview",
+)
+
 @router.post("/preview")
 async def preview_faces(
+    request: Request,
     file: UploadFile = None,
     action: str = Form("preview"),
     employee_id: str = Form(""),
-    face_index: int = Form(0)  # support multi-face from frontend
+    face_index: int = Form(0),  # support multi-face from frontend
+    site: str = Form(""),       # optional kiosk scope: department/site name or "roster"
+    kiosk_id: str = Form(""),   # optional stable kiosk id (defaults to the client address)
 ):
     if not file:
         return {"error": "No image uploaded"}
 
     start_time = time.time()
+    kiosk = kiosk_key(request, kiosk_id)
 
-    # --- Read uploaded image ---
-    contents = await file.read()
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-        tmp.write(contents)
-        tmp_path = tmp.name
+    require_ready()
 
-    # =========================================================
-    # 🧠 STEP 1: Compute embedding (ArcFace only)
-    # =========================================================
+    # --- Read uploaded image (decoded in memory, never written to disk) ---
+    # One encoded crop, or a raw-crop upload with every aligned face of the frame
+    # (crop i → face slot face_index + i)
+    contents = await file.read()
     try:
-        import cv2
-        from deepface import DeepFace
+        crops = upload_crops(contents)
+    except CropWireError as e:
+        return {"error": f"Invalid raw crop upload: {e}"}
 
-        img = cv2.imread(tmp_path)
-        rep = DeepFace.represent(
-            img_path=img,
-            model_name="ArcFace",
-            enforce_detection=False  # trust frontend crop
-        )[0]["embedding"]
+    # Cheap quality gate (off the event loop): the kiosk can retry with a better frame right away
+    kept, rejected = await inference.run(screen_crops, crops, priority=PRIORITY_PREVIEW)
+    if not kept:
+        return {"results": [], "rejected": rejected}
 
-        faces = [{"embedding": rep, "facial_area": {}}]
-    except Exception as e:
-        logger.error(f"❌ ArcFace direct embedding failed: {e}")
-        faces = []
+    # =========================================================
+    # 🧠 STEP 1: Embed + match (micro-batched with other kiosks' crops)
+    # =========================================================
+    # Cache namespace: this kiosk's face slot (a hit never comes from another camera)
+    recognised = await asyncio.gather(
+        *(preview_batcher.submit((crops[i], site, f"{kiosk}:{face_index + i}")) for i in kept),
+        return_exceptions=True,
+    )
+    detected = []  # (face slot, face, batched match)
+    for i, outcome in zip(kept, recognised):
+        if isinstance(outcome, InferenceRejected):
+            raise outcome
+        if isinstance(outcome, Exception):
+            logger.error(f"❌ ArcFace direct embedding failed: {outcome}")
+            continue
+        detected.extend((face_index + i, face, outcome["match"]) for face in outcome["faces"])
 
     # =========================================================
     # 🧱 STEP 2: Handle no face
     # =========================================================
-    if not faces:
+    if not detected:
         duration = time.time() - start_time
         logger.info(f"⚡ Recognition completed in {duration:.3f}s (no faces found)")
         return {"results": []}
 
     # =========================================================
-    # ♻️ STEP 3: Prepare cache
+    # ♻️ STEP 3: Prepare cache (expired sessions drop out inside the store)
     # =========================================================
-    now = time.time()
-    global active_faces
-    if "active_faces" not in globals():
-        active_faces = {}
-
-    FACE_EXPIRY_SECONDS = globals().get("FACE_EXPIRY_SECONDS", 60)
-    CONFIRM_THRESHOLD = globals().get("CONFIRM_THRESHOLD", 0.40)
-
-    # Cleanup expired
-    expired = [
-        fid for fid, data in active_faces.items()
-        if now - data.get("last_seen", 0) > FACE_EXPIRY_SECONDS
-    ]
-    for fid in expired:
-        del active_faces[fid]
-        logger.info(f"🧹 Expired face removed: {fid}")
-
     results = []
-    threshold = 0.38
-    fallback_threshold = 0.35
 
     # =========================================================
-    # 🔍 STEP 4: Process detected (single uploaded) face
+    # 🔍 STEP 4: Process detected face(s) — one per uploaded crop
     # =========================================================
-    for idx, face in enumerate(faces):
+    for slot, face, match in detected:
         # ✅ use frontend-provided index for stable multi-face IDs
-        face_id = f"face_{face_index + 1}"
+        face_id = f"face_{slot + 1}"
         embedding = face.get("embedding")
         box = face.get("facial_area", {})
 
-        matched_id = None
-        for fid, data in active_faces.items():
+        matched_id, matched = None, None
+        for fid, data in face_sessions.sessions(kiosk):  # only this kiosk's tracks
             try:
                 sim = cosine_similarity(embedding, data["embedding"])
                 if sim > CONFIRM_THRESHOLD:
-                    matched_id = fid
+                    matched_id, matched = fid, data
                     break
             except Exception:
                 continue
@@ -619,8 +1626,8 @@ async def preview_faces(
         # 🔁 STEP 4A: Previously seen faces
         # =====================================================
         if matched_id:
-            data = active_faces[matched_id]
-            data["last_seen"] = now
+            data = matched
+            face_sessions.touch(kiosk, matched_id)
 
             if data.get("confirmed"):
                 name = data["name"]
@@ -636,9 +1643,9 @@ async def preview_faces(
 
             else:
                 try:
-                    best_match, best_score, status = find_best_match(
-                        embedding, threshold, fallback_threshold
-                    )
+                    if match is None:
+                        raise RuntimeError("no batched match result")
+                    best_match, best_score, status = match
                     confidence = round(best_score * 100, 2)
 
                     if status == "match" and best_match["name"] == data["pending_name"]:
@@ -688,16 +1695,16 @@ async def preview_faces(
         # =====================================================
         else:
             try:
-                best_match, best_score, status = find_best_match(
-                    embedding, threshold, fallback_threshold
-                )
+                if match is None:
+                    raise RuntimeError("no batched match result")
+                best_match, best_score, status = match
                 pending_name = (
                     best_match["name"] if status in ["match", "maybe"] else "Unknown"
                 )
                 confidence = round(best_score * 100, 2)
 
-                # ✅ Use face_index to keep identity separate per person
-                active_faces[face_id] = {
+                # ✅ Use face_index to keep identity separate per person (within this kiosk)
+                face_sessions.put(kiosk, face_id, {
                     "embedding": embedding,
                     "name": pending_name if status == "match" else "Unknown",
                     "pending_name": pending_name,
@@ -705,8 +1712,7 @@ async def preview_faces(
                     "permanent_unknown": False,
                     "confirm_count": 1 if status == "match" else 0,
                     "unknown_count": 1 if status != "match" else 0,
-                    "last_seen": now,
-                }
+                })
 
                 logger.info(
                     f"⚡ New face {face_id} recognized instantly as {pending_name} "
@@ -739,33 +1745,150 @@ async def preview_faces(
                 "status": result_status,
                 "gender": "unknown",
                 "age": "N/A",
-                "embedding": embedding,
+                "embedding": np.asarray(embedding, dtype=np.float32).tolist(),  # backends/cache hand back ndarrays
             }
         )
 
     # =========================================================
     # 💤 STEP 6: Final logging
     # =========================================================
+    active = face_sessions.sessions(kiosk)
     all_done = all(
         d.get("confirmed") or d.get("permanent_unknown")
-        for d in active_faces.values()
+        for _, d in active
     )
 
     duration = time.time() - start_time
     if any(r["status"] in ("new_face", "verifying", "known") for r in results):
         logger.info(
-            f"⚡ Recognition event in {duration:.3f}s | Active faces: {len(active_faces)}"
+            f"⚡ Recognition event in {duration:.3f}s | Active faces ({kiosk}): {len(active)}"
         )
 
     # Optional — clearer debug summary
-    if len(active_faces) > 1:
+    if len(active) > 1:
         logger.info(
-            "Current active faces → "
-            + ", ".join(f"{fid}:{d['name']}" for fid, d in active_faces.items())
+            f"Current active faces ({kiosk}) → "
+            + ", ".join(f"{fid}:{d['name']}" for fid, d in active)
         )
 
     return {"results": results, "stop_preview": all_done}
 
+# -------------------------
+# Admin: Search by Face (top-k identities + runner-up margin)
+# -------------------------
+def _search_faces(contents, k, aggregate):
+    """
+    /search inference job: detection/embedding, then the top-k identities of every face
+    (a full per-user reduction over the index) → ([(face position, face, found)], index).
+    """
+    index = current_snapshot().index
+    searched = []
+    for idx, face in enumerate(detect_faces(contents)):
+        probe = prepare_probe(face.get("embedding"))
+        if probe is not None:
+            searched.append((idx, face, index.search(probe, k=k, aggregate=aggregate)))
+    return searched, index
+
+@router.post("/search")
+async def search_by_face(
+    file: UploadFile = None,
+    admin_username: str = Form(...),
+    k: int = Form(5),
+    aggregate: str = Form("max"),  # "max" or "mean" over each user's stored rows
+    db: Session = Depends(get_db),
+):
+    if not db.query(Admin).filter(Admin.username == admin_username).first():
+        return {"error": "Admin not found"}
+    if not file:
+        return {"error": "No image uploaded"}
+
+    aggregate = (aggregate or "max").lower().strip()
+    if aggregate not in ("max", "mean"):
+        return {"error": "aggregate must be 'max' or 'mean'"}
+    k = max(1, min(k, 50))
+
+    require_ready()
+    start_time = time.time()
+    contents = await file.read()
+
+    try:
+        # Detection + top-k search off the event loop, in the search lane (behind /mark)
+        searched, index = await inference.run(_search_faces, contents, k, aggregate, priority=PRIORITY_SEARCH)
+    except InferenceRejected:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Face search failed: {e}")
+        return {"results": []}
+
+    results = []
+    for idx, face, found in searched:
+        box = face.get("facial_area", {})
+        results.append({
+            "face_id": f"face_{idx + 1}",
+            "box": [box.get("x"), box.get("y"), box.get("w"), box.get("h")],
+            "matches": [
+                {
+                    "id": m["id"],
+                    "name": m["name"],
+                    "employee_id": f"IFNT{m['id']:03d}",
+                    "score": round(m["score"], 4),
+                    "threshold": round(m["threshold"], 2),
+                    "confidence": round(m["score"] * 100, 2),
+                }
+                for m in found["matches"]
+            ],
+            "margin": round(found["margin"], 4) if found["margin"] is not None else None,
+        })
+
+    duration = time.time() - start_time
+    logger.info(f"🔎 Face search by {admin_username}: {len(results)} face(s) in {duration:.3f}s")
+    return {
+        "results": results,
+        "aggregate": aggregate,
+        "indexed_users": len(index.identity_ids),
+    }
+
+# -------------------------
+# Embedding Index Stats API
+# -------------------------
+@router.get("/index-stats")
+async def get_index_stats():
+    snap = current_snapshot()
+    stats = snap.index.stats()
+    stats["match_backend"] = MATCH_BACKEND
+    stats["native_simd"] = simd_lib.simd_level_name().decode() if simd_lib is not None else None
+    stats["native_extension"] = native_ext is not None
+    stats["ann_min_rows"] = ANN_MIN_ROWS
+    stats["scopes"] = {name: len(idx.identity_ids) for name, idx in snap.scopes.items()}
+    stats["roster_date"] = str(snap.roster_date) if snap.roster_date else None
+    stats["snapshot_version"] = snap.version
+    stats["shared_index"] = dict(_shared_info, path=SHARED_INDEX_PATH) if shared_store is not None else None
+    return stats
+
+# -------------------------
+# Readiness API (load balancers / kiosks poll this after a deploy)
+# -------------------------
+@router.get("/ready")
+async def get_readiness():
+    body = {"ready": inference_ready.is_set(), "backends": dict(_warmup_report)}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+# -------------------------
+# Inference Executor Stats API
+# -------------------------
+@router.get("/inference-stats")
+async def get_inference_stats():
+    """Executor lanes, preview batching, embedding cache, quality gate, face sessions and per-backend embed latency."""
+    return dict(
+        inference.stats(),
+        preview_batcher=preview_batcher.stats(),
+        embed_backend=embedder.name,
+        embedding_cache=embedding_cache.stats() if embedding_cache is not None else None,
+        quality_gate=quality_gate.stats() if quality_gate is not None else None,
+        face_sessions=face_sessions.stats(),
+        embedding_backends={name: b.stats() for name, b in embedding_backends.items()},
+    )
+
 # -------------------------
 # Toggle Auto-Train API
 # -------------------------
@@ -789,16 +1912,18 @@ async def get_auto_train_status():
 # -------------------------
 # Auto-update embeddings (Face Aging Consistency)
 # -------------------------
-def maybe_update_user_embedding(db: Session, user_id: int, new_embedding, similarity: float, threshold: float = 0.90):
+def maybe_update_user_embedding(db: Session, user_id: int, new_embedding, similarity: float, threshold: float = 0.90, user: User = None):
     """
     If similarity is very high, update user's embedding bank using
     weighted + median fusion and adaptive threshold recalculation.
+    Pass `user` when it is already loaded to skip the lookup query.
     """
     if similarity < threshold:
         return  # only update when system is confident
 
-    user = db.query(User).filter(User.id == user_id, User.is_active == True).first()
-    if not user:
+    if user is None or user.id != user_id:
+        user = db.query(User).filter(User.id == user_id, User.is_active == True).first()
+    if not user or not user.is_active:
         return
 
     try:
@@ -861,7 +1986,7 @@ def maybe_update_user_embedding(db: Session, user_id: int, new_embedding, simila
         db.commit()
         db.refresh(user)
 
-        refresh_embeddings()
+        upsert_user_embeddings(user)
         logger.info(
             f"🧠 Auto-Train updated {user.name}: "
             f"{len(stored_embeddings)} samples, threshold={user_threshold:.2f}"
@@ -880,6 +2005,21 @@ from datetime import datetime, date
 import tempfile
 import time
 
+def _mark_faces(crops):
+    """
+    /mark inference job (runs on an inference worker): quality gate, then detection/embedding
+    → ([(face slot, face)], verdict of the first rejected crop or None); faces is None when
+    every crop was rejected. A raw crop keeps its upload position as its slot (like /preview);
+    the faces of one encoded frame are numbered in detection order.
+    """
+    kept, rejected = screen_crops(crops)
+    if not kept:
+        return None, rejected
+    if len(crops) == 1:
+        return list(enumerate(detect_faces(crops[0]))), rejected
+    found = detect_crop_faces([crops[i] for i in kept])
+    return [(i, face) for i, faces in zip(kept, found) for face in faces], rejected
+
 @router.post("/mark")
 async def mark_attendance(
     request: Request,
@@ -887,6 +2027,8 @@ async def mark_attendance(
     file: UploadFile = None,
     employee_id: str = Form(""),
     face_index: int = Form(0),  # ✅ keep consistent with /preview
+    site: str = Form(""),       # optional kiosk scope: department/site name or "roster"
+    kiosk_id: str = Form(""),   # optional stable kiosk id (defaults to the client address)
     db: Session = Depends(get_db),
 ):
     """
@@ -900,6 +2042,8 @@ async def mark_attendance(
         data = await request.json()
         action = data.get("action", action)
         employee_id = data.get("employee_id", employee_id)
+        site = data.get("site", site)
+        kiosk_id = data.get("kiosk_id", kiosk_id)
         face_name = data.get("face_name")
         confidence = data.get("confidence", 0)
     except Exception:
@@ -954,61 +2098,93 @@ async def mark_attendance(
     if not file:
         return {"error": "No image uploaded"}
 
-    # Save uploaded frame
+    require_ready()
+
+    # Read uploaded frame (decoded in memory, never written to disk):
+    # one encoded image, or a raw-crop upload with every aligned face of the frame
     contents = await file.read()
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-        tmp.write(contents)
-        tmp_path = tmp.name
+    try:
+        crops = upload_crops(contents)
+    except CropWireError as e:
+        return {"error": f"Invalid raw crop upload: {e}"}
 
-    # Run face detection/embedding
+    # Quality gate + face detection/embedding: one job off the event loop, in the highest-priority lane
     try:
-        faces = detect_faces(tmp_path)
+        faces, rejected = await inference.run(_mark_faces, crops, priority=PRIORITY_MARK)
+    except InferenceRejected:
+        raise
     except Exception as e:
         logger.error(f"❌ detect_faces failed: {e}")
         return {"results": []}
 
+    if faces is None:  # every crop failed the gate: the kiosk can retry with a better frame right away
+        return {"results": [], "rejected": rejected}
     if not faces:
         return {"results": []}
 
     # ------------------------------------------------------------
-    # Multi-face consistency
+    # Multi-face consistency (this kiosk's preview sessions only)
     # ------------------------------------------------------------
-    global active_faces
-    if "active_faces" not in globals():
-        active_faces = {}
+    kiosk = kiosk_key(request, kiosk_id)
 
     results = []
     action = (action or "").lower().strip()
 
-    for idx, face in enumerate(faces):
-        # ✅ Use provided index or fallback to sequential
-        face_id = f"face_{face_index + idx + 1}"
+    # ------------------------------------------------------------
+    # Batched matching: all faces in one (F x D) GEMM, off the event loop
+    # ------------------------------------------------------------
+    try:
+        matches = await inference.run(
+            find_best_matches, [face.get("embedding") for _, face in faces], strict_threshold, fallback_threshold,
+            scope=site, priority=PRIORITY_MARK,
+        )
+    except InferenceRejected:
+        raise
+    except Exception as e:
+        logger.error(f"⚠️ find_best_matches failed: {e}")
+        return {
+            "results": [
+                {
+                    "face_id": f"face_{face_index + slot + 1}",
+                    "name": "Unknown",
+                    "employee_id": None,
+                    "status": "error_comparing_embeddings",
+                    "confidence": 0.0,
+                }
+                for slot, _ in faces
+            ]
+        }
+
+    # ------------------------------------------------------------
+    # Batched lookups: one users query + one attendance query per frame
+    # ------------------------------------------------------------
+    matched_ids = {m["id"] for m, _, st in matches if st == "match" and m}
+    users_by_id = {}
+    records_by_user = {}
+    if matched_ids and action != "work-application":
+        users_by_id = {
+            u.id: u for u in db.query(User).filter(User.id.in_(matched_ids)).all()
+        }
+        records_by_user = {
+            r.user_id: r
+            for r in db.query(Attendance)
+            .filter(Attendance.user_id.in_(users_by_id.keys()), Attendance.date == today)
+            .all()
+        }
+
+    work_app_user = None
+    if action == "work-application":
+        work_app_user = db.query(User).filter(User.employee_id == employee_id).first()
+
+    for (slot, face), (best_match, best_score, status) in zip(faces, matches):
+        # ✅ Provided index + the face's slot (same face_id as /preview gave this crop)
+        face_id = f"face_{face_index + slot + 1}"
         embedding = face.get("embedding")
         box = face.get("facial_area", {})
-        gender = "unknown"
-        age = "N/A"
-
-        # --------------------------------------------------------
-        # Compute match using strict + fallback thresholds
-        # --------------------------------------------------------
-        try:
-            best_match, best_score, status = find_best_match(
-                embedding, strict_threshold, fallback_threshold
-            )
-            confidence = round(best_score * 100, 2)
-        except Exception as e:
-            logger.error(f"⚠️ find_best_match failed: {e}")
-            results.append({
-                "face_id": face_id,
-                "name": "Unknown",
-                "employee_id": None,
-                "status": "error_comparing_embeddings",
-                "confidence": 0.0,
-            })
-            continue
+        confidence = round(best_score * 100, 2)
 
-        # Prevent low-score false positives
-        if best_score < fallback_threshold:
+        # Prevent low-score false positives (below the user's "maybe" band)
+        if best_match is None or status == "unknown":
             logger.info(f"🚫 Low-score face ({confidence:.2f}%) — ignored")
             results.append({
                 "face_id": face_id,
@@ -1020,8 +2196,8 @@ async def mark_attendance(
             })
             continue
 
-        # Maintain cache stability
-        prev_face = active_faces.get(face_id, {})
+        # Maintain cache stability (name the preview session settled on for this slot)
+        prev_face = face_sessions.get(kiosk, face_id) or {}
         prev_name = prev_face.get("name")
         prev_conf = prev_face.get("confidence", 0)
         if prev_name and prev_name != best_match["name"]:
@@ -1029,18 +2205,11 @@ async def mark_attendance(
                 best_match["name"] = prev_name
                 confidence = prev_conf
 
-        # Update cache
-        active_faces[face_id] = {
-            "name": best_match["name"],
-            "confidence": confidence,
-            "last_seen": now_jst,
-        }
-
         # --------------------------------------------------------
         # Work Application fallback (with uploaded frame)
         # --------------------------------------------------------
         if action == "work-application":
-            user = db.query(User).filter(User.employee_id == employee_id).first()
+            user = work_app_user
             if not user:
                 return {"results": [{"status": "invalid_employee_id"}]}
 
@@ -1071,10 +2240,10 @@ async def mark_attendance(
             continue
 
         # --------------------------------------------------------
-        # Attendance: Check-in / Check-out / Break
+        # Attendance: Check-in / Check-out / Break (in-memory state machine)
         # --------------------------------------------------------
         if status == "match":
-            user = db.query(User).filter(User.id == best_match["id"]).first()
+            user = users_by_id.get(best_match["id"])
             if not user:
                 results.append({
                     "face_id": face_id,
@@ -1085,11 +2254,7 @@ async def mark_attendance(
                 })
                 continue
 
-            record = (
-                db.query(Attendance)
-                .filter(Attendance.user_id == user.id, Attendance.date == today)
-                .first()
-            )
+            record = records_by_user.get(user.id)
             if not record:
                 record = Attendance(
                     user_id=user.id,
@@ -1097,6 +2262,7 @@ async def mark_attendance(
                     date=today,
                 )
                 db.add(record)
+                records_by_user[user.id] = record
 
             # ----- Attendance flow -----
             if action == "checkin":
@@ -1149,7 +2315,7 @@ async def mark_attendance(
 
             # Optional adaptive update
             if AUTO_TRAIN_ENABLED and best_score >= aging_update_threshold:
-                maybe_update_user_embedding(db, user.id, embedding, best_score)
+                maybe_update_user_embedding(db, user.id, embedding, best_score, user=user)
 
             results.append({
                 "face_id": face_id,
@@ -1170,21 +2336,11 @@ async def mark_attendance(
                 "box": [box.get("x"), box.get("y"), box.get("w"), box.get("h")],
             })
 
-    # ------------------------------------------------------------
-    # Cleanup cache (expire faces older than 60s)
-    # ------------------------------------------------------------
-    for fid, data in list(active_faces.items()):
-        if (now_jst - data["last_seen"]).seconds > 60:
-            del active_faces[fid]
-
     db.commit()
 
-    # Clear cache after successful mark
-    try:
-        active_faces.clear()
-        logger.info("🧹 Cleared active_faces cache after mark")
-    except Exception as e:
-        logger.warning(f"⚠️ Cache clear skipped: {e}")
+    # Clear this kiosk's sessions after a mark (the next person starts fresh; other kiosks keep theirs)
+    cleared = face_sessions.clear_kiosk(kiosk)
+    logger.info(f"🧹 Cleared {cleared} face session(s) of kiosk {kiosk} after mark")
 
     return {"results": results}
 
@@ -9,6 +9,9 @@ from datetime import date, datetime, timedelta
 from pydantic import BaseModel
 from typing import Optional, Dict, List
 
+# Rebuild the "today's roster" recognition sub-index when group schedules change
+from routes.attendance import refresh_roster_index
+
 router = APIRouter(prefix="/shift-groups", tags=["Shift Groups"])
 
 # =====================================================
@@ -173,6 +176,7 @@ def assign_employee(payload: AssignEmployeeRequest, db: Session = Depends(get_db
     days_ahead = 56 if payload.apply_to_future else 7
 
     regenerate_shifts_for_employee(db, user, group, start_date, days_ahead)
+    refresh_roster_index()
 
     return {
         "message": f"✅ {payload.employee_id} assigned to group '{group.name}' "
@@ -231,6 +235,7 @@ def update_group(group_id: int, payload: ShiftGroupUpdate, db: Session = Depends
         user = db.query(User).filter(User.employee_id == m.employee_id).first()
         if user:
             regenerate_shifts_for_employee(db, user, group, date.today(), 60)
+    refresh_roster_index()
 
     return {"message": "✅ Shift group updated and shifts regenerated", "data": serialize_group(group)}
 
@@ -247,6 +252,7 @@ def delete_group(group_id: int, db: Session = Depends(get_db)):
     db.query(EmployeeGroup).filter(EmployeeGroup.group_id == group_id).delete()
     db.delete(group)
     db.commit()
+    refresh_roster_index()
 
     return {"message": "✅ Shift group deleted", "data": {"id": group_id}}
 
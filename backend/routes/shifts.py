@@ -7,6 +7,9 @@ from datetime import date, datetime, timedelta
 from pydantic import BaseModel
 import calendar
 
+# Rebuild the "today's roster" recognition sub-index when shifts change
+from routes.attendance import refresh_roster_index
+
 router = APIRouter(prefix="/shifts", tags=["Shifts"])
 
 
@@ -152,6 +155,8 @@ def assign_shift(payload: ShiftAssignRequest, db: Session = Depends(get_db)):
             existing_shift.assigned_by = payload.assigned_by
             db.commit()
             db.refresh(existing_shift)
+            if local_date == date.today():
+                refresh_roster_index()
         return {
             "message": "Shift updated successfully",
             "data": serialize_shift(existing_shift),
@@ -169,6 +174,8 @@ def assign_shift(payload: ShiftAssignRequest, db: Session = Depends(get_db)):
     db.add(new_shift)
     db.commit()
     db.refresh(new_shift)
+    if local_date == date.today():
+        refresh_roster_index()
     return {"message": "Shift assigned successfully", "data": serialize_shift(new_shift)}
 
 
@@ -196,4 +203,6 @@ def delete_shift_by_date(employee_id: str, date_: str, db: Session = Depends(get
         }
     db.delete(shift)
     db.commit()
+    if local_date == date.today():
+        refresh_roster_index()
     return {"message": "Shift deleted successfully"}
\ No newline at end of file
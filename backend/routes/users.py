@@ -3,29 +3,36 @@ from sqlalchemy.orm import Session
 from utils.db import SessionLocal
 from models.User import User
 from models.Attendance import Attendance
-from deepface import DeepFace
-import tempfile
 import json
-import cv2, numpy as np, tempfile
+import cv2, numpy as np
 from pydantic import BaseModel
 from typing import List, Optional
 
-# Import refresh function from attendance
-from routes.attendance import refresh_embeddings
+# Import incremental index helpers from attendance
+from routes.attendance import current_snapshot, upsert_user_embeddings, remove_user_embeddings
+from routes.attendance import embed_crops, inference  # configured embedding backend + executor
+from utils.inference_executor import InferenceRejected, PRIORITY_SEARCH
+from utils.face_index import prepare_probe
+from utils.image_io import decode_image
+from utils.face_quality import sharpness_score  # Laplacian variance (for weighted averaging)
 router = APIRouter(prefix="/users", tags=["Users"])
 
 # -------------------------
-# Unified cache refresh helper (backend + frontend)
+# Unified cache patch helper (backend + frontend)
 # -------------------------
-def refresh_all_caches():
-    """Refresh both backend and frontend embedding caches."""
+def sync_user_caches(user: User, old_name: str = None, deleted: bool = False):
+    """Patch one user into (or out of) the backend index and the frontend cache."""
     try:
-        from app import refresh_embedding_cache  # lazy import avoids circular dependency
-        refresh_embeddings()
-        refresh_embedding_cache()
-        print("✅ Embedding caches refreshed successfully (users.py)")
+        from app import patch_embedding_cache  # lazy import avoids circular dependency
+        if deleted:
+            remove_user_embeddings(user.id)
+            patch_embedding_cache(None, old_name=user.name)
+        else:
+            upsert_user_embeddings(user)
+            patch_embedding_cache(user, old_name=old_name)
+        print(f"✅ Embedding caches patched for {user.name} (users.py)")
     except Exception as e:
-        print(f"⚠️ Cache refresh skipped: {e}")
+        print(f"⚠️ Cache patch skipped: {e}")
 
 # -------------------------
 # Dependency: DB session
@@ -84,13 +91,6 @@ def normalize_lighting(img):
     return img
 
 
-# -------------------------
-# Helper: compute image sharpness (for weighted averaging)
-# -------------------------
-def sharpness_score(img):
-    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-    return cv2.Laplacian(gray, cv2.CV_64F).var()
-
 # -------------------------
 # Helper: compute weighted mean embedding
 # -------------------------
@@ -103,19 +103,28 @@ def weighted_mean_embeddings(embeddings, weights):
 # -------------------------
 # Helper: apply synthetic mask and sunglasses 
 # -------------------------
-def apply_synthetic_mask(image_path):
-    img = cv2.imread(image_path)
+def apply_synthetic_mask(img):
+    """Masked copy of a BGR image (lower face blacked out), or None."""
     if img is None:
         return None
 
-    h, w, _ = img.shape
+    masked = img.copy()
+    h, w, _ = masked.shape
     mask_color = (0, 0, 0)
     y_start = int(h * 0.55)
-    cv2.rectangle(img, (0, y_start), (w, h), mask_color, -1)
+    cv2.rectangle(masked, (0, y_start), (w, h), mask_color, -1)
+    return masked
 
-    tmp_masked = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg")
-    cv2.imwrite(tmp_masked.name, img)
-    return tmp_masked.name
+
+# -------------------------
+# Helper: face crop with context (the embedding backends work on face crops)
+# -------------------------
+def face_crop(img, box, margin=0.25):
+    """Crop a detector box (x, y, w, h) out of a BGR image, grown by `margin` on each side."""
+    x, y, w, h = (int(v) for v in box)
+    dx, dy = int(w * margin), int(h * margin)
+    rows, cols = img.shape[:2]
+    return np.ascontiguousarray(img[max(0, y - dy):min(rows, y + h + dy), max(0, x - dx):min(cols, x + w + dx)])
 
 
 # -------------------------
@@ -155,15 +164,12 @@ async def register_user(
 
     for file in files:
         contents = await file.read()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-            tmp.write(contents)
-            tmp_path = tmp.name
 
         try:
             # ------------------------------------------------------
             # (1) Advanced Preprocessing (Lighting + Gamma + Sharpness)
             # ------------------------------------------------------
-            img = cv2.imread(tmp_path)
+            img = decode_image(contents)  # in memory — no temp file
             if img is None:
                 print("⚠️ Failed to read image — skipping.")
                 continue
@@ -183,8 +189,8 @@ async def register_user(
             # Compute image sharpness
             sharpness = sharpness_score(img)
 
-            # Save processed image
-            cv2.imwrite(tmp_path, cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
+            # Processed image (BGR, as the embedding backends expect for arrays)
+            processed = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
 
             # ------------------------------------------------------
             # (2) Face Detection Only — no alignment or center checks
@@ -201,39 +207,21 @@ async def register_user(
             valid_frame_found = True
 
             # ------------------------------------------------------
-            # (3) Generate Embeddings (Normal + Masked)
+            # (3) Generate Embeddings (Normal + Masked) with the configured embedding
+            # backend — the same model and input (a face crop) kiosk probes are embedded with
             # ------------------------------------------------------
-            rep = DeepFace.represent(
-                img_path=tmp_path,
-                model_name="ArcFace",
-                detector_backend="mtcnn",
-                enforce_detection=True
+            crop = face_crop(processed, max(faces, key=lambda f: f[2] * f[3]))
+            found = await inference.run(
+                embed_crops, [crop, apply_synthetic_mask(crop)], priority=PRIORITY_SEARCH
             )
-
-            if isinstance(rep, dict):
-                rep = [rep]
-            if rep and "embedding" in rep[0]:
-                emb = np.array(rep[0]["embedding"], dtype=float)
-                emb /= np.linalg.norm(emb)
-                embeddings.append((emb, sharpness))  # store embedding + sharpness
-
-            # Masked embedding for robustness
-            masked_path = apply_synthetic_mask(tmp_path)
-            if masked_path:
-                rep_mask = DeepFace.represent(
-                    img_path=masked_path,
-                    model_name="ArcFace",
-                    detector_backend="mtcnn",
-                    enforce_detection=False
-                )
-                if isinstance(rep_mask, dict):
-                    rep_mask = [rep_mask]
-                if rep_mask and "embedding" in rep_mask[0]:
-                    emb2 = np.array(rep_mask[0]["embedding"], dtype=float)
-                    emb2 /= np.linalg.norm(emb2)
-                    embeddings.append((emb2, sharpness * 0.8))
-
-        except HTTPException as he:
+            # Masked embedding (for robustness) counts a little less
+            for crop_faces, weight in zip(found, (sharpness, sharpness * 0.8)):
+                if crop_faces:
+                    emb = np.array(crop_faces[0]["embedding"], dtype=float)
+                    emb /= np.linalg.norm(emb)
+                    embeddings.append((emb, weight))  # store embedding + sharpness
+
+        except (HTTPException, InferenceRejected) as he:
             raise he
         except Exception as e:
             print(f"⚠️ Frame skipped due to error: {e}")
@@ -286,10 +274,21 @@ async def register_user(
     # ------------------------------------------------------
     # (6) Validation — Check duplicates (by face only)
     # ------------------------------------------------------
-    users = db.query(User).all()
     threshold = 0.55  # similarity threshold for duplicate faces
 
     # 🔹 Allow same names, only block similar embeddings
+    # Active users are checked against the in-memory index (one GEMV, no JSON parsing)
+    probe = prepare_probe(final_embedding)
+    if probe is not None:
+        top = current_snapshot().index.search(probe, k=1)["matches"]
+        if top and top[0]["score"] >= threshold:
+            raise HTTPException(
+                status_code=400,
+                detail=f"⚠️ A similar face already exists in the system (User: {top[0]['name']})."
+            )
+
+    # Inactive users are not in the index — scan those from the DB
+    users = db.query(User).filter(User.is_active == False).all()
     for user in users:
         stored_emb = np.array(json.loads(user.embedding), dtype=float)
         score = cosine_similarity(final_embedding, stored_emb)
@@ -317,9 +316,9 @@ async def register_user(
     db.refresh(new_user)
 
     # ------------------------------------------------------
-    # (8) Refresh embeddings cache
+    # (8) Patch embeddings caches (no full reload)
     # ------------------------------------------------------
-    refresh_all_caches()
+    sync_user_caches(new_user)
 
     return {
         "message": f"✅ User {name} registered successfully!",
@@ -347,6 +346,7 @@ async def update_user(payload: UpdateUserRequest, db: Session = Depends(get_db))
     if not user:
         raise HTTPException(status_code=404, detail=f"No user found with employee_id '{payload.current_employee_id}'")
 
+    old_name = user.name
     if payload.new_name:
         user.name = payload.new_name
     if payload.new_department is not None:
@@ -355,7 +355,7 @@ async def update_user(payload: UpdateUserRequest, db: Session = Depends(get_db))
     db.commit()
     db.refresh(user)
 
-    refresh_all_caches()
+    sync_user_caches(user, old_name=old_name)
 
     return {
         "message": "✅ User updated successfully",
@@ -384,7 +384,7 @@ async def delete_user_by_id(employee_id: str, db: Session = Depends(get_db)):
     db.delete(user)
     db.commit()
 
-    refresh_all_caches()
+    sync_user_caches(user, deleted=True)
 
     return {"message": f"🗑️ User {user.name} deleted successfully (attendance preserved)."}
 
@@ -407,7 +407,7 @@ async def delete_user_by_name(name: str, db: Session = Depends(get_db)):
     db.delete(user)
     db.commit()
 
-    refresh_all_caches()
+    sync_user_caches(user, deleted=True)
 
     return {"message": f"🗑️ User {user.name} deleted successfully (attendance preserved)."}
 
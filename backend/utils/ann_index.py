@@ -0,0 +1,231 @@
+import copy
+
+import numpy as np
+
+# ==========================================================
+# Approximate Nearest-Neighbour Index (IVF, pure NumPy)
+# ==========================================================
+# Coarse quantiser: spherical k-means over the normalized embedding rows.
+# Each row lives in the inverted list of its nearest centroid; a query only
+# scans the `n_probe` lists whose centroids are closest to the probe.
+# Row ids are the row numbers of the owning EmbeddingIndex.
+
+
+def _spherical_kmeans(vectors, n_lists, n_iter=8, seed=0, chunk=16384):
+    """Cosine k-means on unit rows → (n_lists, D) unit centroids."""
+    rng = np.random.default_rng(seed)
+    n_rows = vectors.shape[0]
+    centroids = vectors[rng.choice(n_rows, n_lists, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assign = np.empty(n_rows, dtype=np.int64)
+        for start in range(0, n_rows, chunk):
+            block = vectors[start:start + chunk]
+            assign[start:start + chunk] = np.argmax(block @ centroids.T, axis=1)
+
+        # Sum rows per centroid (sorted reduce keeps this O(N·D))
+        order = np.argsort(assign, kind="stable")
+        sorted_assign = assign[order]
+        starts = np.flatnonzero(np.r_[True, sorted_assign[1:] != sorted_assign[:-1]])
+        sums = np.add.reduceat(vectors[order], starts, axis=0)
+
+        new_centroids = vectors[rng.choice(n_rows, n_lists)].copy()  # re-seed empty lists
+        new_centroids[sorted_assign[starts]] = sums
+        norms = np.linalg.norm(new_centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (new_centroids / norms).astype(np.float32)
+
+    return np.ascontiguousarray(centroids)
+
+
+class IVFIndex:
+    """
+    Inverted-file ANN index with incremental add/remove.
+    Every inverted list is a growable float32 buffer; removal swaps the last
+    entry into the freed slot, so both add and remove are amortised O(D).
+    """
+
+    def __init__(self, centroids, n_probe=8):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.n_lists, self.dim = self.centroids.shape
+        self.n_probe = max(1, min(n_probe, self.n_lists))
+        self._vecs = [np.empty((0, self.dim), dtype=np.float32) for _ in range(self.n_lists)]
+        self._ids = [np.empty(0, dtype=np.int64) for _ in range(self.n_lists)]
+        self._sizes = np.zeros(self.n_lists, dtype=np.int64)
+        self._where = {}  # row_id → (list, slot)
+        self._owned = None  # lists safe to write in place (None = all; see clone())
+        self.offsets = None  # optional per-row score offsets (indexed by row_id), e.g. thresholds
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_probe=8, n_iter=8, max_train_rows=50000, seed=0):
+        """Train the coarse quantiser on (a sample of) `vectors` and add every row."""
+        n_rows = vectors.shape[0]
+        if n_lists is None:
+            n_lists = int(np.sqrt(n_rows))
+        n_lists = max(1, min(n_lists, n_rows))
+
+        rng = np.random.default_rng(seed)
+        train = vectors
+        if n_rows > max_train_rows:
+            train = vectors[np.sort(rng.choice(n_rows, max_train_rows, replace=False))]
+
+        index = cls(_spherical_kmeans(train, n_lists, n_iter=n_iter, seed=seed), n_probe=n_probe)
+        index.add(np.arange(n_rows), vectors)
+        return index
+
+    def __len__(self):
+        return len(self._where)
+
+    def _assign(self, vectors, chunk=16384):
+        lists = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], chunk):
+            lists[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ self.centroids.T, axis=1)
+        return lists
+
+    def clone(self):
+        """
+        Copy-on-write twin: list buffers are shared until one side writes to a list,
+        which then copies only that list (O(list size · D) instead of O(N · D)).
+        """
+        twin = copy.copy(self)
+        twin._vecs = list(self._vecs)
+        twin._ids = list(self._ids)
+        twin._sizes = self._sizes.copy()
+        twin._where = dict(self._where)
+        twin._owned = set()
+        self._owned = set()
+        return twin
+
+    def _own(self, lst):
+        if self._owned is not None and lst not in self._owned:
+            self._vecs[lst] = self._vecs[lst].copy()
+            self._ids[lst] = self._ids[lst].copy()
+            self._owned.add(lst)
+
+    def add(self, row_ids, vectors):
+        """Insert (or move) rows; `vectors` must already be unit-normalized."""
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self.remove([r for r in row_ids.tolist() if r in self._where])
+
+        lists = self._assign(vectors)
+        for lst in np.unique(lists):
+            members = np.flatnonzero(lists == lst)
+            size = int(self._sizes[lst])
+            needed = size + len(members)
+            self._own(lst)
+            if needed > self._vecs[lst].shape[0]:
+                capacity = max(needed, 2 * self._vecs[lst].shape[0], 16)
+                grown = np.empty((capacity, self.dim), dtype=np.float32)
+                grown[:size] = self._vecs[lst][:size]
+                grown_ids = np.empty(capacity, dtype=np.int64)
+                grown_ids[:size] = self._ids[lst][:size]
+                self._vecs[lst], self._ids[lst] = grown, grown_ids
+
+            self._vecs[lst][size:needed] = vectors[members]
+            self._ids[lst][size:needed] = row_ids[members]
+            for offset, row_id in enumerate(row_ids[members].tolist()):
+                self._where[row_id] = (int(lst), size + offset)
+            self._sizes[lst] = needed
+
+    def remove(self, row_ids):
+        """Drop rows by id (unknown ids are ignored)."""
+        for row_id in row_ids:
+            loc = self._where.pop(int(row_id), None)
+            if loc is None:
+                continue
+            lst, slot = loc
+            last = int(self._sizes[lst]) - 1
+            self._own(lst)
+            if slot != last:
+                moved = int(self._ids[lst][last])
+                self._vecs[lst][slot] = self._vecs[lst][last]
+                self._ids[lst][slot] = moved
+                self._where[moved] = (lst, slot)
+            self._sizes[lst] = last
+
+    def remap(self, mapping):
+        """Renumber row ids in place (mapping[old_id] = new_id); used after index compaction."""
+        self._where = {}
+        for lst in range(self.n_lists):
+            size = int(self._sizes[lst])
+            ids = mapping[self._ids[lst][:size]]
+            renumbered = np.empty_like(self._ids[lst])  # fresh array — shared buffers stay untouched
+            renumbered[:size] = ids
+            self._ids[lst] = renumbered
+            for slot, row_id in enumerate(ids.tolist()):
+                self._where[row_id] = (lst, slot)
+
+    def search(self, probe):
+        """
+        Approximate best row for one normalized probe → (row_id, score).
+        With `offsets` set, rows are ranked by score - offsets[row_id]; the raw score is returned.
+        """
+        if len(self) == 0:
+            return -1, -1.0
+        centroid_sims = self.centroids @ probe
+        if self.n_probe < self.n_lists:
+            lists = np.argpartition(-centroid_sims, self.n_probe - 1)[:self.n_probe]
+        else:
+            lists = np.arange(self.n_lists)
+
+        best_row, best_score, best_rank = -1, -1.0, -np.inf
+        for lst in lists:
+            size = int(self._sizes[lst])
+            if size == 0:
+                continue
+            ids = self._ids[lst][:size]
+            sims = self._vecs[lst][:size] @ probe
+            ranks = sims - self.offsets[ids] if self.offsets is not None else sims
+            i = int(np.argmax(ranks))
+            if ranks[i] > best_rank:
+                best_row, best_score, best_rank = int(ids[i]), float(sims[i]), float(ranks[i])
+        return best_row, best_score
+
+    def search_many(self, probes):
+        """Approximate best row for each probe in a (F, D) batch."""
+        rows = np.full(probes.shape[0], -1, dtype=np.int64)
+        scores = np.full(probes.shape[0], -1.0, dtype=np.float32)
+        for i, probe in enumerate(probes):
+            rows[i], scores[i] = self.search(probe)
+        return rows, scores
+
+    def recall_at_1(self, vectors, n_queries=200, noise=0.5, seed=0):
+        """
+        Fraction of noisy queries whose ANN top-1 equals the exact-scan top-1.
+        Queries are stored rows plus Gaussian noise of relative norm `noise`,
+        which mimics a fresh capture of an enrolled face.
+        """
+        n_rows = vectors.shape[0]
+        if n_rows == 0:
+            return 1.0
+        rng = np.random.default_rng(seed)
+        picks = rng.choice(n_rows, min(n_queries, n_rows), replace=False)
+        queries = vectors[picks] + rng.normal(0, noise / np.sqrt(self.dim), (len(picks), self.dim))
+        queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+        exact_ranks = queries @ vectors.T
+        if self.offsets is not None:
+            exact_ranks -= self.offsets[None, :n_rows]
+        exact_best = exact_ranks.max(axis=1)
+        approx_rows, approx_scores = self.search_many(queries)
+        approx_ranks = approx_scores - (self.offsets[approx_rows] if self.offsets is not None else 0)
+        # Compare ranking values so that duplicate rows (ties) count as hits
+        return float(np.mean(approx_ranks >= exact_best - 1e-5))
+
+    @property
+    def nbytes(self):
+        """Allocated list buffers + centroids (capacity, not just live rows)."""
+        return self.centroids.nbytes + sum(v.nbytes + i.nbytes for v, i in zip(self._vecs, self._ids))
+
+    def stats(self):
+        sizes = self._sizes
+        return {
+            "type": "ivf",
+            "rows": len(self),
+            "lists": self.n_lists,
+            "n_probe": self.n_probe,
+            "largest_list": int(sizes.max()) if len(sizes) else 0,
+            "empty_lists": int((sizes == 0).sum()),
+            "bytes": self.nbytes,
+        }
@@ -0,0 +1,78 @@
+import struct
+
+import numpy as np
+
+# ==========================================================
+# Raw Aligned-Crop Wire Format (application/octet-stream)
+# ==========================================================
+# The kiosk already detects and aligns faces, so instead of a JPEG per face it
+# may upload the aligned 112x112 pixels themselves — one or many crops in a
+# single application/octet-stream part:
+#
+#   offset  size  field
+#   0       4     magic  b"FTCR"
+#   4       1     version (1)
+#   5       1     channel order: 0 = BGR, 1 = RGB (canvas getImageData minus alpha)
+#   6       2     count   N        (uint16, little-endian)
+#   8       2     height  = 112    (uint16, little-endian)
+#   10      2     width   = 112    (uint16, little-endian)
+#   12      N*112*112*3           uint8 pixels, row-major HxWx3, crop after crop
+#
+# parse_crops() returns the pixels as a read-only [N, 112, 112, 3] view of the
+# upload (BGR uploads are not even copied), which goes straight into the ArcFace
+# blob: no JPEG decode, no resize. A 112x112 crop is 37 KB raw — bigger than a
+# typical JPEG, but one request carries every face of the frame.
+
+MAGIC = b"FTCR"
+VERSION = 1
+ORDER_BGR = 0
+ORDER_RGB = 1
+CROP_SIZE = 112          # ArcFace input side; anything else would need a resize
+MAX_CROPS = 32
+
+_HEADER = struct.Struct("<4sBBHHH")
+HEADER_SIZE = _HEADER.size
+
+
+class CropWireError(ValueError):
+    """Malformed raw-crop upload (bad header, size mismatch, too many crops)."""
+
+
+def is_raw_crops(data) -> bool:
+    """True if `data` starts with the raw-crop header magic."""
+    return len(data) >= HEADER_SIZE and bytes(data[:4]) == MAGIC
+
+
+def parse_crops(data):
+    """Raw-crop upload → uint8 [N, 112, 112, 3] BGR array (a view of `data` when it was sent as BGR)."""
+    if len(data) < HEADER_SIZE:
+        raise CropWireError("upload shorter than the raw-crop header")
+    magic, version, order, count, height, width = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise CropWireError("missing raw-crop magic")
+    if version != VERSION:
+        raise CropWireError(f"unsupported raw-crop version {version}")
+    if order not in (ORDER_BGR, ORDER_RGB):
+        raise CropWireError(f"unknown channel order {order}")
+    if (height, width) != (CROP_SIZE, CROP_SIZE):
+        raise CropWireError(f"crops must be {CROP_SIZE}x{CROP_SIZE}, got {width}x{height}")
+    if not 1 <= count <= MAX_CROPS:
+        raise CropWireError(f"crop count must be 1-{MAX_CROPS}, got {count}")
+
+    expected = HEADER_SIZE + count * height * width * 3
+    if len(data) != expected:
+        raise CropWireError(f"expected {expected} bytes for {count} crop(s), got {len(data)}")
+
+    crops = np.frombuffer(data, dtype=np.uint8, offset=HEADER_SIZE).reshape(count, height, width, 3)
+    if order == ORDER_RGB:
+        crops = np.ascontiguousarray(crops[..., ::-1])  # one vectorised swap for the whole batch
+    return crops
+
+
+def encode_crops(crops, order: int = ORDER_BGR) -> bytes:
+    """uint8 [N, 112, 112, 3] (or a list of 112x112x3 crops) in `order` → raw-crop upload bytes."""
+    crops = np.ascontiguousarray(np.asarray(crops, dtype=np.uint8))
+    if crops.ndim == 3:
+        crops = crops[None]
+    count, height, width = crops.shape[:3]
+    return _HEADER.pack(MAGIC, VERSION, order, count, height, width) + crops.tobytes()
@@ -0,0 +1,278 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from utils.image_io import decode_image
+
+try:
+    import onnxruntime as ort  # optional: only needed for the "onnx" backend
+except ImportError:
+    ort = None
+
+# ==========================================================
+# Pluggable Embedding Backends
+# ==========================================================
+# Every backend turns a batch of face crops (encoded bytes or BGR arrays)
+# into one float32 matrix:
+#
+#     backend.embed(batch) → ndarray [N, 512], L2-normalized rows
+#
+# Rows that could not be embedded are all zeros (see embedded_rows), so one
+# bad crop never fails the batch. Each backend records its own latency, so
+# /attendance/inference-stats shows which CPU path is fastest on this host.
+#
+#   native    C++ libface_engine (cv::dnn ArcFace, batched forward, engine pool)
+#   onnx      ONNX Runtime CPU on models/arcface.onnx (configurable intra-op threads)
+#   deepface  DeepFace ArcFace + MTCNN (TensorFlow) — slowest, detects inside the crop
+
+EMBEDDING_DIM = 512
+INPUT_SIZE = 112
+
+
+def embedded_rows(out):
+    """Boolean mask of the rows a backend actually embedded."""
+    return np.any(out != 0, axis=1)
+
+
+def _normalized(vec):
+    vec = np.asarray(vec, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+def _as_image(item):
+    """Encoded bytes or a BGR ndarray → BGR ndarray (None if undecodable)."""
+    if isinstance(item, np.ndarray):
+        return item
+    return decode_image(bytes(item))
+
+
+class EmbeddingBackend:
+    """Base class: subclasses implement _embed(batch) → [N, dim] float32 (zero rows = failed)."""
+
+    name = "base"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def embed(self, batch):
+        batch = list(batch)
+        if not batch:
+            return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+
+        t0 = time.perf_counter()
+        try:
+            out = self._embed(batch)
+        except Exception:
+            self._record(len(batch), 0, time.perf_counter() - t0)
+            raise
+        self._record(len(batch), int(embedded_rows(out).sum()), time.perf_counter() - t0)
+        return out
+
+    def _embed(self, batch):
+        raise NotImplementedError
+
+    # -------- Latency stats --------
+    def reset_stats(self):
+        with self._lock:
+            self._calls = 0
+            self._items = 0
+            self._embedded = 0
+            self._total_s = 0.0
+            self._avg_item_ms = 0.0   # EWMA per crop
+
+    def _record(self, items, embedded, elapsed):
+        with self._lock:
+            self._calls += 1
+            self._items += items
+            self._embedded += embedded
+            self._total_s += elapsed
+            per_item = elapsed * 1000 / items
+            self._avg_item_ms = per_item if self._calls == 1 else 0.9 * self._avg_item_ms + 0.1 * per_item
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self._calls,
+                "items": self._items,
+                "failed_items": self._items - self._embedded,
+                "avg_batch_size": round(self._items / self._calls, 2) if self._calls else 0.0,
+                "avg_call_ms": round(self._total_s * 1000 / self._calls, 3) if self._calls else 0.0,
+                "avg_item_ms": round(self._avg_item_ms, 3),
+                "items_per_s": round(self._items / self._total_s, 1) if self._total_s else 0.0,
+            }
+
+
+# -------- Native C++ engine --------
+class NativeBackend(EmbeddingBackend):
+    """
+    Wraps the loaded libface_engine. `embed_one(crop bytes)` → embedding | None is the
+    re-entrant single-crop call; `embed_many(list of bytes)` → [embedding | None] the
+    batched forward (None when the build has no embed_batch); `embed_pixels(list of
+    BGR arrays)` → [embedding | None] embeds decoded crops from their pixels (None when
+    the build has no embed_bgr_batch — arrays are then re-encoded).
+    """
+
+    name = "native"
+
+    def __init__(self, embed_one, embed_many=None, embed_pixels=None):
+        super().__init__()
+        self.embed_one = embed_one
+        self.embed_many = embed_many
+        self.embed_pixels = embed_pixels
+
+    def _embed(self, batch):
+        out = np.zeros((len(batch), EMBEDDING_DIM), dtype=np.float32)
+
+        # Decoded BGR crops (raw-crop uploads) go straight into the blob
+        arrays = []
+        if self.embed_pixels is not None:
+            arrays = [i for i, item in enumerate(batch) if _is_bgr(item)]
+            for i, emb in zip(arrays, self.embed_pixels([batch[i] for i in arrays])):
+                if emb is not None:
+                    out[i] = _normalized(emb)
+
+        skip = set(arrays)
+        rows = [i for i in range(len(batch)) if i not in skip]
+        crops = [batch[i] if not isinstance(batch[i], np.ndarray) else _encode(batch[i]) for i in rows]
+        if len(crops) > 1 and self.embed_many is not None:
+            embeddings = self.embed_many(crops)
+        else:
+            embeddings = [self.embed_one(crop) for crop in crops]
+
+        for i, emb in zip(rows, embeddings):
+            if emb is not None:
+                out[i] = _normalized(emb)
+        return out
+
+
+def _is_bgr(item):
+    return isinstance(item, np.ndarray) and item.ndim == 3 and item.shape[2] == 3 and item.dtype == np.uint8
+
+
+def _encode(img):
+    """BGR array → lossless encoded bytes for the native engine (which decodes in C++)."""
+    ok, buf = cv2.imencode(".bmp", img)
+    return buf.tobytes() if ok else b""
+
+
+# -------- ONNX Runtime (CPU) --------
+class OnnxBackend(EmbeddingBackend):
+    """
+    ArcFace through ONNX Runtime's CPU provider. Preprocessing mirrors the native engine
+    (112x112, RGB, [0, 1]) so embeddings stay comparable with the stored index. The input
+    layout (NCHW / NHWC) and whether the batch axis is dynamic are read from the model.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path: str, intra_op_threads: int = 0):
+        super().__init__()
+        if ort is None:
+            raise RuntimeError("onnxruntime is not installed")
+        if not os.path.exists(model_path):
+            raise RuntimeError(f"ONNX model not found: {model_path}")
+
+        options = ort.SessionOptions()
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        shape = model_input.shape
+        self.channels_first = len(shape) == 4 and shape[1] == 3
+        self.dynamic_batch = not isinstance(shape[0], int) or shape[0] != 1
+        self.model_path = model_path
+        self.intra_op_threads = intra_op_threads
+
+    def _blob(self, images):
+        blob = np.empty((len(images), INPUT_SIZE, INPUT_SIZE, 3), dtype=np.float32)
+        for i, img in enumerate(images):
+            face = img if img.shape[:2] == (INPUT_SIZE, INPUT_SIZE) else cv2.resize(img, (INPUT_SIZE, INPUT_SIZE))
+            blob[i] = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
+        blob *= 1.0 / 255.0
+        return np.ascontiguousarray(blob.transpose(0, 3, 1, 2)) if self.channels_first else blob
+
+    def _embed(self, batch):
+        images = [_as_image(item) for item in batch]
+        valid = [i for i, img in enumerate(images) if img is not None and img.size]
+        out = np.zeros((len(batch), EMBEDDING_DIM), dtype=np.float32)
+        if not valid:
+            return out
+
+        blob = self._blob([images[i] for i in valid])
+        if self.dynamic_batch:
+            raw = self.session.run(None, {self.input_name: blob})[0]
+        else:
+            raw = np.concatenate([self.session.run(None, {self.input_name: blob[j:j + 1]})[0]
+                                  for j in range(len(valid))])
+
+        raw = raw.reshape(len(valid), -1).astype(np.float32)
+        raw /= np.linalg.norm(raw, axis=1, keepdims=True) + 1e-6
+        out[valid] = raw[:, :EMBEDDING_DIM]
+        return out
+
+    def stats(self):
+        return dict(super().stats(), intra_op_threads=self.intra_op_threads)
+
+
+# -------- DeepFace (TensorFlow) --------
+class DeepFaceBackend(EmbeddingBackend):
+    """
+    DeepFace ArcFace per crop, with its own face detector inside the crop (MTCNN by default).
+    embed() keeps the first face of each crop; represent() returns every face with its box.
+    """
+
+    name = "deepface"
+
+    def __init__(self, detector_backend: str = "mtcnn"):
+        super().__init__()
+        from deepface import DeepFace  # heavy import — only when this backend is built
+        self._represent = DeepFace.represent
+        self.detector_backend = detector_backend
+
+    def _faces(self, item):
+        img = _as_image(item)
+        if img is None:
+            return []
+        reps = self._represent(
+            img_path=img,
+            model_name="ArcFace",
+            detector_backend=self.detector_backend,
+            enforce_detection=False,
+        )
+        if isinstance(reps, dict):
+            reps = [reps]
+        return [{"embedding": _normalized(rep["embedding"]), "facial_area": rep.get("facial_area", {})}
+                for rep in reps if rep.get("embedding")]
+
+    def represent(self, batch):
+        """Crops → one faces list per crop: every face DeepFace found, [{"embedding", "facial_area"}, ...]."""
+        batch = list(batch)
+        if not batch:
+            return []
+
+        t0 = time.perf_counter()
+        try:
+            faces = [self._faces(item) for item in batch]
+        except Exception:
+            self._record(len(batch), 0, time.perf_counter() - t0)
+            raise
+        self._record(len(batch), sum(1 for found in faces if found), time.perf_counter() - t0)
+        return faces
+
+    def _embed(self, batch):
+        out = np.zeros((len(batch), EMBEDDING_DIM), dtype=np.float32)
+        for i, item in enumerate(batch):
+            faces = self._faces(item)
+            if faces:
+                out[i] = faces[0]["embedding"]
+        return out
@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# ==========================================================
+# Perceptual-Hash Embedding Cache (skip inference on repeated frames)
+# ==========================================================
+# A kiosk in preview mode re-sends near-identical crops of a still face
+# several times a second. Each crop gets a difference hash (dHash) of its
+# downscaled grayscale image; a crop whose hash is within `max_distance`
+# bits of a cached one reuses that embedding instead of running ArcFace.
+#
+# - Entries are scoped by a namespace (kiosk + face slot), so a hit can only
+#   come from the same camera position — never from another kiosk's face.
+# - TTL counts from the real inference and is not refreshed by hits, so a
+#   still face is re-embedded at least every `ttl` seconds.
+# - Near-duplicate lookup uses multi-index hashing: the hash is split into
+#   max_distance + 1 bands, and any hash within max_distance bits must match
+#   at least one band exactly (pigeonhole), so lookups never scan the cache.
+
+DHASH_SIZE = 16   # 16x16 gradient bits = 256-bit hash
+
+
+def dhash(gray, size: int = DHASH_SIZE) -> int:
+    """Difference hash: sign of horizontal gradients on a (size+1) x size thumbnail → int."""
+    thumb = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def crop_hash(crop, size: int = DHASH_SIZE):
+    """
+    dHash of an encoded crop, decoded straight to half-resolution grayscale, or of a
+    decoded BGR crop (raw-crop uploads) → int (None if undecodable).
+    """
+    if isinstance(crop, np.ndarray):
+        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+        return dhash(gray, size) if gray.size else None
+    if not crop:
+        return None
+    gray = cv2.imdecode(np.frombuffer(crop, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_2)
+    if gray is None or gray.size == 0:
+        return None
+    return dhash(gray, size)
+
+
+class EmbeddingCache:
+    def __init__(self, max_entries: int = 1024, ttl: float = 2.0, max_distance: int = 12,
+                 hash_bits: int = DHASH_SIZE * DHASH_SIZE):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self.max_distance = max(0, int(max_distance))
+
+        n_bands = self.max_distance + 1
+        width, extra = divmod(hash_bits, n_bands)
+        self._bands = []  # (shift, mask) per band
+        shift = 0
+        for b in range(n_bands):
+            w = width + (1 if b < extra else 0)
+            self._bands.append((shift, (1 << w) - 1))
+            shift += w
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (namespace, hash) → (embedding, expires_at, cost_s); LRU order
+        self._index = [{} for _ in self._bands]  # band → {(namespace, band value): {hash, ...}}
+
+        self._hits = 0
+        self._misses = 0
+        self._evicted = 0
+        self._expired = 0
+        self._saved_s = 0.0
+
+    # -------- Band index --------
+    def _band_keys(self, namespace, h):
+        return [(namespace, (h >> shift) & mask) for shift, mask in self._bands]
+
+    def _unlink(self, namespace, h):
+        for band, key in zip(self._index, self._band_keys(namespace, h)):
+            bucket = band.get(key)
+            if bucket is not None:
+                bucket.discard(h)
+                if not bucket:
+                    del band[key]
+
+    def _drop(self, key):
+        del self._entries[key]
+        self._unlink(*key)
+
+    # -------- Lookup / insert --------
+    def get(self, namespace, h):
+        """Cached embedding of the nearest live hash within max_distance bits in this namespace, else None."""
+        now = time.monotonic()
+        with self._lock:
+            best_key, best_dist = None, self.max_distance + 1
+            expired = []  # dropped after the scan (buckets must not change while iterated)
+            # An exact hit sits in every one of its own bands, so it is scanned like any candidate
+            candidates = {c for band, key in zip(self._index, self._band_keys(namespace, h)) for c in band.get(key, ())}
+            for candidate in candidates:
+                dist = bin(candidate ^ h).count("1")
+                if dist >= best_dist:
+                    continue
+                if self._entries[(namespace, candidate)][1] < now:
+                    expired.append((namespace, candidate))
+                    continue
+                best_key, best_dist = (namespace, candidate), dist
+
+            for key in expired:
+                self._drop(key)
+            self._expired += len(expired)
+
+            if best_key is not None:
+                embedding, _, cost = self._entries[best_key]
+                self._entries.move_to_end(best_key)
+                self._hits += 1
+                self._saved_s += cost
+                return embedding
+            self._misses += 1
+            return None
+
+    def put(self, namespace, h, embedding, cost_s: float = 0.0):
+        """Store the embedding of a freshly embedded crop; `cost_s` is the inference time it took."""
+        key = (namespace, h)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (embedding, time.monotonic() + self.ttl, cost_s)
+            for band, band_key in zip(self._index, self._band_keys(namespace, h)):
+                band.setdefault(band_key, set()).add(h)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._evicted += 1
+
+    # -------- Metrics --------
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "max_distance": self.max_distance,
+                "lookups": lookups,
+                "hits": self._hits,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+                "saved_inference_ms": round(self._saved_s * 1000, 1),
+                "evicted": self._evicted,
+                "expired": self._expired,
+            }
@@ -0,0 +1,464 @@
+import copy
+from dataclasses import dataclass, field, replace
+from datetime import date
+from typing import Optional
+
+import numpy as np
+
+# ==========================================================
+# Vectorized Face Embedding Index (float32, contiguous)
+# ==========================================================
+# Every stored embedding is one row of a C-contiguous float32 matrix.
+# Rows are L2-normalized once at build time, so cosine similarity
+# against a normalized probe is a single matrix-vector product (BLAS).
+
+
+def normalize_rows(vectors):
+    """Return a contiguous float32 copy of `vectors` with unit-length rows."""
+    mat = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    mat /= norms
+    return np.ascontiguousarray(mat)
+
+
+def prepare_probe(embedding):
+    """Normalize a single probe embedding → float32 vector, or None if empty/zero."""
+    vec = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(vec)) if vec.size else 0.0
+    if norm == 0:
+        return None
+    return vec / norm
+
+
+def prepare_probes(embeddings, dim):
+    """
+    Stack + normalize a batch of probe embeddings → ((F, dim) float32, valid mask).
+    Empty, zero or wrong-sized embeddings get a zero row and valid=False.
+    """
+    probes = np.zeros((len(embeddings), dim), dtype=np.float32)
+    valid = np.zeros(len(embeddings), dtype=bool)
+    for i, emb in enumerate(embeddings):
+        probe = prepare_probe(emb) if emb is not None else None
+        if probe is not None and probe.shape[0] == dim:
+            probes[i] = probe
+            valid[i] = True
+    return probes, valid
+
+
+DEFAULT_USER_THRESHOLD = 0.40  # matches the users.threshold column default
+COMPACT_MIN_DEAD = 1024        # compaction only kicks in past this many tombstoned rows
+COMPACT_DEAD_RATIO = 0.25      # ... and once tombstones exceed this share of all rows
+
+
+class GrowableArray:
+    """Append-only NumPy buffer with capacity doubling (amortised O(1) appends)."""
+
+    def __init__(self, data, dtype, copy=True):
+        data = np.asarray(data, dtype=dtype)
+        self.dtype = dtype
+        self.n = len(data)
+        if not copy:
+            self.buf = data  # adopt as-is (e.g. a read-only mmap view); the first append reallocates
+            return
+        self.buf = np.empty((max(self.n, 16),) + data.shape[1:], dtype=dtype)
+        self.buf[:self.n] = data
+
+    @property
+    def view(self):
+        return self.buf[:self.n]
+
+    def share(self):
+        """New wrapper over the same buffer: appends past `n` never touch the original's view."""
+        return copy.copy(self)
+
+    def copy(self):
+        """Private copy for arrays that are written in place (thresholds, alive mask, ...)."""
+        twin = copy.copy(self)
+        twin.buf = self.buf.copy()
+        return twin
+
+    def append(self, values):
+        values = np.asarray(values, dtype=self.dtype)
+        if self.n == 0 and self.buf.shape[1:] != values.shape[1:]:
+            self.buf = np.empty((16,) + values.shape[1:], dtype=self.dtype)  # first rows fix the width
+        needed = self.n + len(values)
+        if needed > len(self.buf):
+            grown = np.empty((max(needed, 2 * len(self.buf)),) + self.buf.shape[1:], dtype=self.dtype)
+            grown[:self.n] = self.buf[:self.n]
+            self.buf = grown
+        self.buf[self.n:needed] = values
+        self.n = needed
+
+
+class EmbeddingIndex:
+    """
+    In-memory embedding index used for face matching.
+    Rows are parallel to `user_ids`, `names` and `thresholds` (a user may own several rows).
+    Best-row selection maximises score - threshold, so per-user strictness is vectorised.
+
+    Mutations (`upsert` / `remove`) append rows and tombstone old ones in O(rows · D);
+    a tombstoned row gets an infinite threshold so it can never win, and the matrix is
+    compacted once tombstones pile up.
+    """
+
+    def __init__(self, vectors=None, user_ids=None, names=None, thresholds=None, normalized=False, copy=True):
+        if vectors is None or len(vectors) == 0:
+            vectors = np.empty((0, 0), dtype=np.float32)
+        elif not normalized:
+            vectors = normalize_rows(vectors)
+        user_ids = np.asarray(user_ids if user_ids is not None else [], dtype=np.int64)
+        if thresholds is None:
+            thresholds = [DEFAULT_USER_THRESHOLD] * len(user_ids)
+        thresholds = np.array(
+            [DEFAULT_USER_THRESHOLD if t is None else t for t in thresholds], dtype=np.float32
+        )
+
+        # copy=False (with normalized=True) maps the rows zero-copy, e.g. from a shared mmap
+        self._vecs = GrowableArray(vectors, np.float32, copy=copy)
+        self._uids = GrowableArray(user_ids, np.int64)
+        self._thr = GrowableArray(thresholds, np.float32)
+        self._alive = GrowableArray(np.ones(len(user_ids), dtype=bool), bool)
+        self.names = list(names or [])
+        self.n_dead = 0
+
+        self._vectors_f64 = None  # lazy copy of the live rows for the legacy ctypes matcher
+        self._f64_rows = None     # index row of each _vectors_f64 row (None = identity, no tombstones)
+        self.ann = None           # optional IVFIndex over the same rows (large indexes)
+        self.ann_recall = None    # recall@1 of `ann` vs the exact scan, measured at build
+
+        # Row → identity mapping, computed once so per-user aggregation stays O(N)
+        identity_ids, first_rows, row_identity = np.unique(
+            user_ids, return_index=True, return_inverse=True
+        )
+        self._row_ident = GrowableArray(row_identity.ravel(), np.int64)
+        self._ident_ids = GrowableArray(identity_ids, np.int64)
+        self._ident_thr = GrowableArray(thresholds[first_rows], np.float32)
+        self._ident_counts = GrowableArray(np.bincount(row_identity.ravel(), minlength=len(identity_ids)), np.int64)
+        self.identity_names = [self.names[i] for i in first_rows]
+        self._ident_slot = {int(uid): slot for slot, uid in enumerate(identity_ids)}
+        self._rows_of = {}
+        for row, uid in enumerate(user_ids.tolist()):
+            self._rows_of.setdefault(uid, []).append(row)
+
+    # ---- Parallel arrays (views over the growable buffers) ----
+    @property
+    def vectors(self):
+        return self._vecs.view
+
+    @property
+    def user_ids(self):
+        return self._uids.view
+
+    @property
+    def thresholds(self):
+        return self._thr.view
+
+    @property
+    def alive(self):
+        return self._alive.view
+
+    @property
+    def row_identity(self):
+        return self._row_ident.view
+
+    @property
+    def identity_ids(self):
+        return self._ident_ids.view
+
+    @property
+    def identity_thresholds(self):
+        return self._ident_thr.view
+
+    @property
+    def identity_counts(self):
+        return self._ident_counts.view
+
+    def __len__(self):
+        return self._vecs.n
+
+    def __contains__(self, user_id):
+        return int(user_id) in self._rows_of
+
+    @property
+    def n_alive(self):
+        return len(self) - self.n_dead
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1] if len(self) else 0
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes
+
+    def scores(self, probe):
+        """Cosine similarity of a normalized probe against every row (one GEMV)."""
+        return self.vectors @ probe
+
+    def best(self, probe):
+        """
+        Return (row_index, score) of the row with the largest score - threshold margin,
+        or (-1, -1.0) if empty. `score` is the raw cosine similarity of that row.
+        """
+        if self.n_alive == 0 or probe.shape[0] != self.dim:
+            return -1, -1.0
+        sims = self.scores(probe)
+        idx = int(np.argmax(sims - self.thresholds))
+        return idx, float(sims[idx])
+
+    def best_many(self, probes):
+        """
+        Best row (largest score - threshold) for each probe in a (F, D) batch with a single GEMM.
+        Returns (row_indices, scores); rows are -1 when the index is empty.
+        """
+        n_probes = probes.shape[0]
+        if self.n_alive == 0 or n_probes == 0 or probes.shape[1] != self.dim:
+            return np.full(n_probes, -1, dtype=np.int64), np.full(n_probes, -1.0, dtype=np.float32)
+        sims = probes @ self.vectors.T  # (F, N)
+        rows = np.argmax(sims - self.thresholds[None, :], axis=1)
+        return rows, sims[np.arange(n_probes), rows]
+
+    def identity_scores(self, probe, aggregate="max"):
+        """Aggregate row scores per user → float32 array parallel to `identity_ids` (-inf if removed)."""
+        sims = self.scores(probe)
+        if self.n_dead:
+            sims = np.where(self.alive, sims, -np.inf if aggregate == "max" else 0.0)
+        if aggregate == "mean":
+            totals = np.bincount(self.row_identity, weights=sims, minlength=len(self.identity_ids))
+            counts = self.identity_counts
+            with np.errstate(divide="ignore", invalid="ignore"):
+                means = np.where(counts > 0, totals / np.maximum(counts, 1), -np.inf)
+            return means.astype(np.float32)
+        if aggregate != "max":
+            raise ValueError(f"Unsupported aggregate '{aggregate}' (use 'max' or 'mean')")
+        best = np.full(len(self.identity_ids), -np.inf, dtype=np.float32)
+        np.maximum.at(best, self.row_identity, sims)
+        return best
+
+    def search(self, probe, k=5, aggregate="max"):
+        """
+        Top-k identities for a normalized probe.
+        Uses argpartition (O(N)) and only sorts the k survivors.
+        Returns {"matches": [{"id", "name", "score", "threshold"}...], "margin": best - runner_up}.
+        """
+        n_identities = len(self.identity_ids)
+        if self.n_alive == 0 or probe.shape[0] != self.dim or k <= 0:
+            return {"matches": [], "margin": None}
+
+        agg = self.identity_scores(probe, aggregate)
+
+        # Always keep at least 2 so the runner-up margin is available
+        keep = min(max(k, 2), n_identities)
+        if keep < n_identities:
+            top = np.argpartition(-agg, keep - 1)[:keep]
+        else:
+            top = np.arange(n_identities)
+        top = top[np.argsort(-agg[top], kind="stable")]
+
+        matches = [
+            {
+                "id": int(self.identity_ids[i]),
+                "name": self.identity_names[i],
+                "score": float(agg[i]),
+                "threshold": float(self.identity_thresholds[i]),
+            }
+            for i in top
+            if np.isfinite(agg[i])  # removed users
+        ]
+        margin = matches[0]["score"] - matches[1]["score"] if len(matches) > 1 else None
+        return {"matches": matches[:k], "margin": margin}
+
+    def subset(self, user_ids):
+        """Exact sub-index holding only the live rows of `user_ids` (no re-normalization)."""
+        wanted = np.isin(self.user_ids, np.fromiter(user_ids, dtype=np.int64))
+        rows = np.flatnonzero(wanted & self.alive)
+        return EmbeddingIndex(
+            self.vectors[rows] if len(rows) else None,
+            self.user_ids[rows],
+            [self.names[i] for i in rows],
+            self.thresholds[rows],
+            normalized=True,
+        )
+
+    def row_range(self, start, end):
+        """Zero-copy sub-index over rows [start, end) — e.g. one department of a scope-grouped file."""
+        return EmbeddingIndex(
+            self.vectors[start:end] if end > start else None,
+            self.user_ids[start:end],
+            self.names[start:end],
+            self.thresholds[start:end],
+            normalized=True,
+            copy=False,
+        )
+
+    # ---- Incremental mutation ----
+    def clone(self):
+        """
+        Copy-on-write twin for snapshot publishing.
+        The append-only row matrix is shared (the twin only appends past this index's
+        end); arrays written in place are copied, so this index stays immutable.
+        Only clone the latest published index — two clones appending would collide.
+        """
+        twin = copy.copy(self)
+        twin._vecs = self._vecs.share()
+        twin._uids = self._uids.share()
+        twin._row_ident = self._row_ident.share()
+        twin._ident_ids = self._ident_ids.share()
+        twin._thr = self._thr.copy()
+        twin._alive = self._alive.copy()
+        twin._ident_thr = self._ident_thr.copy()
+        twin._ident_counts = self._ident_counts.copy()
+        twin.names = list(self.names)
+        twin.identity_names = list(self.identity_names)
+        twin._ident_slot = dict(self._ident_slot)
+        twin._rows_of = dict(self._rows_of)
+        twin.ann = self.ann.clone() if self.ann is not None else None
+        return twin
+
+    def _tombstone(self, user_id):
+        rows = self._rows_of.pop(user_id, [])
+        if not rows:
+            return
+        self.alive[rows] = False
+        self.thresholds[rows] = np.inf  # a dead row can never win score - threshold
+        self.n_dead += len(rows)
+        slot = self._ident_slot.get(user_id)
+        if slot is not None:
+            self.identity_counts[slot] = 0
+        if self.ann is not None:
+            self.ann.remove(rows)
+
+    def upsert(self, user_id, vectors, threshold=None, name=""):
+        """Insert or replace every row of one user; amortised O(rows · D)."""
+        user_id = int(user_id)
+        new_rows = normalize_rows(vectors)
+        if self.dim and new_rows.shape[1] != self.dim:
+            raise ValueError(f"Embedding dim {new_rows.shape[1]} does not match index dim {self.dim}")
+        threshold = DEFAULT_USER_THRESHOLD if threshold is None else float(threshold)
+
+        self._tombstone(user_id)
+
+        slot = self._ident_slot.get(user_id)
+        if slot is None:
+            slot = len(self.identity_ids)
+            self._ident_slot[user_id] = slot
+            self._ident_ids.append([user_id])
+            self._ident_thr.append([threshold])
+            self._ident_counts.append([0])
+            self.identity_names.append(name)
+        self.identity_thresholds[slot] = threshold
+        self.identity_counts[slot] = len(new_rows)
+        self.identity_names[slot] = name
+
+        start = len(self)
+        k = len(new_rows)
+        self._vecs.append(new_rows)
+        self._uids.append(np.full(k, user_id))
+        self._thr.append(np.full(k, threshold))
+        self._alive.append(np.ones(k, dtype=bool))
+        self._row_ident.append(np.full(k, slot))
+        self.names.extend([name] * k)
+        self._rows_of[user_id] = list(range(start, start + k))
+        self._sync_attachments(new_rows, start)
+        self._maybe_compact()
+
+    def remove(self, user_id):
+        """Tombstone every row of one user (no-op if unknown)."""
+        self._tombstone(int(user_id))
+        self._sync_attachments(None, len(self))
+        self._maybe_compact()
+
+    def _sync_attachments(self, new_rows, start):
+        """Keep the ANN / float64 companions in step with the row buffers."""
+        self._vectors_f64 = None
+        if self.ann is not None:
+            if new_rows is not None:
+                self.ann.add(np.arange(start, start + len(new_rows)), new_rows)
+            self.ann.offsets = self.thresholds
+
+    def _maybe_compact(self):
+        if self.n_dead >= COMPACT_MIN_DEAD and self.n_dead > COMPACT_DEAD_RATIO * len(self):
+            self.compact()
+
+    def compact(self):
+        """Drop tombstoned rows (O(N · D)); an attached ANN index is remapped, not rebuilt."""
+        keep = np.flatnonzero(self.alive)
+        mapping = np.full(len(self), -1, dtype=np.int64)
+        mapping[keep] = np.arange(len(keep))
+        thresholds = self.thresholds[keep]
+
+        fresh = EmbeddingIndex(
+            self.vectors[keep] if len(keep) else None,
+            self.user_ids[keep],
+            [self.names[i] for i in keep],
+            thresholds,
+            normalized=True,
+        )
+        ann, recall = self.ann, self.ann_recall
+        self.__dict__.update(fresh.__dict__)
+        self.ann_recall = recall
+        if ann is not None:
+            ann.remap(mapping)
+            ann.offsets = self.thresholds
+            self.ann = ann
+
+    def build_ann(self, n_probe=8, n_queries=200):
+        """Attach an IVF index built from the same normalized rows and measure its recall@1."""
+        from utils.ann_index import IVFIndex  # local import keeps small deployments lean
+
+        self.ann = IVFIndex.build(self.vectors, n_probe=n_probe)
+        self.ann.offsets = self.thresholds
+        self.ann_recall = self.ann.recall_at_1(self.vectors, n_queries=n_queries)
+        return self.ann_recall
+
+    def stats(self):
+        return {
+            "rows": len(self),
+            "live_rows": self.n_alive,
+            "tombstones": self.n_dead,
+            "identities": len(self.identity_ids),
+            "dim": self.dim,
+            "bytes": self.nbytes,
+            "ann": self.ann.stats() if self.ann is not None else None,
+            "ann_recall_at_1": self.ann_recall,
+        }
+
+    def as_float64(self):
+        """
+        Contiguous float64 copy of the live rows (only built when the C++ matcher is used).
+        The legacy loop knows nothing about tombstones, so they are left out entirely;
+        map a result back with float64_row().
+        """
+        if self._vectors_f64 is None:
+            live = np.flatnonzero(self.alive) if self.n_dead else None
+            rows = self.vectors if live is None else self.vectors[live]
+            self._vectors_f64 = np.ascontiguousarray(rows, dtype=np.float64)
+            self._f64_rows = live
+        return self._vectors_f64
+
+    def float64_row(self, i):
+        """Index row of row `i` of as_float64() (-1 stays -1)."""
+        if i < 0 or self._f64_rows is None:
+            return int(i)
+        return int(self._f64_rows[i])
+
+
+# ==========================================================
+# Immutable Index Snapshot (copy-on-write publishing)
+# ==========================================================
+# Everything a matching request reads lives in one frozen object; writers
+# build a new snapshot and publish it with a single reference assignment,
+# so readers never see new rows paired with old names or thresholds.
+
+
+@dataclass(frozen=True)
+class IndexSnapshot:
+    index: EmbeddingIndex = field(default_factory=EmbeddingIndex)
+    scopes: dict = field(default_factory=dict)   # {"dept:<name>": EmbeddingIndex, "roster": EmbeddingIndex}
+    roster_date: Optional[date] = None
+    version: int = 0
+
+    def evolve(self, **changes):
+        """New snapshot with `changes` applied and the version bumped."""
+        return replace(self, version=self.version + 1, **changes)
@@ -0,0 +1,124 @@
+import threading
+
+import cv2
+import numpy as np
+
+# ==========================================================
+# Face Crop Quality (pre-inference gate)
+# ==========================================================
+# Tiny, badly proportioned, dark, blown-out or blurry crops can never match,
+# yet they cost a full ArcFace forward — and, when the native engine finds
+# nothing, the much slower DeepFace + MTCNN fallback. check_crops() scores a
+# whole batch of crops with a few vectorised NumPy ops (every crop resized to
+# one NORM_SIZE grid, so brightness and Laplacian variance are computed for
+# the stacked batch at once and sharpness is independent of crop size) and
+# returns a machine-readable reason for each rejected crop.
+
+NORM_SIZE = 64
+
+# Checked in this order; the first failing check is the reported reason
+REASONS = ("undecodable", "too_small", "bad_aspect", "too_dark", "too_bright", "blurry")
+
+
+def sharpness_score(img, code=cv2.COLOR_RGB2GRAY):
+    """Laplacian variance of an image (RGB by default; pass code=None for grayscale)."""
+    gray = cv2.cvtColor(img, code) if code is not None and img.ndim == 3 else img
+    return cv2.Laplacian(gray, cv2.CV_64F).var()
+
+
+def _gray(item):
+    """Encoded bytes or a BGR/gray ndarray → uint8 grayscale (None if undecodable)."""
+    if isinstance(item, np.ndarray):
+        return cv2.cvtColor(item, cv2.COLOR_BGR2GRAY) if item.ndim == 3 else item
+    if not item:
+        return None
+    return cv2.imdecode(np.frombuffer(item, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+
+
+class QualityGate:
+    def __init__(self, min_side: int = 40, max_aspect: float = 2.0, min_brightness: float = 35.0,
+                 max_brightness: float = 230.0, min_sharpness: float = 15.0):
+        self.min_side = min_side
+        self.max_aspect = max_aspect          # max(w, h) / min(w, h)
+        self.min_brightness = min_brightness  # mean gray level, 0-255
+        self.max_brightness = max_brightness
+        self.min_sharpness = min_sharpness    # Laplacian variance on the NORM_SIZE grid
+
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._rejected = {reason: 0 for reason in REASONS}
+
+    def check_crops(self, crops):
+        """
+        → one dict per crop: {"ok": bool, "reason": str | None, "width", "height",
+        "brightness", "sharpness"}. Metrics are None when the crop never got that far.
+        """
+        grays = [_gray(crop) for crop in crops]
+        results = [
+            {"ok": False, "reason": None, "width": None, "height": None, "brightness": None, "sharpness": None}
+            for _ in crops
+        ]
+
+        scored = []
+        for i, gray in enumerate(grays):
+            if gray is None or gray.size == 0:
+                results[i]["reason"] = "undecodable"
+                continue
+            h, w = gray.shape[:2]
+            results[i].update(width=int(w), height=int(h))
+            if min(w, h) < self.min_side:
+                results[i]["reason"] = "too_small"
+            elif max(w, h) / min(w, h) > self.max_aspect:
+                results[i]["reason"] = "bad_aspect"
+            else:
+                scored.append(i)
+
+        if scored:
+            stack = np.stack([
+                cv2.resize(grays[i], (NORM_SIZE, NORM_SIZE), interpolation=cv2.INTER_AREA) for i in scored
+            ]).astype(np.float32)
+            brightness = stack.mean(axis=(1, 2))
+            # 4-neighbour Laplacian over the whole batch at once
+            lap = (stack[:, :-2, 1:-1] + stack[:, 2:, 1:-1] + stack[:, 1:-1, :-2] + stack[:, 1:-1, 2:]
+                   - 4.0 * stack[:, 1:-1, 1:-1])
+            sharpness = lap.var(axis=(1, 2))
+
+            for j, i in enumerate(scored):
+                b, s = float(brightness[j]), float(sharpness[j])
+                results[i].update(brightness=round(b, 1), sharpness=round(s, 1))
+                if b < self.min_brightness:
+                    results[i]["reason"] = "too_dark"
+                elif b > self.max_brightness:
+                    results[i]["reason"] = "too_bright"
+                elif s < self.min_sharpness:
+                    results[i]["reason"] = "blurry"
+                else:
+                    results[i]["ok"] = True
+
+        with self._lock:
+            self._checked += len(crops)
+            for r in results:
+                if r["reason"] is not None:
+                    self._rejected[r["reason"]] += 1
+        return results
+
+    def check(self, crop):
+        """Single-crop convenience wrapper around check_crops."""
+        return self.check_crops([crop])[0]
+
+    def stats(self):
+        with self._lock:
+            rejected = sum(self._rejected.values())
+            return {
+                "checked": self._checked,
+                "rejected": rejected,
+                "reject_ratio": round(rejected / self._checked, 4) if self._checked else 0.0,
+                "by_reason": dict(self._rejected),
+                "thresholds": {
+                    "min_side": self.min_side,
+                    "max_aspect": self.max_aspect,
+                    "min_brightness": self.min_brightness,
+                    "max_brightness": self.max_brightness,
+                    "min_sharpness": self.min_sharpness,
+                },
+            }
@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict
+
+# ==========================================================
+# Per-Kiosk Face Session Store (live preview tracking state)
+# ==========================================================
+# Each kiosk tracks the faces in front of its camera across preview frames
+# (pending name, confirm / unknown counters, last embedding). Sessions are
+# keyed by (kiosk id, track id), so two kiosks both sending "face_1" never
+# see each other's state, and a kiosk only ever scans its own few tracks.
+#
+# - Expiry: every touch slides a session's deadline by the same `ttl`, so
+#   recency order *is* expiry order. Sessions live in one OrderedDict in that
+#   order and expired ones are popped from the front — each session is
+#   expired at most once, O(1) amortised, no full scans.
+# - Bounded memory: at most `max_per_kiosk` tracks per kiosk and
+#   `max_sessions` overall; the least recently seen session is evicted first.
+
+
+class FaceSessionStore:
+    def __init__(self, ttl: float = 5.0, max_sessions: int = 4096, max_per_kiosk: int = 32):
+        self.ttl = float(ttl)
+        self.max_sessions = max(1, int(max_sessions))
+        self.max_per_kiosk = max(1, int(max_per_kiosk))
+
+        self._lock = threading.Lock()
+        self._deadlines = OrderedDict()  # (kiosk, track) → expires_at; oldest deadline first
+        self._kiosks = {}                # kiosk → OrderedDict(track → session dict), least recent first
+
+        self._created = 0
+        self._expired = 0
+        self._evicted = 0
+        self._cleared = 0
+
+    # -------- Internal (lock held) --------
+    def _drop(self, kiosk, track):
+        del self._deadlines[(kiosk, track)]
+        tracks = self._kiosks[kiosk]
+        del tracks[track]
+        if not tracks:
+            del self._kiosks[kiosk]
+
+    def _expire(self, now):
+        expired = 0
+        while self._deadlines:
+            key, expires_at = next(iter(self._deadlines.items()))
+            if expires_at > now:
+                break
+            self._drop(*key)
+            expired += 1
+        self._expired += expired
+        return expired
+
+    def _refresh(self, kiosk, track, now):
+        key = (kiosk, track)
+        self._deadlines[key] = now + self.ttl
+        self._deadlines.move_to_end(key)
+        self._kiosks[kiosk].move_to_end(track)
+
+    # -------- Sessions --------
+    def expire(self):
+        """Drop every expired session now → how many were dropped."""
+        with self._lock:
+            return self._expire(time.monotonic())
+
+    def sessions(self, kiosk):
+        """Live sessions of one kiosk → [(track, session dict)], least recently seen first."""
+        with self._lock:
+            self._expire(time.monotonic())
+            return list(self._kiosks.get(kiosk, {}).items())
+
+    def get(self, kiosk, track):
+        """Live session dict of one track, or None."""
+        with self._lock:
+            self._expire(time.monotonic())
+            return self._kiosks.get(kiosk, {}).get(track)
+
+    def touch(self, kiosk, track):
+        """Mark a track as seen again (slides its expiry); False if it is gone."""
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            if track not in self._kiosks.get(kiosk, {}):
+                return False
+            self._refresh(kiosk, track, now)
+            return True
+
+    def put(self, kiosk, track, session: dict):
+        """Create or replace a track's session (counts as seen now), evicting the stalest if full."""
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            tracks = self._kiosks.setdefault(kiosk, OrderedDict())
+            if track not in tracks:
+                self._created += 1
+            tracks[track] = session
+            self._refresh(kiosk, track, now)
+
+            while len(tracks) > self.max_per_kiosk:
+                self._drop(kiosk, next(iter(tracks)))
+                self._evicted += 1
+            while len(self._deadlines) > self.max_sessions:
+                self._drop(*next(iter(self._deadlines)))
+                self._evicted += 1
+
+    def clear_kiosk(self, kiosk):
+        """Forget every session of one kiosk (other kiosks untouched) → how many were dropped."""
+        with self._lock:
+            tracks = list(self._kiosks.get(kiosk, {}))
+            for track in tracks:
+                self._drop(kiosk, track)
+            self._cleared += len(tracks)
+            return len(tracks)
+
+    # -------- Metrics --------
+    def stats(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                "sessions": len(self._deadlines),
+                "kiosks": len(self._kiosks),
+                "ttl_s": self.ttl,
+                "max_sessions": self.max_sessions,
+                "max_per_kiosk": self.max_per_kiosk,
+                "created": self._created,
+                "expired": self._expired,
+                "evicted": self._evicted,
+                "cleared": self._cleared,
+            }
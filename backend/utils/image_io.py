@@ -0,0 +1,16 @@
+import cv2
+import numpy as np
+
+# ==========================================================
+# In-Memory Image Decoding (no temp files)
+# ==========================================================
+# Uploaded frames are decoded straight from the request bytes, so
+# recognition does no filesystem I/O per frame.
+
+
+def decode_image(data: bytes, flags=cv2.IMREAD_COLOR):
+    """Encoded image bytes (JPEG/PNG/...) → BGR ndarray, or None if undecodable."""
+    if not data:
+        return None
+    buf = np.frombuffer(data, dtype=np.uint8)
+    return cv2.imdecode(buf, flags)
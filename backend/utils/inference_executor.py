@@ -0,0 +1,193 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+# ==========================================================
+# Dedicated Inference Executor (bounded, prioritised)
+# ==========================================================
+# Face inference (DeepFace / native ArcFace / image decoding) runs on its own
+# worker threads, never on the event loop, so recognition load cannot stall
+# unrelated endpoints. Jobs wait in one bounded priority queue:
+#
+#   lane      priority  may fill
+#   mark      0         100% of the queue
+#   search    1          75%
+#   preview   2          50%
+#
+# so a flood of preview frames is shed before it can delay attendance marks.
+# Admission is decided up front: a full lane is rejected with 429, and a job
+# whose expected wait already exceeds `max_wait` (or that expired while queued)
+# gets 503 — the kiosk retries instead of hanging on a saturated server.
+# Threads, not processes: the native engine and TensorFlow release the GIL,
+# and workers share the loaded models and the in-memory index.
+
+PRIORITY_MARK = 0
+PRIORITY_SEARCH = 1
+PRIORITY_PREVIEW = 2
+
+LANES = {PRIORITY_MARK: "mark", PRIORITY_SEARCH: "search", PRIORITY_PREVIEW: "preview"}
+LANE_SHARE = {PRIORITY_MARK: 1.0, PRIORITY_SEARCH: 0.75, PRIORITY_PREVIEW: 0.5}
+
+
+class InferenceRejected(Exception):
+    """Raised at submit time (or when a queued job expires); mapped to an HTTP 429/503."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int = 1):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "future", "priority", "enqueued", "deadline")
+
+    def __init__(self, fn, args, kwargs, priority, max_wait):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.deadline = self.enqueued + max_wait
+
+
+class InferenceExecutor:
+    def __init__(self, workers: int, max_queue: int = 64, max_wait: float = 5.0, name: str = "inference"):
+        self.workers = max(1, int(workers))
+        self.max_queue = max(1, int(max_queue))
+        self.max_wait = float(max_wait)
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._heap = []                 # (priority, seq, job)
+        self._seq = itertools.count()   # FIFO within a lane
+        self._threads = []
+        self._closed = False
+
+        self._queued = {p: 0 for p in LANES}
+        self._in_flight = 0
+        self._counts = {
+            p: {"submitted": 0, "completed": 0, "failed": 0, "rejected_429": 0, "rejected_503": 0}
+            for p in LANES
+        }
+        self._avg_wait = 0.0   # EWMA seconds spent queued
+        self._avg_run = 0.0    # EWMA seconds per job
+
+    # -------- Lifecycle --------
+    def _ensure_started(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def shutdown(self):
+        """Stop accepting work; queued jobs fail with 503, running ones finish."""
+        with self._cond:
+            self._closed = True
+            pending, self._heap = self._heap, []
+            for p in LANES:
+                self._queued[p] = 0
+            self._cond.notify_all()
+        for _, _, job in pending:
+            job.future.set_exception(InferenceRejected(503, "inference executor shutting down"))
+
+    # -------- Admission --------
+    def _lane_limit(self, priority):
+        return max(1, int(self.max_queue * LANE_SHARE[priority]))
+
+    def _expected_wait(self, priority):
+        """Queued jobs that would run before this one, spread over the workers."""
+        ahead = sum(n for p, n in self._queued.items() if p <= priority) + self._in_flight
+        return ahead / self.workers * self._avg_run
+
+    def submit(self, fn, *args, priority: int = PRIORITY_PREVIEW, **kwargs) -> Future:
+        """Queue fn(*args, **kwargs); raises InferenceRejected instead of queueing when saturated."""
+        if priority not in LANES:
+            raise ValueError(f"Unknown inference priority {priority}")
+        job = _Job(fn, args, kwargs, priority, self.max_wait)
+        lane = self._counts[priority]
+
+        with self._cond:
+            if self._closed:
+                lane["rejected_503"] += 1
+                raise InferenceRejected(503, "inference executor shutting down")
+            if sum(self._queued.values()) >= self.max_queue or self._queued[priority] >= self._lane_limit(priority):
+                lane["rejected_429"] += 1
+                raise InferenceRejected(429, f"{LANES[priority]} queue full")
+            if self._expected_wait(priority) > self.max_wait:
+                lane["rejected_503"] += 1
+                raise InferenceRejected(503, "recognition overloaded", retry_after=max(1, int(self.max_wait)))
+
+            self._ensure_started()
+            heapq.heappush(self._heap, (priority, next(self._seq), job))
+            self._queued[priority] += 1
+            lane["submitted"] += 1
+            self._cond.notify()
+        return job.future
+
+    async def run(self, fn, *args, priority: int = PRIORITY_PREVIEW, **kwargs):
+        """Await fn(*args, **kwargs) on the executor (cancelling the await drops a still-queued job)."""
+        return await asyncio.wrap_future(self.submit(fn, *args, priority=priority, **kwargs))
+
+    # -------- Workers --------
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._heap:
+                    return
+                _, _, job = heapq.heappop(self._heap)
+                self._queued[job.priority] -= 1
+                self._in_flight += 1
+
+            started = time.monotonic()
+            outcome = self._execute(job, started)
+            finished = time.monotonic()
+
+            with self._cond:
+                self._in_flight -= 1
+                if outcome is not None:
+                    self._counts[job.priority][outcome] += 1
+                    self._avg_wait = 0.9 * self._avg_wait + 0.1 * (started - job.enqueued)
+                if outcome in ("completed", "failed"):
+                    self._avg_run = 0.9 * self._avg_run + 0.1 * (finished - started)
+
+    @staticmethod
+    def _execute(job, started):
+        """Run one dequeued job → counter to bump ("completed" / "failed" / "rejected_503"), None if cancelled."""
+        if not job.future.set_running_or_notify_cancel():
+            return None  # caller went away while queued
+        if started > job.deadline:
+            job.future.set_exception(InferenceRejected(503, "expired in inference queue"))
+            return "rejected_503"
+        try:
+            result = job.fn(*job.args, **job.kwargs)
+        except BaseException as e:
+            job.future.set_exception(e)
+            return "failed"
+        job.future.set_result(result)
+        return "completed"
+
+    # -------- Metrics --------
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "max_wait_s": self.max_wait,
+                "queue_depth": sum(self._queued.values()),
+                "in_flight": self._in_flight,
+                "avg_wait_ms": round(self._avg_wait * 1000, 2),
+                "avg_run_ms": round(self._avg_run * 1000, 2),
+                "lanes": {
+                    LANES[p]: dict(self._counts[p], queued=self._queued[p], limit=self._lane_limit(p))
+                    for p in LANES
+                },
+            }
@@ -0,0 +1,142 @@
+import asyncio
+import time
+
+from utils.inference_executor import InferenceRejected
+
+# ==========================================================
+# Micro-Batching Scheduler (coalesce concurrent requests)
+# ==========================================================
+# Requests that arrive within `max_wait_ms` of each other (or until
+# `max_batch` are waiting) are handed to `run_batch` together as one job on
+# the inference executor — one batched embedding forward + one matrix match
+# instead of N single-face passes. Results are fanned back to each waiting
+# request in order.
+#
+# At most `max_in_flight` batches of this lane are on the executor at once.
+# While they run, later arrivals keep collecting (timers do not flush them),
+# and the moment a batch completes everything waiting goes out as the next
+# batch — so batches grow with load, and stay at 1 when the server is idle
+# (at most `max_wait_ms` of added latency).
+#
+# Lives on the event loop: submit() must be awaited from request handlers.
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, executor, priority: int, max_batch: int = 16, max_wait_ms: float = 5.0,
+                 max_in_flight: int = 1, name: str = "batch"):
+        self.run_batch = run_batch      # list[item] → list[result] (same order), blocking
+        self.executor = executor
+        self.priority = priority
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.name = name
+
+        self._pending = []              # [(item, asyncio.Future)]
+        self._timer = None
+        self._in_flight = 0             # batches of this lane on the executor
+
+        self._batches = 0
+        self._items = 0
+        self._largest = 0
+        self._flushed = {"full": 0, "timeout": 0, "drain": 0}
+        self._rejected = 0
+        self._avg_batch_ms = 0.0        # EWMA of run_batch time
+
+    async def submit(self, item):
+        """Queue one item for the next batch and wait for its result."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        self._schedule()
+        return await future
+
+    # -------- Scheduling (event loop thread) --------
+    def _schedule(self):
+        """Flush a full batch, or arm the wait timer — unless the lane is busy (drained on completion)."""
+        if not self._pending or self._in_flight >= self.max_in_flight:
+            return
+        if len(self._pending) >= self.max_batch:
+            self._flush("full")
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        if self._in_flight < self.max_in_flight:
+            self._flush("timeout")
+
+    def _flush(self, reason):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending = [(item, fut) for item, fut in self._pending if not fut.done()]  # drop disconnected callers
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        if not batch:
+            return
+
+        try:
+            done = self.executor.submit(self._timed_run, [item for item, _ in batch], priority=self.priority)
+        except InferenceRejected as e:
+            self._rejected += len(batch)
+            for _, fut in batch:
+                fut.set_exception(e)
+            self._schedule()
+            return
+
+        self._in_flight += 1
+        self._batches += 1
+        self._items += len(batch)
+        self._largest = max(self._largest, len(batch))
+        self._flushed[reason] += 1
+
+        loop = asyncio.get_running_loop()
+        done.add_done_callback(lambda f: loop.call_soon_threadsafe(self._fan_out, batch, f))
+        self._schedule()  # leftovers beyond max_batch, if a slot is still free
+
+    def _fan_out(self, batch, done):
+        self._in_flight -= 1
+        if self._pending:
+            self._flush("drain")  # everything that queued up while this batch ran
+        if done.cancelled():
+            for _, fut in batch:
+                fut.cancel()
+            return
+        error = done.exception()
+        results = done.result() if error is None else None
+        for i, (_, fut) in enumerate(batch):
+            if fut.done():
+                continue
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(results[i])
+
+    # -------- Execution (inference worker thread) --------
+    def _timed_run(self, items):
+        t0 = time.perf_counter()
+        try:
+            results = self.run_batch(items)
+        finally:
+            self._avg_batch_ms = 0.9 * self._avg_batch_ms + 0.1 * (time.perf_counter() - t0) * 1000
+        if len(results) != len(items):
+            raise RuntimeError(f"{self.name}: run_batch returned {len(results)} results for {len(items)} items")
+        return results
+
+    # -------- Metrics --------
+    def stats(self):
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+            "max_in_flight": self.max_in_flight,
+            "batches": self._batches,
+            "items": self._items,
+            "avg_batch_size": round(self._items / self._batches, 2) if self._batches else 0.0,
+            "largest_batch": self._largest,
+            "flushed_full": self._flushed["full"],
+            "flushed_timeout": self._flushed["timeout"],
+            "flushed_drain": self._flushed["drain"],
+            "in_flight": self._in_flight,
+            "rejected_items": self._rejected,
+            "waiting": len(self._pending),
+            "avg_batch_ms": round(self._avg_batch_ms, 2),
+        }
@@ -0,0 +1,158 @@
+import json
+import mmap
+import os
+import struct
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl  # POSIX only — Windows runs a single worker, so the lock is a no-op there
+except ImportError:
+    fcntl = None
+
+# ==========================================================
+# Shared Memory-Mapped Embedding Index (multi-worker)
+# ==========================================================
+# One process writes the normalized rows into a single file (ideally on
+# /dev/shm); every worker maps it read-only, so N workers share one copy
+# of the vectors. Writers replace the file atomically (write temp + rename),
+# which lets readers detect a new version by inode/mtime and re-map.
+#
+# Layout (little-endian, sections 64-byte aligned):
+#   header   magic, version, n_rows, dim, meta_bytes, built_at
+#   vectors  float32 [n_rows, dim]
+#   user_ids int64   [n_rows]
+#   thresh   float32 [n_rows]
+#   meta     UTF-8 JSON (row names, department row ranges, builder group)
+
+MAGIC = b"FTIDX001"
+HEADER = struct.Struct("<8sQQQQd")
+ALIGN = 64
+
+
+def _aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _sections(n_rows, dim):
+    vec_off = _aligned(HEADER.size)
+    ids_off = _aligned(vec_off + n_rows * dim * 4)
+    thr_off = _aligned(ids_off + n_rows * 8)
+    meta_off = _aligned(thr_off + n_rows * 4)
+    return vec_off, ids_off, thr_off, meta_off
+
+
+class SharedIndexFile:
+    """Versioned, memory-mapped index file shared by every worker on the box."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.alive_path = path + ".alive"
+        self._alive_fh = None  # shared liveness flock, held for the life of the process
+
+    def join(self):
+        """
+        Register this process as a live user of the file (shared flock held until exit).
+        The first process to join while nobody else holds the lock removes any file left
+        behind by a previous run — its group id can be reused (e.g. same parent shell),
+        so it must never be attached. Returns True if a stale file was discarded.
+        """
+        if fcntl is None or self._alive_fh is not None:
+            return False
+        fh = open(self.alive_path, "a+")
+        discarded = False
+        try:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            pass  # other workers of a live server hold it: the file is current
+        else:
+            try:
+                os.remove(self.path)
+                discarded = True
+            except FileNotFoundError:
+                pass
+        fcntl.flock(fh.fileno(), fcntl.LOCK_SH)  # downgrade (or wait for the first worker to finish)
+        self._alive_fh = fh
+        return discarded
+
+    @contextmanager
+    def locked(self):
+        """Exclusive cross-process writer lock (flock on a side file)."""
+        with open(self.lock_path, "a+") as fh:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+    def signature(self):
+        """(inode, mtime_ns) of the current file, or None — changes on every publish."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def version(self):
+        try:
+            with open(self.path, "rb") as fh:
+                magic, version, *_ = HEADER.unpack(fh.read(HEADER.size))
+            return version if magic == MAGIC else 0
+        except (FileNotFoundError, struct.error):
+            return 0
+
+    def write(self, vectors, user_ids, thresholds, meta):
+        """Write a new version (call while holding `locked()`); returns the version number."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n_rows = vectors.shape[0]
+        dim = vectors.shape[1] if n_rows else 0
+        version = self.version() + 1
+        meta_bytes = json.dumps(meta).encode("utf-8")
+        vec_off, ids_off, thr_off, meta_off = _sections(n_rows, dim)
+
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(HEADER.pack(MAGIC, version, n_rows, dim, len(meta_bytes), time.time()))
+            for offset, payload in (
+                (vec_off, vectors.tobytes()),
+                (ids_off, np.ascontiguousarray(user_ids, dtype=np.int64).tobytes()),
+                (thr_off, np.ascontiguousarray(thresholds, dtype=np.float32).tobytes()),
+                (meta_off, meta_bytes),
+            ):
+                fh.seek(offset)
+                fh.write(payload)
+        os.replace(tmp, self.path)  # atomic: readers see the old or the new file, never half of one
+        return version
+
+    def read(self):
+        """
+        Map the current file read-only → dict with zero-copy numpy views, or None if absent.
+        The views keep the mapping alive, so a replaced file stays valid until they are dropped.
+        """
+        signature = self.signature()
+        try:
+            with open(self.path, "rb") as fh:
+                mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        magic, version, n_rows, dim, meta_len, built_at = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a FaceTrack index file")
+        vec_off, ids_off, thr_off, meta_off = _sections(n_rows, dim)
+
+        return {
+            "version": version,
+            "signature": signature,
+            "built_at": built_at,
+            "vectors": np.frombuffer(mapped, np.float32, n_rows * dim, vec_off).reshape(n_rows, dim),
+            "user_ids": np.frombuffer(mapped, np.int64, n_rows, ids_off),
+            "thresholds": np.frombuffer(mapped, np.float32, n_rows, thr_off),
+            "meta": json.loads(bytes(mapped[meta_off:meta_off + meta_len]).decode("utf-8")),
+            "nbytes": len(mapped),
+        }
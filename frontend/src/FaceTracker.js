@@ -4,6 +4,7 @@ import { getGlobalDetector } from "./hooks/globalDetector";
 import { strictMatch } from "./hooks/cosineMatcher"; // use your safe matcher
 import { useEmbeddingsCache } from "./hooks/useEmbeddingsCache";
 import { API_BASE } from "./config";
+import { getKioskId } from "./hooks/kioskId";
 
 
 // --- Estimate distance from face box width (approx) ---
@@ -463,6 +464,7 @@ const facePromises = detections.map(async (det, i) => {
   const formData = new FormData();
   formData.append("file", blob);
   formData.append("face_index", i);
+  formData.append("kiosk_id", getKioskId());
 
   try {
     const res = await fetch(`${API_BASE}/attendance/preview`, {
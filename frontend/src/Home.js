@@ -15,6 +15,7 @@ import { useNavigate } from "react-router-dom";
 import Footer from "./Footer";
 import HeaderDateTime from "./HeaderDateTime";
 import { API_BASE } from "./config";
+import { getKioskId } from "./hooks/kioskId";
 import FaceTracker from "./FaceTracker";
 import { useEmbeddingsCache } from "./hooks/useEmbeddingsCache";
 import { strictMatch } from "./hooks/cosineMatcher";
@@ -185,6 +186,7 @@ const captureAndSendFrame = useCallback(
     const blob = await (await fetch(imageSrc)).blob();
     const formData = new FormData();
     formData.append("file", blob, "frame.jpg");
+    formData.append("kiosk_id", getKioskId());
 
     // Use proper action mapping
     if (action === "work-application") {
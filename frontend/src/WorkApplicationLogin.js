@@ -8,6 +8,7 @@ import { useNavigate } from "react-router-dom";
 import Footer from "./Footer";
 import HeaderDateTime from "./HeaderDateTime";
 import { API_BASE } from "./config";
+import { getKioskId } from "./hooks/kioskId";
 import FaceTracker from "./FaceTracker";
 
 function WorkApplicationLogin() {
@@ -70,6 +71,7 @@ if (trimmedId !== trimmedId.toUpperCase()) {
     formData.append("file", blob, "frame.jpg");
     formData.append("action", "work-application");
     formData.append("employee_id", employeeId.trim().toUpperCase());
+    formData.append("kiosk_id", getKioskId());
 
     const response = await fetch(`${API_BASE}/attendance/mark`, {
       method: "POST",
@@ -142,6 +144,7 @@ useEffect(() => {
 // ✅ Always send employee_id (even if blank)
 const trimmedId = (employeeId || "").trim().toUpperCase();
 formData.append("employee_id", trimmedId);
+formData.append("kiosk_id", getKioskId());
 console.log("🧾 Sending employee_id to backend:", trimmedId || "(empty)");
 
       // ✅ Send preview frame to backend
@@ -223,6 +226,7 @@ const handleInstantLogin = async () => {
     employee_id: trimmedId,
     face_name: face.name,
     confidence: face.confidence,
+    kiosk_id: getKioskId(),
   };
 
   try {
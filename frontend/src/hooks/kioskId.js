@@ -0,0 +1,32 @@
+// src/hooks/kioskId.js
+
+const STORAGE_KEY = "facetrackKioskId";
+let cachedId = null;
+
+/**
+ * Stable id of this kiosk (browser profile), sent as `kiosk_id` with preview/mark.
+ * Generated once and kept in localStorage, so kiosks behind the same proxy/NAT
+ * never share live-preview sessions on the backend.
+ */
+export function getKioskId() {
+  if (cachedId) return cachedId;
+
+  try {
+    cachedId = localStorage.getItem(STORAGE_KEY);
+  } catch (e) {
+    cachedId = null; // storage blocked (private mode) → per-tab id below
+  }
+
+  if (!cachedId) {
+    cachedId =
+      window.crypto && window.crypto.randomUUID
+        ? window.crypto.randomUUID()
+        : `kiosk-${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+    try {
+      localStorage.setItem(STORAGE_KEY, cachedId);
+    } catch (e) {
+      console.warn("⚠️ Kiosk id not persisted (localStorage unavailable)");
+    }
+  }
+  return cachedId;
+}
@@ -0,0 +1,201 @@
+"""
+ArcFace inference throughput vs batch size (native engine, CPU or whatever backend it picks).
+
+Feeds synthetic encoded face crops through `embed_batch` in batches of 1, 2, 4, ... and
+reports per-batch latency and faces/second as JSON, alongside the per-face
+`detect_and_embed_buffer` path for reference. Needs the built libface_engine and
+backend/cpp/models/arcface_r100.onnx (the engine loads it relative to backend/).
+
+--raw also times embed_bgr_batch on the same crops as pre-aligned 112x112 raw pixels
+(the application/octet-stream upload, utils/crop_wire.py) — no JPEG decode, no resize —
+and reports the upload size of both formats.
+
+--backends also runs the Python embedding backends (utils/embedding_backends.py:
+onnx, deepface) over the same crops, to compare CPU paths on this machine.
+
+Usage (from the repo root):
+    python loadtests/embed_benchmark.py --batch-sizes 1,2,4,8,16,32 --faces 256
+    python loadtests/embed_benchmark.py --raw --batch-sizes 1,4,16 --faces 128
+    python loadtests/embed_benchmark.py --backends onnx,deepface --onnx-threads 4 --faces 64
+"""
+import argparse
+import ctypes
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+LIB_NAMES = ["libface_engine.dylib", "libface_engine.so", "face_engine.so", "face_engine.dll"]
+
+
+def load_engine(path=None, required=True):
+    candidates = [path] if path else [os.path.join(BACKEND_DIR, "cpp", "build", n) for n in LIB_NAMES]
+    for candidate in candidates:
+        if candidate and os.path.exists(candidate):
+            lib = ctypes.CDLL(os.path.abspath(candidate))
+            if not hasattr(lib, "embed_batch"):
+                sys.exit(f"❌ {candidate} has no embed_batch — rebuild backend/cpp")
+            lib.embedding_dim.restype = ctypes.c_int
+            lib.embed_batch.restype = ctypes.c_int
+            lib.embed_batch.argtypes = [
+                ctypes.POINTER(ctypes.c_char_p), ctypes.POINTER(ctypes.c_size_t), ctypes.c_int,
+                ctypes.POINTER(ctypes.c_float), ctypes.POINTER(ctypes.c_int),
+            ]
+            lib.detect_and_embed_buffer.restype = ctypes.c_char_p
+            lib.detect_and_embed_buffer.argtypes = [ctypes.c_char_p, ctypes.c_size_t]
+            if hasattr(lib, "embed_bgr_batch"):
+                lib.embed_bgr_batch.restype = ctypes.c_int
+                lib.embed_bgr_batch.argtypes = [
+                    ctypes.POINTER(ctypes.c_uint8), ctypes.c_int, ctypes.c_int, ctypes.c_int,
+                    ctypes.POINTER(ctypes.c_float), ctypes.POINTER(ctypes.c_int),
+                ]
+            return lib
+    if required:
+        sys.exit("❌ libface_engine not found — build backend/cpp or pass --lib")
+    return None
+
+
+def make_crops(n, size=160, seed=0):
+    """Synthetic JPEG crops (smooth noise, roughly face-sized) — content does not affect speed."""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    crops = []
+    for _ in range(n):
+        img = cv2.GaussianBlur(rng.integers(0, 256, (size, size, 3), dtype=np.uint8), (9, 9), 0)
+        ok, buf = cv2.imencode(".jpg", img)
+        crops.append(buf.tobytes())
+    return crops
+
+
+def embed(lib, crops):
+    n = len(crops)
+    out = np.zeros((n, lib.embedding_dim()), dtype=np.float32)
+    ok = np.zeros(n, dtype=np.int32)
+    lib.embed_batch(
+        (ctypes.c_char_p * n)(*crops), (ctypes.c_size_t * n)(*[len(c) for c in crops]), n,
+        out.ctypes.data_as(ctypes.POINTER(ctypes.c_float)), ok.ctypes.data_as(ctypes.POINTER(ctypes.c_int)),
+    )
+    return out, ok
+
+
+def embed_raw(lib, pixels):
+    """pixels: contiguous uint8 [N, 112, 112, 3] BGR → (embeddings, ok)."""
+    n, rows, cols = pixels.shape[:3]
+    out = np.zeros((n, lib.embedding_dim()), dtype=np.float32)
+    ok = np.zeros(n, dtype=np.int32)
+    lib.embed_bgr_batch(
+        pixels.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8)), n, rows, cols,
+        out.ctypes.data_as(ctypes.POINTER(ctypes.c_float)), ok.ctypes.data_as(ctypes.POINTER(ctypes.c_int)),
+    )
+    return out, ok
+
+
+def raw_crops(crops):
+    """Decode + resize the JPEG crops once, as the kiosk would before a raw-crop upload."""
+    import cv2
+
+    faces = [cv2.resize(cv2.imdecode(np.frombuffer(c, np.uint8), cv2.IMREAD_COLOR), (112, 112)) for c in crops]
+    return np.ascontiguousarray(np.stack(faces))
+
+
+def bench_batches(lib, crops, batch, warmup=2, run=embed):
+    for _ in range(warmup):
+        run(lib, crops[:batch])
+    latencies = []
+    for start in range(0, len(crops) - batch + 1, batch):
+        t0 = time.perf_counter()
+        run(lib, crops[start:start + batch])
+        latencies.append((time.perf_counter() - t0) * 1000)
+    lat = np.array(latencies)
+    return {
+        "batch": batch,
+        "batches": len(lat),
+        "p50_batch_ms": round(float(np.percentile(lat, 50)), 3),
+        "p99_batch_ms": round(float(np.percentile(lat, 99)), 3),
+        "faces_per_s": round(float(batch * len(lat) / (lat.sum() / 1000.0)), 1),
+    }
+
+
+def bench_backend(name, crops, batch, args):
+    """Time one utils.embedding_backends backend over the crops in batches of `batch`."""
+    sys.path.insert(0, BACKEND_DIR)
+    from utils.embedding_backends import OnnxBackend, DeepFaceBackend
+
+    try:
+        if name == "onnx":
+            backend = OnnxBackend(args.onnx_model, args.onnx_threads)
+        elif name == "deepface":
+            backend = DeepFaceBackend("mtcnn")
+        else:
+            return {"skipped": f"unknown backend '{name}'"}
+        backend.embed(crops[:1])  # warm-up (model construction)
+    except Exception as e:
+        return {"skipped": str(e)}
+
+    backend.reset_stats()
+    for start in range(0, len(crops) - batch + 1, batch):
+        backend.embed(crops[start:start + batch])
+    return dict(backend.stats(), batch=batch)
+
+
+def bench_single(lib, crops):
+    lib.detect_and_embed_buffer(crops[0], len(crops[0]))  # warm-up (model load)
+    t0 = time.perf_counter()
+    for crop in crops:
+        lib.detect_and_embed_buffer(crop, len(crop))
+    elapsed = time.perf_counter() - t0
+    return {"faces_per_s": round(len(crops) / elapsed, 1), "ms_per_face": round(elapsed * 1000 / len(crops), 3)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16,32")
+    parser.add_argument("--faces", type=int, default=256, help="crops per batch size")
+    parser.add_argument("--crop-size", type=int, default=160)
+    parser.add_argument("--lib", default=None)
+    parser.add_argument("--raw", action="store_true", help="also time raw 112x112 crops (embed_bgr_batch)")
+    parser.add_argument("--backends", default="", help="also time Python backends, e.g. onnx,deepface")
+    parser.add_argument("--backend-batch", type=int, default=8)
+    parser.add_argument("--onnx-model", default=os.path.join(BACKEND_DIR, "models", "arcface.onnx"))
+    parser.add_argument("--onnx-threads", type=int, default=0, help="intra-op threads (0 = ORT default)")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    lib = load_engine(args.lib, required=not backends)
+    out_path = os.path.abspath(args.out) if args.out else None
+    args.onnx_model = os.path.abspath(args.onnx_model)  # before chdir
+    os.chdir(BACKEND_DIR)  # the engine resolves cpp/models/... relative to backend/
+    crops = make_crops(args.faces, args.crop_size)
+
+    report = {
+        "machine": {"platform": platform.platform(), "cpus": os.cpu_count()},
+        "faces": args.faces,
+    }
+    if lib is not None:
+        report["per_face_json_path"] = bench_single(lib, crops)
+        report["embed_batch"] = [bench_batches(lib, crops, int(b)) for b in args.batch_sizes.split(",") if b.strip()]
+    if lib is not None and args.raw:
+        if not hasattr(lib, "embed_bgr_batch"):
+            sys.exit("❌ libface_engine has no embed_bgr_batch — rebuild backend/cpp")
+        pixels = raw_crops(crops)
+        report["upload_bytes_per_face"] = {
+            "jpeg": round(sum(len(c) for c in crops) / len(crops)),
+            "raw": int(pixels[0].nbytes),
+        }
+        report["embed_bgr_batch"] = [
+            bench_batches(lib, pixels, int(b), run=embed_raw) for b in args.batch_sizes.split(",") if b.strip()
+        ]
+    if backends:
+        report["backends"] = {name: bench_backend(name, crops, args.backend_batch, args) for name in backends}
+
+    text = json.dumps(report, indent=2)
+    if out_path:
+        with open(out_path, "w") as fh:
+            fh.write(text)
+    print(text)
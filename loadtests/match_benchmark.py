@@ -0,0 +1,304 @@
+"""
+Embedding-matching benchmark across every matching backend, on synthetic identity sets.
+
+Backends (each timed per single probe; *_batch backends time whole frames of probes):
+    numpy         float32 BLAS scan (EmbeddingIndex.best)            — the reference
+    numpy_batch   one GEMM per frame (EmbeddingIndex.best_many)
+    ctypes        legacy C++ best_match over float64 rows (no per-user thresholds)
+    native        C++ SIMD best_match_f32
+    native_batch  C++ SIMD best_match_many (OpenMP shards)
+    ivf           IVF approximate index (IVFIndex)
+    int8          int8 shortlist + exact float32 re-rank (Int8Index)
+
+Reports p50/p99 latency, throughput, memory and top-1 identity agreement with the
+reference as JSON. Native backends need the built libface_engine (see backend/cpp).
+
+Usage (from the repo root):
+    python loadtests/match_benchmark.py --sizes 1000,10000,100000 --rows-per-identity 2
+    python loadtests/match_benchmark.py --sizes 1000000 --backends numpy,ivf,int8 --out bench.json
+
+A 1M-identity run with 2 rows/identity at 512-d needs ~4 GB for the float32 rows alone
+(the float64 ctypes copy doubles that, so it is skipped above --max-legacy-rows).
+"""
+import argparse
+import ctypes
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+# Make backend/utils importable without starting the API
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+from utils.face_index import EmbeddingIndex, normalize_rows  # noqa: E402
+from utils.ann_index import IVFIndex  # noqa: E402
+
+ALL_BACKENDS = ["numpy", "numpy_batch", "ctypes", "native", "native_batch", "ivf", "int8"]
+LIB_NAMES = ["libface_engine.dylib", "libface_engine.so", "face_engine.so", "face_engine.dll"]
+
+
+# -------- Int8 candidate (benchmark only) --------
+class Int8Index:
+    """
+    Per-dimension int8 codes shortlist `rerank` rows, re-scored with the exact float32 rows.
+    Evaluated here rather than served: re-ranking needs the float32 matrix resident, so
+    the codes only add memory, and the widening pass is no faster than the BLAS scan.
+    """
+
+    def __init__(self, vectors, offsets=None, rerank=32, chunk=256):
+        scale = np.abs(vectors).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        self.scale = scale.astype(np.float32)
+        self.codes = np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+        self.exact = vectors
+        self.offsets = offsets
+        self.rerank = max(1, rerank)
+        self.chunk = chunk
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scale.nbytes
+
+    def search(self, probe):
+        scaled = probe * self.scale  # fold the per-dim scale into the probe
+        approx = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), self.chunk):
+            approx[start:start + self.chunk] = self.codes[start:start + self.chunk].astype(np.float32) @ scaled
+        ranks = approx - self.offsets if self.offsets is not None else approx
+        keep = min(self.rerank, len(self.codes))
+        shortlist = np.argpartition(-ranks, keep - 1)[:keep]
+
+        exact = self.exact[shortlist] @ probe
+        exact_ranks = exact - self.offsets[shortlist] if self.offsets is not None else exact
+        i = int(np.argmax(exact_ranks))
+        return int(shortlist[i]), float(exact[i])
+
+
+# -------- Synthetic identities --------
+def make_dataset(n_identities, rows_per_identity, dim=512, noise=0.5, n_queries=500, seed=0, chunk=65536):
+    """
+    Unit-norm identity centres with several noisy rows each, plus noisy probe queries.
+    Generated chunk by chunk in float32 so 1M identities never materialise float64 temporaries.
+    """
+    rng = np.random.default_rng(seed)
+    sigma = np.float32(noise / np.sqrt(dim))
+    rows = np.empty((n_identities * rows_per_identity, dim), dtype=np.float32)
+
+    for start in range(0, n_identities, chunk):
+        count = min(chunk, n_identities - start)
+        centres = normalize_rows(rng.standard_normal((count, dim), dtype=np.float32))
+        block = np.repeat(centres, rows_per_identity, axis=0)
+        block += rng.standard_normal(block.shape, dtype=np.float32) * sigma
+        rows[start * rows_per_identity:(start + count) * rows_per_identity] = normalize_rows(block)
+
+    user_ids = np.repeat(np.arange(n_identities, dtype=np.int64), rows_per_identity)
+    thresholds = rng.choice([0.36, 0.38, 0.40, 0.42], size=len(rows)).astype(np.float32)
+
+    # A query is a stored row plus fresh noise (a new capture of an enrolled face)
+    picks = rng.integers(0, len(rows), n_queries)
+    queries = normalize_rows(rows[picks] + rng.standard_normal((n_queries, dim), dtype=np.float32) * sigma)
+    return rows, user_ids, thresholds, queries
+
+
+# -------- Native library --------
+def load_native(path=None):
+    """Load libface_engine (explicit path or backend/cpp/build) → CDLL or None."""
+    candidates = [path] if path else [os.path.join(BACKEND_DIR, "cpp", "build", n) for n in LIB_NAMES]
+    for candidate in candidates:
+        if candidate and os.path.exists(candidate):
+            try:
+                lib = ctypes.CDLL(os.path.abspath(candidate))
+            except OSError as e:
+                print(f"⚠️ Could not load {candidate}: {e}", file=sys.stderr)
+                continue
+            dptr, fptr, iptr = ctypes.POINTER(ctypes.c_double), ctypes.POINTER(ctypes.c_float), ctypes.POINTER(ctypes.c_int)
+            lib.best_match.restype = ctypes.c_int
+            lib.best_match.argtypes = [dptr, dptr, ctypes.c_int, ctypes.c_int, dptr]
+            if hasattr(lib, "best_match_many"):
+                lib.best_match_f32.restype = ctypes.c_int
+                lib.best_match_f32.argtypes = [fptr, fptr, ctypes.c_int, ctypes.c_int, fptr, fptr]
+                lib.best_match_many.restype = None
+                lib.best_match_many.argtypes = [fptr, ctypes.c_int, fptr, ctypes.c_int, ctypes.c_int, fptr, iptr, fptr]
+                lib.simd_level_name.restype = ctypes.c_char_p
+            return lib
+    return None
+
+
+# -------- Backend factories: each returns (search(probe) | search_many(probes), bytes) --------
+def build_backend(name, index, lib, args):
+    fptr = ctypes.POINTER(ctypes.c_float)
+
+    if name == "numpy":
+        return index.best, index.nbytes
+    if name == "numpy_batch":
+        return index.best_many, index.nbytes
+
+    if name == "ctypes":
+        if lib is None:
+            raise RuntimeError("libface_engine not found")
+        if len(index) > args.max_legacy_rows:
+            raise RuntimeError(f"skipped above --max-legacy-rows={args.max_legacy_rows}")
+        rows64 = index.as_float64()
+        dptr = ctypes.POINTER(ctypes.c_double)
+        all_ptr = rows64.ctypes.data_as(dptr)
+
+        def search(probe):
+            emb = np.ascontiguousarray(probe, dtype=np.float64)
+            score = ctypes.c_double()
+            row = lib.best_match(emb.ctypes.data_as(dptr), all_ptr, rows64.shape[0], rows64.shape[1], ctypes.byref(score))
+            return row, score.value
+        return search, rows64.nbytes
+
+    if name in ("native", "native_batch"):
+        if lib is None or not hasattr(lib, "best_match_many"):
+            raise RuntimeError("libface_engine without SIMD kernels")
+        vec_ptr = index.vectors.ctypes.data_as(fptr)
+        thr_ptr = index.thresholds.ctypes.data_as(fptr)
+
+        if name == "native":
+            def search(probe):
+                probe = np.ascontiguousarray(probe, dtype=np.float32)
+                score = ctypes.c_float()
+                row = lib.best_match_f32(probe.ctypes.data_as(fptr), vec_ptr, len(index), index.dim, thr_ptr, ctypes.byref(score))
+                return row, score.value
+            return search, index.nbytes
+
+        def search_many(probes):
+            probes = np.ascontiguousarray(probes, dtype=np.float32)
+            rows = np.empty(len(probes), dtype=np.int32)
+            scores = np.empty(len(probes), dtype=np.float32)
+            lib.best_match_many(
+                probes.ctypes.data_as(fptr), len(probes), vec_ptr, len(index), index.dim, thr_ptr,
+                rows.ctypes.data_as(ctypes.POINTER(ctypes.c_int)), scores.ctypes.data_as(fptr),
+            )
+            return rows, scores
+        return search_many, index.nbytes
+
+    if name == "ivf":
+        ivf = IVFIndex.build(index.vectors, n_probe=args.nprobe)
+        ivf.offsets = index.thresholds
+        return ivf.search, ivf.nbytes
+
+    if name == "int8":
+        int8 = Int8Index(index.vectors, offsets=index.thresholds, rerank=args.rerank)
+        return int8.search, int8.nbytes + index.nbytes  # codes + the exact rows kept for re-ranking
+
+    raise ValueError(f"Unknown backend '{name}'")
+
+
+# -------- Timing helpers --------
+def summarise(latencies_ms, n_queries):
+    lat = np.asarray(latencies_ms)
+    return {
+        "p50_ms": round(float(np.percentile(lat, 50)), 4),
+        "p99_ms": round(float(np.percentile(lat, 99)), 4),
+        "qps": round(float(n_queries / (lat.sum() / 1000.0)), 1),
+    }
+
+
+def time_queries(search, queries):
+    latencies, rows = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        row, _ = search(q)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        rows.append(row)
+    return np.array(rows), summarise(latencies, len(queries))
+
+
+def time_batches(search_many, queries, batch):
+    """Latency per frame of `batch` probes; qps counts individual probes."""
+    latencies, rows = [], []
+    for start in range(0, len(queries), batch):
+        t0 = time.perf_counter()
+        frame_rows, _ = search_many(queries[start:start + batch])
+        latencies.append((time.perf_counter() - t0) * 1000)
+        rows.extend(np.asarray(frame_rows).tolist())
+    return np.array(rows), dict(summarise(latencies, len(queries)), batch=batch)
+
+
+def run(n_identities, args, lib):
+    rows, user_ids, thresholds, queries = make_dataset(
+        n_identities, args.rows_per_identity, dim=args.dim, n_queries=args.queries, seed=args.seed
+    )
+    index = EmbeddingIndex(rows, user_ids, [str(u) for u in user_ids], thresholds, normalized=True, copy=False)
+
+    # Reference identities: exact scan with per-user thresholds (and without, for the legacy loop)
+    sims = queries @ index.vectors.T
+    reference = user_ids[np.argmax(sims - index.thresholds, axis=1)]
+    reference_raw = user_ids[np.argmax(sims, axis=1)]
+    del sims
+
+    report = {"identities": n_identities, "rows": len(rows), "dim": args.dim, "backends": {}}
+    for name in args.backends:
+        try:
+            t0 = time.perf_counter()
+            search, nbytes = build_backend(name, index, lib, args)
+            build_s = time.perf_counter() - t0
+        except RuntimeError as e:
+            report["backends"][name] = {"skipped": str(e)}
+            continue
+
+        if name.endswith("_batch"):
+            found, timing = time_batches(search, queries, args.batch)
+        else:
+            found, timing = time_queries(search, queries)
+
+        expected = reference_raw if name == "ctypes" else reference
+        valid = found >= 0
+        agreement = np.zeros(len(found), dtype=bool)
+        agreement[valid] = user_ids[found[valid]] == expected[valid]
+        report["backends"][name] = {
+            "bytes": int(nbytes),
+            "build_s": round(build_s, 3),
+            **timing,
+            "top1_agreement": round(float(agreement.mean()), 4),
+        }
+        print(f"  {n_identities:>8} ids  {name:<13} p50={timing['p50_ms']:.3f}ms qps={timing['qps']}", file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated identity counts")
+    parser.add_argument("--rows-per-identity", type=int, default=2)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=8, help="probes per frame for *_batch backends")
+    parser.add_argument("--backends", default=",".join(ALL_BACKENDS))
+    parser.add_argument("--rerank", type=int, default=32)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--max-legacy-rows", type=int, default=200000)
+    parser.add_argument("--lib", default=None, help="path to libface_engine (default: backend/cpp/build)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="also write the JSON report to this file")
+    args = parser.parse_args()
+    args.backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+
+    lib = load_native(args.lib)
+    report = {
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "cpus": os.cpu_count(),
+            "native_simd": lib.simd_level_name().decode() if lib is not None and hasattr(lib, "simd_level_name") else None,
+        },
+        "config": {
+            "rows_per_identity": args.rows_per_identity,
+            "queries": args.queries,
+            "rerank": args.rerank,
+            "nprobe": args.nprobe,
+        },
+        "results": [run(int(n), args, lib) for n in args.sizes.split(",") if n.strip()],
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as fh:
+            fh.write(text)
+    print(text)